@@ -2,71 +2,61 @@ import os
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
 os.environ['OMP_NUM_THREADS'] = '1'
 os.environ['FAISS_OPT_LEVEL'] = 'generic'
-from flask import Flask, request, jsonify, render_template, redirect, url_for
+import time
+import logging
+# LOG_LEVEL=DEBUG brings back the per-question retrieval details
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
+                    format="%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s")
+from flask import Flask, request, jsonify, render_template, redirect, url_for, Response, stream_with_context, g
 import chatbot  # Import our chatbot logic
-from datetime import datetime
-import threading
-import re
+import json
+import metrics
 from werkzeug.utils import secure_filename
-import ingest
+from ingest_queue import IngestQueue
+from sessions import SessionStore, cap_history
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'data_uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB limit
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-UNANSWERED_LOG = 'unanswered_log.txt'
-FEEDBACK_LOG = 'feedback_log.txt'
 
-# --- Ingestion Status Tracking ---
-INGESTION_STATUS = {
-    'status': 'Idle',
-    'last_run': None,
-    'error': None
-}
+# --- Ingestion Job Queue ---
+# One writer at a time across all workers; the finished job's brain version is
+# loaded right away here, and by other workers on their next request.
+ingest_jobs = IngestQueue(app.config['UPLOAD_FOLDER'], on_complete=lambda job: chatbot.load_brain())
+
+# --- Conversation Sessions ---
+# The chat history lives server-side, bounded and summarized; clients only send a session id.
+chat_sessions = SessionStore(summarize=chatbot.summarize_conversation)
+
+def conversation(data):
+    """
+    Returns (session_id, chat_history) for an /ask or /ask_stream request,
+    starting a new session when none is given. Clients that still send a
+    'history' array (and no session) get it capped to the same token budget.
+    """
+    session_id = data.get('session_id')
+    if session_id:
+        return session_id, chat_sessions.history(session_id)
+    return SessionStore.new_id(), cap_history(data.get('history') or [])
 
 # --- Load Brain (Critical for Gunicorn) ---
-# Removed top-level load to prevent hang
-
-# --- Feedback Logger ---
-def log_feedback(question, answer, feedback_type):
-    try:
-        with open(FEEDBACK_LOG, 'a', encoding='utf-8') as f:
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            f.write(f"[{timestamp}] - TYPE: {feedback_type}\n")
-            f.write(f"  Q: {question}\n")
-            f.write(f"  A: {answer}\n")
-            f.write("-" * 20 + "\n")
-    except Exception as e:
-        print(f"Error logging feedback: {e}")
-
-# --- Admin Log Parsers ---
-def parse_unanswered_logs():
-    logs = []
-    if not os.path.exists(UNANSWERED_LOG): return logs
-    with open(UNANSWERED_LOG, 'r', encoding='utf-8') as f:
-        for line in f:
-            match = re.match(r"\[(.*?)\] - (.*)", line)
-            if match: logs.append({'timestamp': match.group(1), 'question': match.group(2)})
-    return logs
-
-def parse_feedback_logs():
-    logs = []
-    if not os.path.exists(FEEDBACK_LOG): return logs
-    with open(FEEDBACK_LOG, 'r', encoding='utf-8') as f:
-        content = f.read().split('-' * 20)
-        for entry in content:
-            if not entry.strip(): continue
-            log = {}
-            ts_match = re.search(r"\[(.*?)\] - TYPE: (up|down)", entry)
-            q_match = re.search(r"Q: (.*)", entry)
-            a_match = re.search(r"A: (.*)", entry, re.DOTALL)
-            if ts_match and q_match and a_match:
-                log.update({
-                    'timestamp': ts_match.group(1), 'type': ts_match.group(2),
-                    'question': q_match.group(1).strip(), 'answer': a_match.group(1).strip()
-                })
-                logs.append(log)
-    return logs
+# Only when preloading (see gunicorn.conf.py): the master maps the brain once
+# and forked workers share its pages instead of each loading their own copy.
+if os.getenv("PRELOAD_BRAIN") == "1":
+    chatbot.load_brain()
+
+# --- Request Timing ---
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.teardown_request
+def record_request_time(exc):
+    # Streamed responses outlive this teardown; ask_stream times itself
+    start = g.pop('request_start', None)
+    if start is not None and request.endpoint not in (None, 'static', 'prometheus_metrics', 'ask_stream'):
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=request.endpoint)
 
 # --- Routes ---
 
@@ -79,17 +69,52 @@ def home():
 def ask():
     data = request.get_json()
     user_question = data.get('question')
-    chat_history = data.get('history', []) # Get history, default to empty list
+    document = data.get('document')  # Optional: only search this uploaded file
 
     if not user_question:
         return jsonify({'answer': 'Invalid request. No question provided.'}), 400
     
     # Pass both to the chatbot
-    bot_answer = chatbot.get_bot_response(user_question, chat_history)
+    session_id, chat_history = conversation(data)
+    response = chatbot.answer_question(user_question, chat_history, document)
+    chat_sessions.record(session_id, user_question, response['answer'])
     
-    return jsonify({'answer': bot_answer})
+    return jsonify({'answer': response['answer'], 'sources': response['sources'], 'session_id': session_id})
 # --- END OF UPDATE ---
 
+@app.route('/ask_stream', methods=['POST'])
+def ask_stream():
+    """
+    Same as /ask, but streams the answer as Server-Sent Events:
+    'data: {"text": ...}' for each piece, then 'event: done' with the full
+    answer, its sources and the session id ('event: incomplete' instead when
+    the model's stream broke off partway).
+    """
+    data = request.get_json()
+    user_question = data.get('question')
+    document = data.get('document')
+
+    if not user_question:
+        return jsonify({'answer': 'Invalid request. No question provided.'}), 400
+    session_id, chat_history = conversation(data)
+    start = g.request_start
+
+    def generate():
+        pieces, sources, status = [], [], {}
+        try:
+            for piece in chatbot.stream_bot_response(user_question, chat_history, document, sources, status):
+                pieces.append(piece)
+                yield f"data: {json.dumps({'text': piece})}\n\n"
+            answer = ''.join(pieces)
+            chat_sessions.record(session_id, user_question, answer)
+            event = 'done' if status.get('complete', True) else 'incomplete'
+            yield f"event: {event}\ndata: {json.dumps({'answer': answer, 'sources': sources, 'session_id': session_id})}\n\n"
+        finally:
+            metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint='ask_stream')
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
 @app.route('/feedback', methods=['POST'])
 def feedback():
     data = request.get_json()
@@ -98,15 +123,14 @@ def feedback():
     feedback_type = data.get('feedback_type')
     if not all([question, answer, feedback_type]):
         return jsonify({'status': 'error', 'message': 'Missing data'}), 400
-    threading.Thread(target=log_feedback, args=(question, answer, feedback_type)).start()
+    chatbot.get_event_log().log('feedback', question, answer, feedback_type)
     return jsonify({'status': 'success', 'message': 'Feedback received'})
 
 @app.route('/admin')
 def admin():
-    unanswered = parse_unanswered_logs()
-    feedback = parse_feedback_logs()
-    unanswered.reverse()
-    feedback.reverse()
+    # Newest first, one page each; the *_before ids page back through older entries
+    unanswered, unanswered_next = chatbot.get_event_log().page('unanswered', request.args.get('unanswered_before', type=int))
+    feedback, feedback_next = chatbot.get_event_log().page('feedback', request.args.get('feedback_before', type=int))
     
     # List uploaded files
     uploaded_files = []
@@ -117,16 +141,17 @@ def admin():
         
     return render_template('admin.html', 
                            unanswered_logs=unanswered, 
+                           unanswered_next=unanswered_next,
                            feedback_logs=feedback, 
+                           feedback_next=feedback_next,
                            uploaded_files=uploaded_files)
 
 @app.route('/clear_logs')
 def clear_logs():
     try:
-        if os.path.exists(UNANSWERED_LOG): os.remove(UNANSWERED_LOG)
-        if os.path.exists(FEEDBACK_LOG): os.remove(FEEDBACK_LOG)
+        chatbot.get_event_log().clear()
     except Exception as e:
-        print(f"Error clearing logs: {e}")
+        app.logger.error("Error clearing logs: %s", e)
     return redirect(url_for('admin'))
 
 @app.route('/upload_doc', methods=['POST'])
@@ -143,36 +168,35 @@ def upload_doc():
         if file:
             filename = secure_filename(file.filename)
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            # Renamed into place once complete, so an ingestion job running on
+            # another thread never reads a half-written upload
+            file.save(filepath + '.part')
+            os.replace(filepath + '.part', filepath)
             saved_count += 1
     
     if saved_count > 0:
         # Trigger Background Ingestion
-        def run_ingestion():
-            global INGESTION_STATUS
-            INGESTION_STATUS['status'] = 'Processing'
-            INGESTION_STATUS['last_run'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            INGESTION_STATUS['error'] = None
-            try:
-                success = ingest.rebuild_brain(app.config['UPLOAD_FOLDER'])
-                if success:
-                    chatbot.load_brain()
-                    INGESTION_STATUS['status'] = 'Success'
-                else:
-                    INGESTION_STATUS['status'] = 'Failed'
-                    INGESTION_STATUS['error'] = 'Ingestion produced no chunks (check file types/content)'
-            except Exception as e:
-                INGESTION_STATUS['status'] = 'Error'
-                INGESTION_STATUS['error'] = str(e)
-
-        threading.Thread(target=run_ingestion).start()
+        ingest_jobs.submit('sync', reason=f'upload of {saved_count} files')
         return redirect(url_for('admin', status=f'Uploaded {saved_count} files. Training started in background...'))
     
     return redirect(url_for('admin', status='No files were saved.'))
 
 @app.route('/ingest_status')
 def ingest_status():
-    return jsonify(INGESTION_STATUS)
+    return jsonify(ingest_jobs.status())
+
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify({
+        'embedding_cache': chatbot.embedding_cache.stats(),
+        'answer_cache': chatbot.answer_cache.stats(),
+        'rewrite_cache': chatbot.rewrite_cache.stats(),
+        'coalescing': chatbot.answer_flights.stats()
+    })
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/delete_doc/<filename>')
 def delete_doc(filename):
@@ -182,10 +206,9 @@ def delete_doc(filename):
     if os.path.exists(filepath):
         try:
             os.remove(filepath)
-            # Rebuild brain after deletion
-            ingest.rebuild_brain(app.config['UPLOAD_FOLDER'])
-            chatbot.load_brain()
-            return redirect(url_for('admin', status=f'File {filename} deleted and brain updated.'))
+            # Drop only this file's vectors from the brain, in the background
+            ingest_jobs.submit('sync', reason=f'delete of {filename}')
+            return redirect(url_for('admin', status=f'File {filename} deleted; brain update queued.'))
         except Exception as e:
             return redirect(url_for('admin', status=f'Error deleting file: {e}'))
     else:
@@ -199,14 +222,10 @@ def delete_all_docs():
                 if f.lower().endswith(('.txt', '.pdf')):
                     os.remove(os.path.join(app.config['UPLOAD_FOLDER'], f))
         
-        # Rebuild brain (which will now clear it)
-        ingest.rebuild_brain(app.config['UPLOAD_FOLDER'])
-        
-        # Update memory
-        chatbot.index = None
-        chatbot.chunks = []
+        # Rebuild brain (which will now clear it) in the background
+        ingest_jobs.submit('rebuild', reason='delete of all documents')
         
-        return redirect(url_for('admin', status='All documents deleted and brain cleared.'))
+        return redirect(url_for('admin', status='All documents deleted; clearing the brain is queued.'))
     except Exception as e:
         return redirect(url_for('admin', status=f'Error clearing documents: {e}'))
 
@@ -0,0 +1,30 @@
+import os
+import threading
+
+class BackgroundThread:
+    """
+    A daemon thread running target for the life of the process. start() is
+    cheap enough to call on every use: it only starts the thread when this
+    process has none running, which includes the first call after a fork
+    (a forked child doesn't inherit the parent's threads).
+    """
+
+    def __init__(self, target, name):
+        self.target = target
+        self.name = name
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def running(self):
+        return self._pid == os.getpid() and self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running():
+            return
+        with self._lock:
+            if self.running():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self.target, name=self.name, daemon=True)
+            self._thread.start()
@@ -0,0 +1,110 @@
+"""
+Compares the old character splitter (ingest.split_text_recursive) with the
+token-aware chunker (chunker.py) on the documents in data_uploads/.
+
+    python benchmarks/chunking.py [--queries 200] [--k 5] [--dim 768]
+
+Per document and splitter it reports the chunk count, tokens stored (and how
+many of those are overlap duplicates), the flat index size at --dim, the
+splitting time, and a retrieval hit rate: sentences sampled from the text are
+used as queries against a BM25 index of the chunks, and a query hits when one
+of the top-k chunks contains the whole sentence (i.e. the passage wasn't cut).
+Runs offline; no embedding calls. Documents are read in a throwaway copy of
+the app (sandbox.py), so the extracted-text cache isn't written to the repo.
+"""
+import os
+import sys
+import argparse
+import random
+import re
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import sandbox
+
+# App modules, imported from the sandbox copy by main()
+ingest = chunker = LexicalIndex = None
+
+def normalize(text):
+    return " ".join(text.split())
+
+def text_segments(text):
+    """
+    Yields the runs of text between page breaks and heading lines: a
+    "sentence" crossing either is an extraction artifact, not a real one.
+    """
+    for page in text.split(chunker.PAGE_BREAK):
+        lines = []
+        for line in page.split("\n"):
+            if chunker.is_heading(line):
+                yield "\n".join(lines)
+                lines = []
+            else:
+                lines.append(line)
+        yield "\n".join(lines)
+
+def sample_sentences(text, n, seed=0):
+    sentences = [normalize(s) for segment in text_segments(text) for s in re.split(r"(?<=[.!?])\s+", segment)]
+    sentences = [s for s in sentences if 8 <= len(s.split()) <= 40]
+    random.Random(seed).shuffle(sentences)
+    return sentences[:n]
+
+def hit_rate(chunks, queries, k):
+    if not queries:
+        return None
+    normalized = [normalize(c) for c in chunks]
+    index = LexicalIndex.build(dict(enumerate(chunks)))
+    hits = 0
+    for query in queries:
+        if any(query in normalized[chunk_id] for chunk_id, _, _ in index.search(query, k=k)):
+            hits += 1
+    return hits / len(queries)
+
+def splitters():
+    return [
+        ("recursive 1000/200ch", lambda text: ingest.split_text_recursive(text, chunk_size=1000, chunk_overlap=200)),
+        (f"chunker {chunker.CHUNK_TOKENS}/{chunker.CHUNK_OVERLAP_TOKENS}tok",
+         lambda text: [c.text for c in chunker.chunk_text(text)]),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=768, help="Embedding dimension for the index size")
+    args = parser.parse_args()
+
+    global ingest, chunker, LexicalIndex
+    root = sandbox.create()
+    try:
+        sandbox.use(root)
+        import ingest
+        import chunker
+        from lexical_index import LexicalIndex
+        run(args, os.path.join(root, "data_uploads"))
+    finally:
+        sandbox.remove(root)
+
+def run(args, upload_dir):
+    files = ingest.list_documents(upload_dir)
+    texts = ingest.read_documents({os.path.join(upload_dir, f): ingest.file_sha256(os.path.join(upload_dir, f))
+                                   for f in files})
+    print(f"\n{'document':<22} {'splitter':<22} {'chunks':>7} {'tokens':>8} {'dup %':>6} "
+          f"{'index KB':>9} {'ms':>7} {f'hit@{args.k}':>7}")
+    for file_path, text in texts.items():
+        source_tokens = chunker.count_tokens(text)
+        queries = sample_sentences(text, args.queries)
+        for label, split in splitters():
+            start = time.perf_counter()
+            chunks = split(text)
+            elapsed = time.perf_counter() - start
+            stored = sum(chunker.count_tokens(c) for c in chunks)
+            duplicate = (stored - source_tokens) / source_tokens * 100 if source_tokens else 0
+            index_kb = len(chunks) * args.dim * 4 / 1024
+            rate = hit_rate(chunks, queries, args.k)
+            print(f"{os.path.basename(file_path)[:22]:<22} {label:<22} {len(chunks):>7} {stored:>8} {duplicate:>6.1f} "
+                  f"{index_kb:>9.0f} {elapsed * 1000:>7.1f} {'n/a' if rate is None else f'{rate:.1%}':>7}")
+
+if __name__ == "__main__":
+    main()
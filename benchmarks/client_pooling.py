@@ -0,0 +1,104 @@
+"""
+Compares one-off requests.post calls with the pooled gemini_client session
+(and its asyncio variant) against the local mock Gemini server, and checks
+that the pools reuse their connections.
+
+    python benchmarks/client_pooling.py [--calls 200] [--threads 10] [--latency 0.0]
+
+Reports the TCP connections the server accepted and the mean latency per
+call. Against the real API every new connection also pays a TLS handshake,
+so the gap is larger than what this plain-HTTP mock shows.
+
+Exits with status 1 unless: every one-off call opened its own connection,
+sequential pooled calls shared a single one, --threads concurrent callers
+opened no more than they needed, and the async client, with every call
+gathered at once, stayed within its pool (GEMINI_POOL_SIZE).
+"""
+import os
+import sys
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+import gemini_client
+from mock_gemini import MockGeminiServer
+
+def unpooled_embed(text):
+    url = gemini_client.model_url(gemini_client.EMBEDDING_MODEL, "embedContent")
+    response = requests.post(url, headers=gemini_client.HEADERS,
+                             data=json.dumps(gemini_client.embedding_request(text)), timeout=10)
+    return response.json()['embedding']['values']
+
+def pooled_embed(text):
+    embedding = gemini_client.embed(text)
+    if embedding is None:
+        raise RuntimeError("Pooled embedding call failed")
+    return embedding
+
+def run(label, server, calls, fn):
+    """
+    Runs fn, prints its row and returns the connections the server accepted.
+    """
+    server.reset_counters()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    connections = server.counters.get('connections', 0)
+    print(f"{label:<22} {connections:>12} {elapsed / calls * 1000:>10.2f}")
+    return connections
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=gemini_client.POOL_SIZE,
+                        help="Concurrent callers for the threaded run (at most GEMINI_POOL_SIZE)")
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    threads = max(1, min(args.threads, gemini_client.POOL_SIZE))
+
+    server = MockGeminiServer(latency=args.latency).start()
+    gemini_client.API_BASE = server.api_base
+    gemini_client.reset_session()
+    texts = [f"question number {i}" for i in range(args.calls)]
+
+    def threaded():
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(pooled_embed, texts))
+
+    async def async_embeds():
+        async with gemini_client.AsyncGeminiClient() as client:
+            embeddings = await asyncio.gather(*(client.embed(t) for t in texts))
+        if any(embedding is None for embedding in embeddings):
+            raise RuntimeError("Async embedding call failed")
+
+    try:
+        print(f"{'client':<22} {'connections':>12} {'ms/call':>10}")
+        unpooled = run("requests.post", server, args.calls, lambda: [unpooled_embed(t) for t in texts])
+        pooled = run("pooled session", server, args.calls, lambda: [pooled_embed(t) for t in texts])
+        gemini_client.reset_session()  # The threaded run starts from an empty pool too
+        concurrent = run(f"pooled, {threads} threads", server, args.calls, threaded)
+        gathered = run("async pooled (gather)", server, args.calls, lambda: asyncio.run(async_embeds()))
+    finally:
+        server.shutdown()
+
+    failures = []
+    if unpooled != args.calls:
+        failures.append(f"requests.post opened {unpooled} connections for {args.calls} calls")
+    if pooled != 1:
+        failures.append(f"sequential pooled calls opened {pooled} connections instead of 1")
+    if concurrent > threads:
+        failures.append(f"{threads} threads opened {concurrent} pooled connections")
+    if gathered > gemini_client.POOL_SIZE:
+        failures.append(f"the async client opened {gathered} connections for a pool of {gemini_client.POOL_SIZE}")
+    if failures:
+        print("\nConnections were not reused as expected: " + "; ".join(failures))
+        sys.exit(1)
+    print(f"\nPooled calls reused their connections ({args.calls} calls over {pooled}, {concurrent} and {gathered}).")
+
+if __name__ == "__main__":
+    main()
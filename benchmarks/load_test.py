@@ -0,0 +1,275 @@
+"""
+Replays question traffic against /ask (or /ask_stream) at a fixed
+concurrency and reports p50/p95/p99 latency and throughput.
+
+    python benchmarks/load_test.py [--concurrency 8] [--requests 400] [--stream]
+        [--workers 2] [--threads 16] [--embed-latency 0.05] [--generate-latency 0.8]
+        [--jitter 0.2] [--error-rate 0.0] [--questions benchmarks/questions.jsonl]
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 [--concurrency 8] ...
+
+Without --url the whole stack runs locally and offline: the mock Gemini API
+(mock_gemini.py), a throwaway copy of the app (sandbox.py) whose brain is
+built from data_uploads/ with mock embeddings, and gunicorn serving that
+copy with gunicorn.conf.py (--workers, --threads and --worker-class
+override its defaults the way WEB_CONCURRENCY, GUNICORN_THREADS and
+GUNICORN_WORKER_CLASS do in production). Nothing is written to the real
+brain or stores. The answer cache is off unless --answer-cache, so every
+request goes through retrieval and generation.
+
+Questions are read from a JSONL file, one {"question": ..., "document": ...}
+object per line ("document" optional; plain text lines work too), so a log
+of real traffic can be replayed as well. They are shuffled with --seed and
+cycled until --requests have been sent. Each client thread keeps its own
+keep-alive connection and one session, like a browser tab would.
+"""
+import os
+import sys
+import argparse
+import itertools
+import json
+import math
+import random
+import socket
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+import sandbox
+from mock_gemini import MockGeminiServer
+
+QUESTIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "questions.jsonl")
+FALLBACK_NOTE = "**Note:**"  # chatbot.FALLBACK_NOTE: every model failed, raw context returned
+REQUEST_TIMEOUT = 120
+
+def load_questions(path):
+    questions = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                item = {'question': line}
+            if isinstance(item, dict) and item.get('question'):
+                questions.append({'question': item['question'], 'document': item.get('document')})
+    return questions
+
+def percentile(sorted_values, p):
+    # Nearest rank, so p99 of 100 samples is the 99th, not an interpolation
+    if not sorted_values:
+        return float('nan')
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# --- Clients ---
+def ask(http, url, item, session_id, stream):
+    """
+    Sends one question. Returns (status, seconds, first_byte_seconds, answer, session_id).
+    """
+    payload = {'question': item['question'], 'session_id': session_id}
+    if item.get('document'):
+        payload['document'] = item['document']
+    start = time.perf_counter()
+    if not stream:
+        response = http.post(f"{url}/ask", json=payload, timeout=REQUEST_TIMEOUT)
+        elapsed = time.perf_counter() - start
+        body = response.json() if response.status_code == 200 else {}
+        return response.status_code, elapsed, elapsed, body.get('answer', ''), body.get('session_id')
+
+    first_byte, done = None, {}
+    with http.post(f"{url}/ask_stream", json=payload, timeout=REQUEST_TIMEOUT, stream=True) as response:
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if first_byte is None and line and line.startswith('data:'):
+                first_byte = time.perf_counter() - start
+            if line.startswith('event:'):
+                event = line.split(':', 1)[1].strip()
+            elif line.startswith('data:') and event == 'done':
+                done = json.loads(line.split(':', 1)[1])
+        elapsed = time.perf_counter() - start
+        return response.status_code, elapsed, first_byte or elapsed, done.get('answer', ''), done.get('session_id')
+
+def run_load(url, questions, concurrency, total, stream=False, seed=0):
+    """
+    Sends total questions from concurrency threads. Returns the per-request
+    results and the wall-clock seconds taken.
+    """
+    order = list(questions)
+    random.Random(seed).shuffle(order)
+    feed = itertools.islice(itertools.cycle(order), total)
+    feed_lock = threading.Lock()
+    results = []
+    results_lock = threading.Lock()
+
+    def client():
+        http = requests.Session()
+        session_id = None
+        while True:
+            with feed_lock:
+                item = next(feed, None)
+            if item is None:
+                return
+            try:
+                status, seconds, first_byte, answer, session_id = ask(http, url, item, session_id, stream)
+            except requests.RequestException as e:
+                status, seconds, first_byte, answer = type(e).__name__, None, None, ''
+            with results_lock:
+                results.append({'status': status, 'seconds': seconds, 'first_byte': first_byte,
+                                'fallback': answer.startswith(FALLBACK_NOTE)})
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    return results, time.perf_counter() - start
+
+def summarize(results, elapsed):
+    ok = sorted(r['seconds'] for r in results if r['status'] == 200)
+    first_bytes = sorted(r['first_byte'] for r in results if r['status'] == 200)
+    errors = {}
+    for r in results:
+        if r['status'] != 200:
+            errors[str(r['status'])] = errors.get(str(r['status']), 0) + 1
+    return {
+        'requests': len(results),
+        'ok': len(ok),
+        'errors': errors,
+        'fallback_answers': sum(1 for r in results if r['fallback']),
+        'seconds': elapsed,
+        'throughput': len(ok) / elapsed if elapsed else 0.0,
+        'latency_ms': {f"p{p}": percentile(ok, p) * 1000 for p in (50, 95, 99)},
+        'max_ms': ok[-1] * 1000 if ok else float('nan'),
+        'first_byte_ms': {f"p{p}": percentile(first_bytes, p) * 1000 for p in (50, 95, 99)},
+    }
+
+def print_report(summary, stream, mock_counters=None):
+    print("-" * 50)
+    print(f"Requests:         {summary['requests']} ({summary['ok']} ok) in {summary['seconds']:.2f} s")
+    print(f"Throughput:       {summary['throughput']:.2f} answers/s")
+    latency = summary['latency_ms']
+    print(f"Latency (ms):     p50 {latency['p50']:.1f}  p95 {latency['p95']:.1f}  p99 {latency['p99']:.1f}  "
+          f"max {summary['max_ms']:.1f}")
+    if stream:
+        first = summary['first_byte_ms']
+        print(f"First token (ms): p50 {first['p50']:.1f}  p95 {first['p95']:.1f}  p99 {first['p99']:.1f}")
+    if summary['errors']:
+        print(f"Errors:           " + ", ".join(f"{k}: {v}" for k, v in sorted(summary['errors'].items())))
+    print(f"Fallback answers: {summary['fallback_answers']}")
+    if mock_counters:
+        calls = {k: v for k, v in sorted(mock_counters.items()) if k != 'connections'}
+        print(f"Mock API calls:   " + ", ".join(f"{k}: {v}" for k, v in calls.items()))
+    print("-" * 50)
+
+# --- Local Stack ---
+def build_brain(root, env):
+    result = subprocess.run([sys.executable, "ingest.py"], cwd=root, env=env, capture_output=True, text=True)
+    if not os.path.exists(os.path.join(root, "brains", "CURRENT")):
+        sys.stdout.write(result.stdout + result.stderr)
+        raise SystemExit("Building the benchmark brain failed.")
+
+def start_server(root, env):
+    port = free_port()
+    log = open(os.path.join(root, "server.log"), "w")
+    command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}", "app:app"]
+    process = subprocess.Popen(command, cwd=root, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            if requests.get(url + "/", timeout=1).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    with open(os.path.join(root, "server.log"), "r") as f:
+        sys.stdout.write(f.read())
+    raise SystemExit("The benchmark server did not start.")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="Server to test; default starts a local one on the mock API")
+    parser.add_argument("--questions", default=QUESTIONS_PATH, help="JSONL file of questions to replay")
+    parser.add_argument("--concurrency", type=int, default=8, help="Clients sending questions at once")
+    parser.add_argument("--requests", type=int, default=200, help="Questions to send in total")
+    parser.add_argument("--warmup", type=int, default=None, help="Untimed questions first (default: --concurrency)")
+    parser.add_argument("--stream", action="store_true", help="Use /ask_stream and also report time to first token")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for question order, jitter and 429 injection")
+    parser.add_argument("--save", default=None, help="Write the results as JSON to this file")
+    local = parser.add_argument_group("local stack (without --url)")
+    local.add_argument("--workers", type=int, default=None, help="gunicorn workers (default: gunicorn.conf.py)")
+    local.add_argument("--threads", type=int, default=None, help="Threads per worker (default: gunicorn.conf.py)")
+    local.add_argument("--worker-class", default=None, help="gunicorn worker class (default: gunicorn.conf.py)")
+    local.add_argument("--embed-latency", type=float, default=0.05, help="Mock seconds per embedding call")
+    local.add_argument("--generate-latency", type=float, default=0.5, help="Mock seconds per generation call")
+    local.add_argument("--jitter", type=float, default=0.2, help="Random +/- fraction of each mock latency")
+    local.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock calls answered with 429")
+    local.add_argument("--answer-cache", action="store_true", help="Leave the semantic answer cache on")
+    local.add_argument("--keep", action="store_true", help="Keep the app copy (and its server.log) afterwards")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    if not questions:
+        raise SystemExit(f"No questions in {args.questions}")
+    random.seed(args.seed)
+    warmup = args.concurrency if args.warmup is None else args.warmup
+
+    mock, process, root = None, None, None
+    try:
+        url = args.url
+        if url is None:
+            mock = MockGeminiServer().start()
+            root = sandbox.create()
+            overrides = {} if args.answer_cache else {'ANSWER_CACHE_TTL': 0}
+            for name, value in (('WEB_CONCURRENCY', args.workers), ('GUNICORN_THREADS', args.threads),
+                                ('GUNICORN_WORKER_CLASS', args.worker_class)):
+                if value is not None:
+                    overrides[name] = value
+            env = sandbox.environment(root, mock.api_base, **overrides)
+            print(f"Building the benchmark brain in {root} ...")
+            build_brain(root, env)
+            process, url = start_server(root, env)
+            print(f"Serving on {url} with {args.workers or 'default'} worker(s) x "
+                  f"{args.threads or 'default'} thread(s)")
+            # Ingestion ran at full speed; the load sees the configured API behaviour
+            mock.embed_latency, mock.generate_latency = args.embed_latency, args.generate_latency
+            mock.jitter, mock.error_rate = args.jitter, args.error_rate
+
+        if warmup:
+            run_load(url, questions, args.concurrency, warmup, args.stream, args.seed + 1)
+        if mock is not None:
+            mock.reset_counters()
+        print(f"Sending {args.requests} questions from {args.concurrency} clients ...")
+        results, elapsed = run_load(url, questions, args.concurrency, args.requests, args.stream, args.seed)
+        summary = summarize(results, elapsed)
+        summary['config'] = {k: v for k, v in vars(args).items() if k not in ('save', 'keep')}
+        print_report(summary, args.stream, mock.counters if mock is not None else None)
+        if args.save:
+            with open(args.save, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=2)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if mock is not None:
+            mock.shutdown()
+        if root is not None and not args.keep:
+            sandbox.remove(root)
+
+if __name__ == "__main__":
+    main()
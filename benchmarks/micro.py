@@ -0,0 +1,141 @@
+"""
+Micro-benchmarks of the ingestion path over the bundled data_uploads/ corpus:
+PDF text extraction, both splitters and a full brain rebuild.
+
+    python benchmarks/micro.py [--repeat 5] [--upload-dir data_uploads]
+    python benchmarks/micro.py --save baseline.json
+    python benchmarks/micro.py --compare baseline.json [--tolerance 0.25]
+
+  extract_text_from_pdf  every PDF, in-process (no worker pool, no text cache)
+  split_text_recursive   the old character splitter over every document
+  chunker.chunk_text     the token-aware splitter ingestion uses now
+  rebuild_brain (cold)   extraction, chunking, embedding and indexing with
+                         the text and embedding caches cleared first
+  rebuild_brain (warm)   the same with both caches filled, i.e. chunking,
+                         indexing and saving a new brain version
+
+Embeddings come from the mock Gemini server with no added latency, so the
+rebuild numbers are this code's own cost. Everything runs in a throwaway
+copy of the app (sandbox.py); the real brain and caches are not touched.
+
+Each benchmark runs --repeat times and reports the best and median time.
+--compare exits with status 1 when a best time is more than --tolerance
+slower than the saved baseline, so it can gate a deploy; the best time is
+compared because it is the least disturbed by whatever else the machine runs.
+"""
+import os
+import sys
+import argparse
+import contextlib
+import glob
+import json
+import logging
+import shutil
+import statistics
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import sandbox
+from mock_gemini import MockGeminiServer
+
+@contextlib.contextmanager
+def quiet():
+    # Ingestion reports progress on stdout; keep it out of the table
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def measure(fn, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with quiet():
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+    return {'best': min(times), 'median': statistics.median(times), 'runs': len(times)}
+
+def clear_caches(ingest):
+    shutil.rmtree(ingest.TEXT_CACHE_DIR, ignore_errors=True)
+    for path in glob.glob(ingest.VECTOR_CACHE_PATH + '*'):
+        os.remove(path)
+
+def run_benchmarks(ingest, chunker, upload_dir, repeat):
+    files = [os.path.join(upload_dir, name) for name in ingest.list_documents(upload_dir)]
+    pdfs = [path for path in files if path.lower().endswith('.pdf')]
+    with quiet():
+        texts = [ingest.read_document(path) for path in files]
+    characters = sum(len(text) for text in texts)
+    print(f"Corpus: {len(files)} documents ({len(pdfs)} PDFs), {characters:,} characters\n")
+
+    results = {}
+    if pdfs:
+        results['extract_text_from_pdf'] = measure(lambda: [ingest.extract_text_from_pdf(p) for p in pdfs], repeat)
+    results['split_text_recursive'] = measure(lambda: [ingest.split_text_recursive(t) for t in texts], repeat)
+    results['chunker.chunk_text'] = measure(lambda: [chunker.chunk_text(t) for t in texts], repeat)
+    results['rebuild_brain (cold)'] = measure(lambda: ingest.rebuild_brain(upload_dir), repeat,
+                                              setup=lambda: clear_caches(ingest))
+    results['rebuild_brain (warm)'] = measure(lambda: ingest.rebuild_brain(upload_dir), repeat)
+    return results
+
+def print_results(results, baseline=None, tolerance=0.0):
+    """
+    Prints the table; returns the names of benchmarks slower than the baseline allows.
+    """
+    regressions = []
+    header = f"{'benchmark':<24} {'best ms':>10} {'median ms':>10}"
+    print(header + (f" {'baseline':>10} {'change':>8}" if baseline else ""))
+    for name, result in results.items():
+        line = f"{name:<24} {result['best'] * 1000:>10.1f} {result['median'] * 1000:>10.1f}"
+        previous = (baseline or {}).get(name)
+        if previous:
+            change = result['best'] / previous['best'] - 1
+            flag = ""
+            if change > tolerance:
+                regressions.append(name)
+                flag = "  REGRESSION"
+            line += f" {previous['best'] * 1000:>10.1f} {change:>+8.0%}{flag}"
+        print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--upload-dir", default=None, help="Corpus to use instead of data_uploads/")
+    parser.add_argument("--save", default=None, help="Write the results as a JSON baseline to this file")
+    parser.add_argument("--compare", default=None, help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before failing (0.25 = 25%%)")
+    args = parser.parse_args()
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    logging.basicConfig(level=logging.WARNING)
+    server = MockGeminiServer().start()
+    root = sandbox.create(os.path.abspath(args.upload_dir) if args.upload_dir else None)
+    try:
+        # The app modules read their paths and API settings on import, so
+        # they are imported only once the environment points at the copy
+        os.environ.update(sandbox.environment(root, server.api_base, PDF_WORKERS=1))
+        sandbox.use(root)
+        with quiet():
+            import ingest
+            import chunker
+        results = run_benchmarks(ingest, chunker, os.path.join(root, "data_uploads"), args.repeat)
+    finally:
+        server.shutdown()
+        sandbox.remove(root)
+
+    regressions = print_results(results, baseline, args.tolerance)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) more than {args.tolerance:.0%} slower than {args.compare}: "
+              + ", ".join(regressions))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Local stand-in for the Gemini REST endpoints used by the chatbot:
+embedContent, batchEmbedContents, generateContent and streamGenerateContent.
+
+Embeddings are deterministic (hashed bag of words), so similar texts land
+close together. The server speaks HTTP/1.1 keep-alive and counts the TCP
+connections it accepts, which shows whether clients reuse connections.
+Latency can be set per endpoint kind (embedding vs generation) with random
+jitter, and a share of calls can be answered with 429 like an exhausted quota.
+
+    python benchmarks/mock_gemini.py [--port 8765] [--embed-latency 0.05]
+        [--generate-latency 0.8] [--jitter 0.2] [--error-rate 0.05]
+    GEMINI_API_BASE=http://127.0.0.1:8765/v1beta python app.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIM = 768
+ROUTE = re.compile(r"^/v1beta/models/(?P<model>[^:/?]+):(?P<method>\w+)")
+EMBED_METHODS = ("embedContent", "batchEmbedContents")
+
+def fake_embedding(text, dim=EMBEDDING_DIM):
+    vector = [0.0] * dim
+    for word in text.lower().split():
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % dim] += 1.0
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+def fake_answer(payload):
+    question = payload["contents"][-1]["parts"][0]["text"].rsplit("QUESTION:", 1)[-1].strip()
+    return f"This is a mock answer to: {question}"
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so connection reuse is observable
+
+    def setup(self):
+        super().setup()
+        # Headers and body are separate writes; don't let Nagle delay the second one
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.count("connections")
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        match = ROUTE.match(self.path)
+        if not match:
+            return self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+        method = match.group("method")
+        self.server.count(method)
+
+        delay = self.server.delay(method)
+        if delay:
+            time.sleep(delay)
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            self.server.count("429")
+            return self._send_json(429, {"error": {"code": 429, "message": "Resource has been exhausted (mock)."}})
+
+        if method == "embedContent":
+            text = payload["content"]["parts"][0]["text"]
+            return self._send_json(200, {"embedding": {"values": fake_embedding(text)}})
+        if method == "batchEmbedContents":
+            embeddings = [{"values": fake_embedding(r["content"]["parts"][0]["text"])} for r in payload["requests"]]
+            return self._send_json(200, {"embeddings": embeddings})
+        if method == "generateContent":
+            candidate = {"content": {"parts": [{"text": fake_answer(payload)}], "role": "model"}, "finishReason": "STOP"}
+            return self._send_json(200, {"candidates": [candidate]})
+        if method == "streamGenerateContent":
+            return self._stream_answer(fake_answer(payload))
+        return self._send_json(404, {"error": {"message": f"Unknown method {method}"}})
+
+    def _stream_answer(self, answer):
+        # SSE without Content-Length: close the connection to end the stream
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        words = answer.split(" ")
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            candidate = {"content": {"parts": [{"text": word + ("" if last else " ")}], "role": "model"}}
+            if last:
+                candidate["finishReason"] = "STOP"
+            self.wfile.write(f"data: {json.dumps({'candidates': [candidate]})}\r\n\r\n".encode())
+            self.wfile.flush()
+        self.close_connection = True
+
+class MockGeminiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0,
+                 embed_latency=None, generate_latency=None, jitter=0.0):
+        super().__init__((host, port), MockGeminiHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        # Per-kind latencies fall back to the shared one
+        self.embed_latency = latency if embed_latency is None else embed_latency
+        self.generate_latency = latency if generate_latency is None else generate_latency
+        self.jitter = jitter
+        self.counters = {}
+        self._counter_lock = threading.Lock()
+
+    @property
+    def api_base(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1beta"
+
+    def delay(self, method):
+        """
+        Seconds to wait before answering a call: the latency for its kind,
+        randomly stretched or shrunk by up to the jitter fraction.
+        """
+        base = self.embed_latency if method in EMBED_METHODS else self.generate_latency
+        if not base:
+            return 0.0
+        return max(0.0, base * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def count(self, name):
+        with self._counter_lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on purpose (deadlines, hedged calls, shutdown); keep the output clean
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def reset_counters(self):
+        with self._counter_lock:
+            self.counters = {}
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--embed-latency", type=float, default=None, help="Seconds added to embedding calls")
+    parser.add_argument("--generate-latency", type=float, default=None, help="Seconds added to generation calls")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- fraction applied to each latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered with a 429")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for jitter and 429 injection")
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    server = MockGeminiServer(args.host, args.port, args.latency, args.error_rate,
+                              args.embed_latency, args.generate_latency, args.jitter)
+    print(f"Mock Gemini API listening on {server.api_base}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
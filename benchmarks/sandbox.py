@@ -0,0 +1,61 @@
+"""
+Throwaway copies of the app for benchmarks that ingest or serve.
+
+The brain, caches and SQLite stores live next to the modules (BASE_DIR), so
+a benchmark that rebuilds the brain with mock embeddings must not run in the
+real tree. create() copies the code, templates and data_uploads/ into a temp
+directory; importing from there (or running the server in it) keeps every
+file it writes inside the copy.
+"""
+import os
+import sys
+import glob
+import shutil
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COPIED_DIRS = ("templates", "static", "data_uploads")
+
+def create(upload_dir=None):
+    """
+    Returns the path of a fresh copy of the app. upload_dir replaces the
+    bundled data_uploads/ corpus.
+    """
+    root = tempfile.mkdtemp(prefix="chatbot-bench-")
+    for path in glob.glob(os.path.join(REPO_DIR, "*.py")):
+        shutil.copy2(path, root)
+    for name in COPIED_DIRS:
+        source = upload_dir if name == "data_uploads" and upload_dir else os.path.join(REPO_DIR, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(root, name))
+    return root
+
+def remove(root):
+    shutil.rmtree(root, ignore_errors=True)
+
+def use(root):
+    """
+    Makes `import ingest` (and friends) load the copy in root. Call before
+    importing any app module.
+    """
+    sys.path.insert(0, root)
+
+def environment(root, api_base, **overrides):
+    """
+    Environment for a process running the copy against the mock API: every
+    store inside root, and no real key sent anywhere.
+    """
+    env = dict(os.environ)
+    env.update({
+        "GEMINI_API_BASE": api_base,
+        "GEMINI_API_KEY": "mock-key",
+        "EMBEDDING_BACKEND": "gemini",
+        "SESSIONS_DB": os.path.join(root, "sessions.db"),
+        "EVENTS_DB": os.path.join(root, "events.db"),
+        "INGEST_JOBS_DB": os.path.join(root, "ingest_jobs.db"),
+        "METRICS_DIR": os.path.join(root, "metrics_data"),
+        "PYTHONPATH": root,
+    })
+    env.pop("EMBEDDING_CACHE_DB", None)  # Would point outside the copy
+    env.update({key: str(value) for key, value in overrides.items()})
+    return env
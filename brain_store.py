@@ -0,0 +1,277 @@
+import os
+import logging
+import re
+import json
+import time
+import shutil
+import pickle
+import threading
+import faiss
+from chunk_store import ChunkStore, ChunkMetadata
+from lexical_index import LexicalIndex
+
+log = logging.getLogger(__name__)
+
+# --- Configuration ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BRAINS_DIR = os.path.join(BASE_DIR, "brains")           # One sub-directory per brain version
+CURRENT_PATH = os.path.join(BRAINS_DIR, "CURRENT")      # Name of the live version
+KEEP_VERSIONS = int(os.getenv("BRAIN_KEEP_VERSIONS", "3"))  # Old versions kept for in-flight readers
+
+# Files inside a version directory
+INDEX_FILE = "faiss_index"
+CHUNKS_BASE = "chunks"  # chunks.txt / chunks.idx
+META_BASE = "chunk_meta"  # Columnar chunk metadata: chunk_meta.npy / .docs.json
+LEXICAL_BASE = "lexical"  # BM25 index: lexical.terms.json / .postings.npy / .docs.npy
+MANIFEST_FILE = "brain_manifest.json"
+
+# Pre-versioning brain at the top level, still served until the first ingest
+LEGACY_INDEX_PATH = os.path.join(BASE_DIR, "faiss_index")
+LEGACY_DATA_STORE_PATH = os.path.join(BASE_DIR, "data_store.pkl")
+LEGACY_CHUNK_STORE_PATH = os.path.join(BASE_DIR, "chunks")
+LEGACY_MANIFEST_PATH = os.path.join(BASE_DIR, "brain_manifest.json")
+LEGACY_VERSION = "legacy"
+
+_VERSION_RE = re.compile(r"^v(\d+)$")
+
+# IO_FLAG_MMAP only maps the inverted lists of IVF indexes; IO_FLAG_MMAP_IFC
+# (faiss >= 1.10) maps the whole file, so flat and HNSW indexes are shared too
+MMAP_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+# --- Version Directories ---
+def version_dir(version):
+    return os.path.join(BRAINS_DIR, version)
+
+def current_version():
+    """
+    Returns the name of the live version, or None if there is none.
+    """
+    try:
+        with open(CURRENT_PATH, 'r', encoding='utf-8') as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+    return version if version and os.path.isdir(version_dir(version)) else None
+
+def list_versions():
+    """
+    Returns the version names on disk, oldest first.
+    """
+    if not os.path.isdir(BRAINS_DIR):
+        return []
+    numbered = []
+    for name in os.listdir(BRAINS_DIR):
+        match = _VERSION_RE.match(name)
+        if match and os.path.isdir(version_dir(name)):
+            numbered.append((int(match.group(1)), name))
+    return [name for _, name in sorted(numbered)]
+
+def new_version():
+    """
+    Creates and returns an empty, unpublished version directory.
+    """
+    os.makedirs(BRAINS_DIR, exist_ok=True)
+    versions = list_versions()
+    number = int(_VERSION_RE.match(versions[-1]).group(1)) + 1 if versions else 1
+    while True:
+        version = f"v{number:06d}"
+        try:
+            os.mkdir(version_dir(version))
+            return version
+        except FileExistsError:
+            number += 1  # Another writer got there first
+
+def write_version(index, chunk_map, manifest):
+    """
+    Writes index, chunks (text and metadata), their BM25 index and the manifest
+    into a new version directory and returns its name. Nothing is visible to
+    readers until publish().
+    """
+    version = new_version()
+    path = version_dir(version)
+    faiss.write_index(index, os.path.join(path, INDEX_FILE))
+    ChunkStore.write(os.path.join(path, CHUNKS_BASE), chunk_map)
+    ChunkMetadata.write(os.path.join(path, META_BASE), chunk_map, manifest)
+    LexicalIndex.build(chunk_map).save(os.path.join(path, LEXICAL_BASE))
+    with open(os.path.join(path, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return version
+
+def publish(version):
+    """
+    Atomically points CURRENT at version (None clears the brain), then prunes
+    old versions and the legacy top-level files.
+    """
+    os.makedirs(BRAINS_DIR, exist_ok=True)
+    if version is None:
+        if os.path.exists(CURRENT_PATH):
+            os.remove(CURRENT_PATH)
+    else:
+        tmp_path = CURRENT_PATH + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, CURRENT_PATH)
+    remove_legacy()
+    prune(KEEP_VERSIONS)
+
+def prune(keep):
+    """
+    Deletes all but the newest `keep` versions (never the live one). Readers
+    still holding an old version keep working: its files are memory-mapped and
+    unlinking doesn't unmap them.
+    """
+    live = current_version()
+    versions = list_versions()
+    for version in versions[:max(0, len(versions) - keep)]:
+        if version != live:
+            shutil.rmtree(version_dir(version), ignore_errors=True)
+
+def remove_legacy():
+    for path in (LEGACY_INDEX_PATH, LEGACY_DATA_STORE_PATH, LEGACY_MANIFEST_PATH):
+        if os.path.exists(path):
+            os.remove(path)
+    ChunkStore.remove(LEGACY_CHUNK_STORE_PATH)
+
+def has_legacy():
+    has_chunks = ChunkStore.exists(LEGACY_CHUNK_STORE_PATH) or os.path.exists(LEGACY_DATA_STORE_PATH)
+    return os.path.exists(LEGACY_INDEX_PATH) and has_chunks
+
+# --- Snapshot Contents ---
+def load_manifest(version):
+    path = LEGACY_MANIFEST_PATH if version == LEGACY_VERSION else os.path.join(version_dir(version), MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        log.error("Error loading manifest: %s", e)
+        return None
+
+def load_chunks(version):
+    """
+    Opens a version's chunks: a ChunkStore, or the legacy pickled list.
+    """
+    if version == LEGACY_VERSION:
+        if ChunkStore.exists(LEGACY_CHUNK_STORE_PATH):
+            return ChunkStore(LEGACY_CHUNK_STORE_PATH)
+        with open(LEGACY_DATA_STORE_PATH, 'rb') as f:
+            return pickle.load(f)
+    return ChunkStore(os.path.join(version_dir(version), CHUNKS_BASE))
+
+def load_metadata(version):
+    """
+    Returns a version's ChunkMetadata, or None for versions written without it.
+    """
+    if version == LEGACY_VERSION:
+        return None
+    base_path = os.path.join(version_dir(version), META_BASE)
+    return ChunkMetadata(base_path) if ChunkMetadata.exists(base_path) else None
+
+def load_lexical(version):
+    """
+    Returns a version's BM25 index, or None for versions written without one.
+    """
+    if version == LEGACY_VERSION:
+        return None
+    base_path = os.path.join(version_dir(version), LEXICAL_BASE)
+    return LexicalIndex.load(base_path) if LexicalIndex.exists(base_path) else None
+
+def load_index(version, mmap=False):
+    path = LEGACY_INDEX_PATH if version == LEGACY_VERSION else os.path.join(version_dir(version), INDEX_FILE)
+    return faiss.read_index(path, MMAP_FLAG if mmap else 0)
+
+class Brain:
+    """
+    One immutable brain snapshot: index, chunks, chunk metadata and BM25 index
+    (None for brains written before they existed) of a single version, plus
+    the embedding backend key its vectors were made with (None likewise).
+    Callers grab a reference once per request, so a swap never mixes versions.
+    """
+
+    def __init__(self, version, index, chunks, metadata=None, lexical=None, embedding=None, load_seconds=None):
+        self.version = version
+        self.index = index
+        self.chunks = chunks
+        self.metadata = metadata
+        self.lexical = lexical
+        self.embedding = embedding
+        self.load_seconds = load_seconds
+
+    @classmethod
+    def load(cls, version, mmap=True):
+        start = time.perf_counter()
+        index = load_index(version, mmap)
+        chunks = load_chunks(version)
+        metadata = load_metadata(version)
+        lexical = load_lexical(version)
+        embedding = (load_manifest(version) or {}).get('embedding')
+        return cls(version, index, chunks, metadata, lexical, embedding, time.perf_counter() - start)
+
+    def get_chunk(self, chunk_id):
+        """
+        Looks up a chunk by id. Works with the chunk store and legacy lists.
+        """
+        if isinstance(self.chunks, list):
+            return self.chunks[chunk_id] if 0 <= chunk_id < len(self.chunks) else None
+        return self.chunks.get(chunk_id)
+
+    def source(self, chunk_id):
+        return self.metadata.source(chunk_id) if self.metadata is not None else None
+
+    def __len__(self):
+        return len(self.chunks)
+
+# --- Live Version Tracking ---
+class BrainWatcher:
+    """
+    Tracks which version is live for this process. changed() stats CURRENT at
+    most every check_interval seconds, so every worker picks up a new version
+    on its next request after the interval, without a restart.
+    """
+
+    def __init__(self, check_interval=2.0):
+        self.check_interval = check_interval
+        self._stamp = object()  # (inode, mtime_ns, size) of CURRENT last time we looked; never matches at first
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _current_stamp():
+        try:
+            st = os.stat(CURRENT_PATH)
+            # os.replace gives CURRENT a new inode even when mtime and size match
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def changed(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return False
+        with self._lock:
+            self._checked = now
+            stamp = self._current_stamp()
+            if stamp == self._stamp:
+                return False
+            self._stamp = stamp
+            return True
+
+    def reset(self):
+        """
+        Forgets the last stamp, so the next check reports a change again;
+        called when loading the version it announced failed.
+        """
+        with self._lock:
+            self._stamp = object()
+
+def live_version():
+    """
+    The version readers should serve: CURRENT, else the legacy files, else None.
+    """
+    version = current_version()
+    if version is None and has_legacy():
+        return LEGACY_VERSION
+    return version
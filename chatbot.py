@@ -3,25 +3,74 @@ os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
 os.environ['FAISS_OPT_LEVEL'] = 'generic'
 from dotenv import load_dotenv
 load_dotenv()
-import pickle
 import faiss
 import numpy as np
-from datetime import datetime
+import logging
 import threading
 import requests
 import json
+import math
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
+from query_cache import EmbeddingCache, AnswerCache, RewriteCache, normalize_question
+from single_flight import SingleFlight
+import brain_store
+from brain_store import Brain, BrainWatcher
+import gemini_client
+import embeddings
+import chunker
+import sessions
+from sessions import estimate_tokens
+import query_rewrite
+from event_log import EventLog
+import metrics
+from metrics import span
+
+log = logging.getLogger(__name__)
 
 # --- Configuration ---
-LOG_FILE = 'unanswered_log.txt'
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-VECTOR_DB_PATH = os.path.join(BASE_DIR, "faiss_index")
-DATA_STORE_PATH = os.path.join(BASE_DIR, "data_store.pkl")
+# Memory-map the FAISS index instead of reading it into each process's heap
+BRAIN_MMAP = os.getenv("BRAIN_MMAP", "1") == "1"
+# How often each process checks brains/CURRENT for a newly published version
+BRAIN_CHECK_INTERVAL = float(os.getenv("BRAIN_CHECK_INTERVAL", "2.0"))
+
+# --- Retrieval Configuration ---
+CONFIDENCE_THRESHOLD = 2.0      # Max L2 distance for a chunk to count as relevant
+TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+MAX_CONTEXT_TOKENS = int(os.getenv("MAX_CONTEXT_TOKENS", "1500"))
+# Longest text two neighbouring chunks can share, in characters: the chunker
+# repeats up to CHUNK_OVERLAP_TOKENS tokens of whole sentences (~16 chars per
+# token is generous); brains from the old splitter overlap by 200 chars
+MAX_CHUNK_OVERLAP = max(300, chunker.CHUNK_OVERLAP_TOKENS * 16)
+
+# --- Hybrid Retrieval (BM25 + vectors, fused by reciprocal rank) ---
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1") == "1"
+RRF_K = 60                      # Standard RRF constant; damps the weight of top ranks
+# Share of the question's IDF weight a BM25 hit must match to count as relevant
+LEXICAL_MIN_COVERAGE = float(os.getenv("LEXICAL_MIN_COVERAGE", "0.6"))
+# When BM25 already found something, the embedding gets this long before we answer without it
+EMBEDDING_DEADLINE = float(os.getenv("EMBEDDING_DEADLINE", "2.0"))
+
+# --- Follow-up Query Rewriting (search text only; the model still sees the question as asked) ---
+QUERY_REWRITE = os.getenv("QUERY_REWRITE", "1") == "1"
+# Ask a model to rewrite follow-ups the local heuristic can't resolve on its own
+QUERY_REWRITE_LLM = os.getenv("QUERY_REWRITE_LLM", "1") == "1"
+QUERY_REWRITE_DEADLINE = float(os.getenv("QUERY_REWRITE_DEADLINE", "2.0"))  # Seconds before using the heuristic
+
+# --- Request Coalescing ---
+# Identical new-conversation questions arriving together (a class told to ask
+# the same thing) share one retrieval and one model call per process
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "1") == "1"
+
+# --- ANN Search Tunables (ignored by index types they don't apply to) ---
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))         # IVF lists scanned per query
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64")) # HNSW candidate list size
 
 # --- Gemini API Configuration ---
-API_KEY = os.getenv("GEMINI_API_KEY")
+API_KEY = gemini_client.API_KEY
 if not API_KEY or API_KEY == "Paste_Your_Gemini_API_Key_Here":
-    print("WARNING: GEMINI_API_KEY not set in .env file.")
+    log.warning("GEMINI_API_KEY not set in .env file.")
 
 # Optimized list of models. We try the most likely to work/fastest first.
 MODEL_CANDIDATES = [
@@ -30,69 +79,297 @@ MODEL_CANDIDATES = [
     "gemini-2.0-flash"                      # Standard 2.0 Flash
 ]
 
+# --- Hedged Fallback & Circuit Breakers ---
+# If the current model hasn't answered after HEDGE_DELAY seconds, the next
+# candidate is started in parallel and the first good answer wins.
+# 0 disables hedging (models are tried one after another).
+HEDGE_DELAY = float(os.getenv("GEMINI_HEDGE_DELAY", "3.0"))
+HEDGE_WORKERS = int(os.getenv("GEMINI_HEDGE_WORKERS", "16"))
+# Base cooldowns (doubled per consecutive failure) before a failing model is tried again
+BREAKER_COOLDOWN_429 = float(os.getenv("GEMINI_BREAKER_COOLDOWN_429", "30"))
+BREAKER_COOLDOWN_404 = float(os.getenv("GEMINI_BREAKER_COOLDOWN_404", "3600"))
+BREAKER_COOLDOWN_ERROR = float(os.getenv("GEMINI_BREAKER_COOLDOWN_ERROR", "10"))
+
+model_breaker = gemini_client.CircuitBreaker()
+_generation_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="gemini")
+
+def trip_model(model_name, status_code):
+    if status_code == 404:
+        cooldown = model_breaker.trip(model_name, BREAKER_COOLDOWN_404)
+    elif status_code == 429:
+        cooldown = model_breaker.trip(model_name, BREAKER_COOLDOWN_429)
+    else:
+        cooldown = model_breaker.trip(model_name, BREAKER_COOLDOWN_ERROR)
+    metrics.BREAKER_TRIPS.inc(model=model_name, status=status_code or 'error')
+    log.warning("Skipping %s for %.0fs after %s", model_name, cooldown, status_code or 'request error')
+
+def available_models():
+    # Lazy, so a half-open model's trial is only claimed when it is about to be called
+    return (m for m in MODEL_CANDIDATES if not model_breaker.is_open(m))
+
 # --- Cloud Embedding Function ---
-def get_embedding(text):
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/text-embedding-004:embedContent?key={API_KEY}"
-    payload = {
-        "model": "models/text-embedding-004",
-        "content": {
-            "parts": [{"text": text}]
-        }
-    }
-    headers = {'Content-Type': 'application/json'}
+embedding_cache = EmbeddingCache()
+
+def query_backend(snapshot):
+    """
+    The embedding backend questions must use: the one the brain was built with.
+    """
+    return embeddings.get_backend(snapshot.embedding or embeddings.LEGACY_EMBEDDING_KEY)
+
+def get_embedding(text, deadline=None, backend=None):
+    """
+    Returns the question's embedding, from the LRU cache when it was asked before.
+    With a deadline, gives up waiting after that many seconds and returns None;
+    the call carries on in the background and caches its result for next time.
+    """
+    backend = backend or embeddings.get_backend()
+    cached = embedding_cache.get(text, namespace=backend.key)
+    metrics.CACHE_LOOKUPS.inc(cache='embedding', result='hit' if cached is not None else 'miss')
+    if cached is not None:
+        return cached
+    if deadline is None:
+        return fetch_and_cache_embedding(text, backend)
+    future = _generation_pool.submit(fetch_and_cache_embedding, text, backend)
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=10)
-        if response.status_code == 200:
-            return response.json()['embedding']['values']
-        else:
-            print(f"Error getting embedding: {response.text}")
-            return None
-    except Exception as e:
-        print(f"Error: {e}")
+        return future.result(timeout=deadline)
+    except FutureTimeout:
+        log.debug("Embedding took over %ss, answering from BM25 only", deadline)
+        return None
+
+def fetch_and_cache_embedding(text, backend):
+    embedding = fetch_embedding(text, backend)
+    if embedding is None:
+        # Lets the next questions skip straight to the BM25 fast path for a while
+        model_breaker.trip(backend.key, BREAKER_COOLDOWN_ERROR)
+        metrics.BREAKER_TRIPS.inc(model=backend.key, status='error')
         return None
+    model_breaker.success(backend.key)
+    return embedding_cache.put(text, embedding, namespace=backend.key)
+
+def fetch_embedding(text, backend):
+    return backend.embed(text, timeout=10)
 
 # --- Global variables for our 'brain' ---
-index = None
-chunks = []
+answer_cache = AnswerCache()
+FALLBACK_NOTE = "**Note:**"  # Prefix of the raw-context fallback, which is never cached
+
+brain = None  # The live Brain snapshot; swapped whole, never modified in place
+_brain_lock = threading.Lock()
+brain_watcher = BrainWatcher(BRAIN_CHECK_INTERVAL)
+_search_overrides = {}  # nprobe / ef_search given to load_brain, kept for every later reload
 
-def load_brain():
+def apply_search_params(index, nprobe=None, ef_search=None):
     """
-    This function loads the FAISS index and the text chunks into memory.
+    Sets the recall/latency knobs of IVF (nprobe) and HNSW (efSearch) indexes.
     """
-    global index, chunks
-    if not os.path.exists(VECTOR_DB_PATH) or not os.path.exists(DATA_STORE_PATH):
-        print("Error: FAISS index or data store not found. Run 'ingest.py' first.")
-        return
-    print("Loading FAISS index and data store...")
-    try:
-        index = faiss.read_index(VECTOR_DB_PATH)
-        with open(DATA_STORE_PATH, 'rb') as f:
-            chunks = pickle.load(f)
-        print(f"✅ AI Brain (FAISS) loaded successfully with {len(chunks)} chunks.")
-    except Exception as e:
-        print(f"Error loading AI brain: {e}")
+    params = faiss.ParameterSpace()
+    for name, value in (('nprobe', nprobe or IVF_NPROBE), ('efSearch', ef_search or HNSW_EF_SEARCH)):
+        try:
+            params.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass  # Parameter does not apply to this index type
 
-def log_unanswered_question(question):
+def load_brain(nprobe=None, ef_search=None):
     """
-    Writes a question to our log file in a separate thread.
+    This function loads the live brain version (index + text chunks) and
+    swaps it in with a single assignment, so in-flight requests finish on the
+    snapshot they started with. Both files are memory-mapped (unless
+    BRAIN_MMAP=0), so loading is near-instant and processes forked after it
+    (gunicorn --preload) share the same pages.
+    nprobe / ef_search override IVF_NPROBE / HNSW_EF_SEARCH for ANN indexes,
+    for this and every later version loaded.
     """
-    try:
-        with open(LOG_FILE, 'a', encoding='utf-8') as f:
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            f.write(f"[{timestamp}] - {question}\n")
-    except Exception as e:
-        print(f"Error logging unanswered question: {e}")
+    global brain
+    with _brain_lock:
+        overridden = False
+        for name, value in (('nprobe', nprobe), ('ef_search', ef_search)):
+            if value is not None and _search_overrides.get(name) != value:
+                _search_overrides[name] = value
+                overridden = True
+        version = brain_store.live_version()
+        if version is None:
+            if brain is not None:
+                log.info("Knowledge base was cleared; unloading AI brain.")
+            else:
+                log.error("FAISS index or data store not found. Run 'ingest.py' first.")
+            brain = None
+            answer_cache.clear()
+            return None
+        if brain is not None and brain.version == version and not overridden:
+            return brain  # Already live
+        log.info("Loading AI brain version '%s'...", version)
+        try:
+            new_brain = Brain.load(version, mmap=BRAIN_MMAP)
+            apply_search_params(new_brain.index, **_search_overrides)
+        except Exception as e:
+            log.error("Error loading AI brain: %s", e)
+            brain_watcher.reset()  # Retry after the next check interval instead of waiting for another version
+            return brain
+        brain = new_brain
+        answer_cache.clear()  # Cached answers may cite chunks that changed
+        log.info("✅ AI Brain (FAISS) loaded successfully with %d chunks in %.1f ms.", len(brain), brain.load_seconds * 1000)
+        return brain
+
+def get_brain():
+    """
+    Returns the live snapshot, first reloading it if a new version has been
+    published (by this or any other process) since the last check.
+    """
+    if brain_watcher.changed():
+        return load_brain()
+    return brain
+
+# --- Context Assembly ---
+def merge_overlapping(first, second):
+    """
+    Joins two neighbouring chunks, dropping the sentences the second one
+    repeats from the end of the first (the chunker's overlap).
+    """
+    max_k = min(len(first), len(second), MAX_CHUNK_OVERLAP)
+    for k in range(max_k, 20, -1):
+        if first.endswith(second[:k]):
+            return first + second[k:]
+    return first + "\n" + second
+
+def assemble_context(snapshot, chunk_ids, max_tokens=MAX_CONTEXT_TOKENS):
+    """
+    Builds one context string from ranked chunk ids.
+    Neighbouring chunks of the same file are merged into a single passage (so
+    their overlap is only sent once), passages keep the rank of their best
+    chunk, and chunks are added in rank order until the token budget is spent.
+    """
+    files = {}
+
+    def file_of(chunk_id):
+        # None for brains without chunk metadata, whose neighbours are merged as before
+        if chunk_id not in files:
+            source = snapshot.source(chunk_id)
+            files[chunk_id] = source['file'] if source else None
+        return files[chunk_id]
+
+    def build(selected):
+        runs = []  # Runs of consecutive chunk ids, in document order
+        for chunk_id in sorted(selected):
+            if runs and chunk_id == runs[-1][-1] + 1 and file_of(chunk_id) == file_of(runs[-1][-1]):
+                runs[-1].append(chunk_id)
+            else:
+                runs.append([chunk_id])
+        runs.sort(key=lambda ids: min(selected[i] for i in ids))
+        passages = []
+        for ids in runs:
+            text = snapshot.get_chunk(ids[0])
+            for chunk_id in ids[1:]:
+                text = merge_overlapping(text, snapshot.get_chunk(chunk_id))
+            passages.append(text)
+        return "\n\n---\n\n".join(passages)
+
+    selected = {}
+    context = ""
+    for rank, chunk_id in enumerate(chunk_ids):
+        text = snapshot.get_chunk(chunk_id)
+        if not text or chunk_id in selected:
+            continue
+        if text in context:
+            continue  # Already fully covered by another passage
+        candidate = {**selected, chunk_id: rank}
+        candidate_context = build(candidate)
+        if selected and estimate_tokens(candidate_context) > max_tokens:
+            continue
+        selected, context = candidate, candidate_context
+
+    # The best chunk is always used, even if it alone exceeds the budget
+    return context[:max_tokens * 4]
+
+def filter_params(index, allowed_ids):
+    """
+    Search parameters restricting a search to allowed_ids. The filter drops
+    most candidates of each probed IVF list or HNSW neighbourhood, so the
+    index's nprobe / efSearch are raised by the share of the index it
+    excludes (up to a full scan) to keep finding as many allowed chunks.
+    """
+    selector = faiss.IDSelectorBatch(np.asarray(allowed_ids, dtype='int64'))
+    widen = max(1.0, index.ntotal / max(1, len(allowed_ids)))
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=min(index.nlist, math.ceil(index.nprobe * widen)))
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else None
+    if isinstance(inner, faiss.IndexHNSW):
+        ef_search = min(max(index.ntotal, TOP_K), math.ceil(inner.hnsw.efSearch * widen))
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search)
+    return faiss.SearchParameters(sel=selector)
+
+def search_chunks(snapshot, question_embedding, k=TOP_K, allowed_ids=None):
+    """
+    Returns [(chunk_id, distance), ...] for the k nearest chunks, best first,
+    optionally only among allowed_ids.
+    """
+    k = max(1, min(k, snapshot.index.ntotal))
+    if allowed_ids is None:
+        D, I = snapshot.index.search(question_embedding, k=k)
+    else:
+        D, I = snapshot.index.search(question_embedding, k, params=filter_params(snapshot.index, allowed_ids))
+    return [(int(i), float(d)) for i, d in zip(I[0], D[0]) if i != -1]
+
+def search_lexical(snapshot, question, k=TOP_K, allowed_ids=None):
+    """
+    Returns [(chunk_id, bm25_score, coverage), ...] best first, or [] when
+    hybrid retrieval is off or the brain has no BM25 index.
+    """
+    if not HYBRID_RETRIEVAL or snapshot.lexical is None:
+        return []
+    return snapshot.lexical.search(question, k=k, chunk_ids=allowed_ids)
+
+def cite_sources(snapshot, chunk_ids):
+    """
+    Returns [{'file', 'page'}, ...] for the chunks, best first, one entry per
+    distinct file and page. Empty for brains without chunk metadata.
+    """
+    sources, seen = [], set()
+    for chunk_id in chunk_ids:
+        source = snapshot.source(chunk_id)
+        if source is None or (source['file'], source['page']) in seen:
+            continue
+        seen.add((source['file'], source['page']))
+        sources.append(source)
+    return sources
+
+def fuse_rankings(*rankings, k=TOP_K):
+    """
+    Reciprocal-rank fusion of several best-first chunk id lists: a chunk's
+    score is the sum of 1 / (RRF_K + rank) over the lists it appears in.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank)
+    return sorted(scores, key=lambda chunk_id: -scores[chunk_id])[:k]
+
+# Unanswered questions and feedback, written in batches by a background thread
+_event_log = None
+_event_log_lock = threading.Lock()
+
+def get_event_log():
+    """
+    Returns the process-wide EventLog, opening events.db on first use rather
+    than when this module is imported.
+    """
+    global _event_log
+    if _event_log is None:
+        with _event_log_lock:
+            if _event_log is None:
+                _event_log = EventLog()
+    return _event_log
+
+def log_unanswered_question(question):
+    get_event_log().log('unanswered', question)
 
 # --- UPDATED: Generative Function (The "G" in RAG) ---
-def get_generative_answer(context, question, chat_history, retries_per_model=1):
+def build_generation_payload(context, question, chat_history):
     """
-    Calls the Gemini API to generate a clean answer based on context AND chat history.
-    Iterates through MODEL_CANDIDATES. Fails gracefully if all are blocked.
+    Builds the generateContent / streamGenerateContent request body.
     """
-    print("DEBUG (Gemini): Generating clean answer with history...")
     system_prompt = (
         "You are a helpful and concise assistant, an expert in Design and Analysis of Algorithms (DAA) and Computer Science. "
-        "Use the provided CONTEXT (which is a chunk from a textbook) to answer the user's new QUESTION. "
+        "Use the provided CONTEXT (one or more excerpts from a textbook, separated by '---') to answer the user's new QUESTION. "
         "Use the CHAT HISTORY for context if the question is a follow-up (e.g., 'why?' or 'explain that')."
         "Answer *only* based on the context. Do not make up information. "
         "Be direct, clear, and explain concepts step-by-step if needed."
@@ -122,94 +399,471 @@ def get_generative_answer(context, question, chat_history, retries_per_model=1):
             {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"}
         ]
     }
-    
-    headers = {'Content-Type': 'application/json'}
-    
-    for model_name in MODEL_CANDIDATES:
-        print(f"DEBUG: Trying model: {model_name}")
-        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={API_KEY}"
-        
-        for i in range(retries_per_model + 1): # +1 for the initial try
-            try:
-                response = requests.post(api_url, headers=headers, data=json.dumps(payload), timeout=15)
-                
-                if response.status_code == 200:
-                    result = response.json()
+    return payload
+
+def summarize_conversation(summary, messages):
+    """
+    Folds older chat messages into the running conversation summary (see
+    sessions.SessionStore). Returns None if no model could do it.
+    """
+    transcript = "\n".join(f"{m['role'].upper()}: {sessions.message_text(m)}" for m in messages)
+    prompt = (
+        f"Update the summary of a conversation between a student and a tutoring assistant. "
+        f"Keep the topics, the facts established and what the student is trying to do, "
+        f"in at most {sessions.SUMMARY_TOKENS * 3 // 4} words.\n\n"
+        f"CURRENT SUMMARY:\n{summary or '(none)'}\n\nNEW MESSAGES:\n{transcript}"
+    )
+    payload = {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": {"temperature": 0.1, "maxOutputTokens": sessions.SUMMARY_TOKENS * 2},
+    }
+    for model_name in available_models():
+        text = call_model(model_name, payload, retries_per_model=0)
+        if text:
+            return text.replace(" ... (answer shortened)", "").strip()
+    return None
+
+def fallback_answer(context):
+    # Graceful Fallback: Just show the text nicely.
+    return f"{FALLBACK_NOTE} I'm currently experiencing high traffic on my summarization engine. Here is the relevant information directly from the handbook:\n\n{context}"
+
+def observe_call(model_name, start, outcome):
+    metrics.MODEL_CALL_SECONDS.observe(time.perf_counter() - start, model=model_name, outcome=outcome)
+
+def call_model(model_name, payload, retries_per_model=1, cancelled=None):
+    """
+    Asks one model for an answer. Returns the text, or None if the model
+    failed, was blocked, or the call was cancelled because another won.
+    A 429/404/5xx trips the model's circuit breaker instead of sleeping and
+    retrying; only network errors are retried (retries_per_model times).
+    """
+    cancelled = cancelled or threading.Event()
+    log.debug("Trying model: %s", model_name)
+    for i in range(retries_per_model + 1): # +1 for the initial try
+        if cancelled.is_set():
+            return None
+        start = time.perf_counter()
+        try:
+            response = gemini_client.post(model_name, "generateContent", payload, timeout=15)
+            
+            if response.status_code == 200:
+                model_breaker.success(model_name)
+                result = response.json()
+                try:
+                    candidate = result.get('candidates', [])[0]
+                    finish_reason = candidate.get('finishReason')
+                    
+                    if finish_reason and finish_reason != 'STOP':
+                        if finish_reason == "MAX_TOKENS" and candidate.get('content', {}).get('parts', [])[0].get('text'):
+                             observe_call(model_name, start, 'max_tokens')
+                             return candidate.get('content', {}).get('parts', [])[0].get('text') + " ... (answer shortened)"
+                        # Usually safety block.
+                        observe_call(model_name, start, 'blocked')
+                        log.info("Blocked by safety/other: %s", finish_reason)
+                        return None
+
+                    text = candidate.get('content', {}).get('parts', [])[0].get('text')
+                    if text:
+                        observe_call(model_name, start, 'ok')
+                        return text
+                    observe_call(model_name, start, 'empty')
+                    log.warning("No 'text' in candidate parts. %s", result)
+                    return None
+
+                except (IndexError, KeyError, AttributeError, TypeError) as e:
+                    observe_call(model_name, start, 'bad_response')
+                    log.warning("Error parsing response JSON: %s", e)
+                    return None
+
+            observe_call(model_name, start, str(response.status_code))
+            if response.status_code == 429:
+                log.warning("Rate limit hit for %s.", model_name)
+            elif response.status_code == 404:
+                log.warning("Model %s not found.", model_name)
+            else:
+                log.warning("API Error %s for %s", response.status_code, model_name)
+            if response.status_code in (404, 429) or response.status_code >= 500:
+                trip_model(model_name, response.status_code)
+            return None
+
+        except requests.exceptions.RequestException as e:
+            observe_call(model_name, start, 'network_error')
+            log.warning("Request to %s failed: %s", model_name, e)
+            if i < retries_per_model:
+                metrics.MODEL_RETRIES.inc(model=model_name)
+                cancelled.wait(1)
+            else:
+                trip_model(model_name, None)
+    return None
+
+def get_generative_answer(context, question, chat_history, retries_per_model=1):
+    """
+    Calls the Gemini API to generate a clean answer based on context AND chat history.
+    Starts with the first MODEL_CANDIDATES entry whose breaker is closed, hedges
+    with the next one after HEDGE_DELAY (or as soon as one fails), and returns
+    the first good answer. Fails gracefully if all are blocked.
+    """
+    log.debug("Generating clean answer with history...")
+    payload = build_generation_payload(context, question, chat_history)
+
+    models = available_models()
+    cancelled = threading.Event()
+    pending = set()
+
+    def launch_next():
+        # Returns False when there is no model left to try
+        model_name = next(models, None)
+        if model_name is None:
+            return False
+        pending.add(_generation_pool.submit(call_model, model_name, payload, retries_per_model, cancelled))
+        return True
+
+    launch_next()
+    try:
+        while pending:
+            done, _ = wait(pending, timeout=HEDGE_DELAY or None, return_when=FIRST_COMPLETED)
+            if not done:
+                if launch_next():
+                    log.debug("No reply yet, hedging with the next model")
+                    metrics.MODEL_HEDGES.inc()
+                continue
+            for future in done:
+                pending.discard(future)
+                text = future.result()
+                if text:
+                    return text
+                launch_next()  # Replace the failed attempt
+    finally:
+        # Losing attempts stop retrying; their responses are ignored
+        cancelled.set()
+        for future in pending:
+            future.cancel()
+
+    log.warning("All models failed or were blocked.")
+    metrics.FALLBACK_ANSWERS.inc(mode='generate')
+    return fallback_answer(context)
+
+def stream_generative_answer(context, question, chat_history, status=None):
+    """
+    Same as get_generative_answer, but yields the answer text piece by piece
+    from streamGenerateContent (SSE) as Gemini produces it.
+    A model that fails before sending any text is skipped straight away (no
+    retry sleep, to keep time-to-first-token low); once text has been sent the
+    stream can't be restarted on another model, so it just ends.
+    status['complete'] (if a dict is passed) is set to whether the answer
+    ended normally: False when the stream broke off or was blocked partway.
+    """
+    status = status if status is not None else {}
+    status['complete'] = False
+    log.debug("Streaming answer with history...")
+    payload = build_generation_payload(context, question, chat_history)
+
+    for model_name in available_models():
+        log.debug("Trying model (stream): %s", model_name)
+        produced = False
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            with gemini_client.post(model_name, "streamGenerateContent", payload, timeout=15, stream=True, alt="sse") as response:
+                if response.status_code != 200:
+                    outcome = str(response.status_code)
+                    log.warning("API Error %s for %s", response.status_code, model_name)
+                    if response.status_code in (404, 429) or response.status_code >= 500:
+                        trip_model(model_name, response.status_code)
+                    continue
+                model_breaker.success(model_name)
+                response.encoding = 'utf-8'
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
                     try:
-                        candidate = result.get('candidates', [])[0]
-                        finish_reason = candidate.get('finishReason')
-                        
-                        if finish_reason and finish_reason != 'STOP':
-                            if finish_reason == "MAX_TOKENS" and candidate.get('content', {}).get('parts', [])[0].get('text'):
-                                 return candidate.get('content', {}).get('parts', [])[0].get('text') + " ... (answer shortened)"
-                            # If blocked, try next model? Or just return raw text?
-                            # Usually safety block.
-                            print(f"DEBUG: Blocked by safety/other: {finish_reason}")
-                            break 
-
-                        text = candidate.get('content', {}).get('parts', [])[0].get('text')
-                        if text:
-                            return text
-                        else:
-                            print(f"DEBUG (Gemini): No 'text' in candidate parts. {result}")
-                            break
-
-                    except (IndexError, KeyError, AttributeError, TypeError) as e:
-                        print(f"DEBUG (Gemini): Error parsing response JSON: {e}")
+                        candidate = json.loads(line[5:])['candidates'][0]
+                    except (ValueError, IndexError, KeyError, TypeError) as e:
+                        log.warning("Error parsing stream event: %s", e)
+                        continue
+                    text = "".join(part.get('text', '') for part in candidate.get('content', {}).get('parts', []))
+                    if text:
+                        if not produced:
+                            metrics.STAGE_SECONDS.observe(time.perf_counter() - start, stage='first_token')
+                        produced = True
+                        yield text
+                    finish_reason = candidate.get('finishReason')
+                    if finish_reason == 'STOP':
+                        status['complete'] = True
+                    elif finish_reason == 'MAX_TOKENS' and produced:
+                        yield " ... (answer shortened)"
+                    elif finish_reason and finish_reason not in ('STOP', 'MAX_TOKENS'):
+                        outcome = 'blocked'
+                        log.info("Blocked by safety/other: %s", finish_reason)
                         break
+        except requests.exceptions.RequestException as e:
+            outcome = 'network_error'
+            log.warning("Stream request to %s failed: %s", model_name, e)
+        finally:
+            if outcome == 'ok' and produced and not status['complete']:
+                outcome = 'incomplete'
+            metrics.MODEL_CALL_SECONDS.observe(time.perf_counter() - start, model=model_name,
+                                               outcome=outcome if produced or outcome != 'ok' else 'empty')
+        if produced:
+            if not status['complete']:
+                log.warning("Stream from %s ended early (%s)", model_name, outcome)
+            return
 
-                elif response.status_code == 429:
-                    print(f"DEBUG (Gemini): Rate limit hit for {model_name}. Retrying...")
-                    time.sleep(1) # Short wait
-                elif response.status_code == 404:
-                    print(f"DEBUG (Gemini): Model {model_name} not found. Skipping.")
-                    break 
-                else:
-                    print(f"DEBUG (Gemini): API Error {response.status_code} for {model_name}")
-                    break
-
-            except requests.exceptions.RequestException as e:
-                print(f"DEBUG (Gemini): Request failed: {e}")
-                time.sleep(1)
-        
-    
-    print("DEBUG (Gemini): All models failed or were blocked.")
-    # Graceful Fallback: Just show the text nicely.
-    return f"**Note:** I'm currently experiencing high traffic on my summarization engine. Here is the relevant information directly from the handbook:\n\n{context}"
+    log.warning("All models failed or were blocked.")
+    metrics.FALLBACK_ANSWERS.inc(mode='stream')
+    status['complete'] = True
+    yield fallback_answer(context)
 
-# --- Main Bot Response Function ---
-def get_bot_response(user_question, chat_history):
-    global index, chunks
-    if index is None or not chunks:
-        load_brain()
-        
-    if index is None or not chunks:
-        return "I'm sorry, my brain is not loaded. Please ask an admin to train me."
+# --- Follow-up Query Rewriting ---
+rewrite_cache = RewriteCache()
+
+def rewrite_with_model(question, chat_history):
+    """
+    Asks the first available model for a standalone version of a follow-up.
+    Returns None on failure.
+    """
+    transcript = "\n".join(f"{m.get('role', 'user').upper()}: {sessions.message_text(m)[:500]}"
+                           for m in chat_history[-4:])
+    prompt = (
+        "Rewrite the student's follow-up question as a single standalone search query, "
+        "naming the topic it refers to. Reply with the query only.\n\n"
+        f"CONVERSATION:\n{transcript}\n\nFOLLOW-UP: {question}"
+    )
+    payload = {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": {"temperature": 0.0, "maxOutputTokens": 64},
+    }
+    for model_name in available_models():
+        text = call_model(model_name, payload, retries_per_model=0)
+        if text:
+            return " ".join(text.replace(" ... (answer shortened)", "").split()).strip('"')
+    return None
+
+def rewrite_query(question, chat_history):
+    """
+    Returns the text to search with. Standalone questions are used as is.
+    A follow-up is joined to the earlier question it refers to; one that also
+    brings new content of its own ("what about 3NF?"), or whose topic isn't in
+    the recent messages, is rewritten by a model when QUERY_REWRITE_LLM is on.
+    """
+    if not QUERY_REWRITE or not chat_history:
+        return question
+    kind = query_rewrite.classify(question)
+    if kind == query_rewrite.STANDALONE:
+        return question
+    topic = query_rewrite.find_topic(chat_history)
+    if (kind == query_rewrite.REFERENCE and topic is not None) or not QUERY_REWRITE_LLM:
+        return query_rewrite.heuristic_rewrite(question, topic)
 
+    context = " ".join(sessions.message_text(m) for m in chat_history[-2:])
+    cached = rewrite_cache.get(question, context)
+    metrics.CACHE_LOOKUPS.inc(cache='rewrite', result='hit' if cached is not None else 'miss')
+    if cached is not None:
+        return cached
+    # Like get_embedding: a late rewrite still lands in the cache for the retry
+    future = _generation_pool.submit(fetch_and_cache_rewrite, question, chat_history, context)
     try:
-        q_emb = get_embedding(user_question)
-        if q_emb is None:
-             return "I'm having trouble understanding (Embedding Error)."
-        
+        rewritten = future.result(timeout=QUERY_REWRITE_DEADLINE)
+    except FutureTimeout:
+        log.debug("Query rewrite took over %ss, using the heuristic", QUERY_REWRITE_DEADLINE)
+        rewritten = None
+    return rewritten or query_rewrite.heuristic_rewrite(question, topic)
+
+def fetch_and_cache_rewrite(question, chat_history, context):
+    rewritten = rewrite_with_model(question, chat_history)
+    if rewritten:
+        rewrite_cache.put(question, context, rewritten)
+    return rewritten
+
+# --- Main Bot Response Function ---
+def retrieve_context(user_question, chat_history, document=None):
+    """
+    The retrieval half of RAG. Returns a dict with either a final 'answer'
+    (brain not loaded, embedding error, cache hit or no confident match), or
+    the assembled 'context' plus what is needed to cache the generated answer.
+    Either way 'sources' lists the cited files and pages. document, if given,
+    restricts the search to that uploaded file.
+    """
+    with span('retrieve'):
+        retrieval = _retrieve_context(user_question, chat_history, document)
+    if retrieval['answer'] is not None:
+        metrics.ANSWERS.inc(outcome=retrieval.get('outcome', 'error'))
+    return retrieval
+
+def _retrieve_context(user_question, chat_history, document):
+    snapshot = get_brain()  # Held for the whole request, even if a new version goes live
+    if snapshot is None or len(snapshot) == 0:
+        return {'answer': "I'm sorry, my brain is not loaded. Please ask an admin to train me.", 'sources': [],
+                'outcome': 'no_brain'}
+
+    allowed_ids = None
+    if document:
+        if snapshot.metadata is None:
+            return {'answer': "I'm sorry, this brain can't search by document yet. Please ask an admin to retrain me.",
+                    'sources': [], 'outcome': 'unknown_document'}
+        allowed_ids = snapshot.metadata.chunk_ids(document)
+        if len(allowed_ids) == 0:
+            return {'answer': f"I'm sorry, I don't know a document named '{document}'.", 'sources': [],
+                    'outcome': 'unknown_document'}
+        log.debug("Searching %d chunks of '%s'", len(allowed_ids), document)
+
+    log.debug("User asked: '%s'", user_question)
+    with span('rewrite'):
+        search_query = rewrite_query(user_question, chat_history)
+    if search_query != user_question:
+        log.debug("Searching for follow-up as: '%s'", search_query)
+    with span('lexical_search'):
+        lexical_hits = search_lexical(snapshot, search_query, allowed_ids=allowed_ids)
+    lexical_ids = [chunk_id for chunk_id, _, coverage in lexical_hits if coverage >= LEXICAL_MIN_COVERAGE]
+    if lexical_hits:
+        log.debug("Best lexical match is chunk %s with coverage: %.2f", lexical_hits[0][0], lexical_hits[0][2])
+
+    # BM25 fast path: with confident lexical hits, don't wait long for (or
+    # even call, while its breaker is open) the embedding API
+    backend = query_backend(snapshot)
+    if lexical_ids and model_breaker.is_open(backend.key):
+        q_emb = None
+    else:
+        with span('embedding'):
+            q_emb = get_embedding(search_query, deadline=EMBEDDING_DEADLINE if lexical_ids else None, backend=backend)
+    if q_emb is None and not lexical_ids:
+        return {'answer': "I'm having trouble understanding (Embedding Error).", 'sources': [],
+                'outcome': 'embedding_error'}
+
+    dense_ids, distance = [], None
+    if q_emb is not None:
         question_embedding = np.array([q_emb]).astype('float32')
-        D, I = index.search(question_embedding, k=1)
-        
-        best_match_index = I[0][0]
-        distance = D[0][0]
-
-        print(f"DEBUG: User asked: '{user_question}'")
-        print(f"DEBUG: Best match is chunk {best_match_index} with distance: {distance}")
-
-        CONFIDENCE_THRESHOLD = 2.0 
-        
-        if distance < CONFIDENCE_THRESHOLD:
-            context_chunk = chunks[best_match_index]
-            generative_answer = get_generative_answer(context_chunk, user_question, chat_history)
-            return generative_answer
-        else:
-            threading.Thread(target=log_unanswered_question, args=(user_question,)).start()
-            return f"I'm sorry, I couldn't find a confident answer for that. (Best match distance: {distance:.2f} / Threshold: {CONFIDENCE_THRESHOLD})"
+        with span('vector_search'):
+            hits = search_chunks(snapshot, question_embedding, allowed_ids=allowed_ids)
+        if hits:  # A filtered ANN search can still come back empty
+            best_match_index, distance = hits[0]
+            log.debug("Best match is chunk %s with distance: %s", best_match_index, distance)
+            dense_ids = [chunk_id for chunk_id, d in hits if d < CONFIDENCE_THRESHOLD]
+
+    confident_ids = fuse_rankings(dense_ids, lexical_ids)
+    if not confident_ids:
+        log_unanswered_question(user_question)
+        best = f"Best match distance: {distance:.2f}" if distance is not None else "No close match"
+        return {'answer': f"I'm sorry, I couldn't find a confident answer for that. ({best} / Threshold: {CONFIDENCE_THRESHOLD})",
+                'sources': [], 'outcome': 'unanswered'}
+
+    # Follow-ups depend on the conversation, so only history-free questions are cached.
+    # Chunk ids are only meaningful within one brain version.
+    context_key = [snapshot.version] + sorted(confident_ids)
+    sources = cite_sources(snapshot, confident_ids)
+    if not chat_history and q_emb is not None and answer_cache.enabled:
+        cached_answer = answer_cache.get(q_emb, context_key)
+        metrics.CACHE_LOOKUPS.inc(cache='answer', result='hit' if cached_answer is not None else 'miss')
+        if cached_answer is not None:
+            log.debug("Answer cache hit")
+            return {'answer': cached_answer, 'sources': sources, 'outcome': 'cache_hit'}
+
+    with span('assemble_context'):
+        context = assemble_context(snapshot, confident_ids)
+    log.debug("Using %d chunks (%d dense, %d lexical), ~%d context tokens",
+              len(confident_ids), len(dense_ids), len(lexical_ids), estimate_tokens(context))
+    return {'answer': None, 'context': context, 'embedding': q_emb, 'context_key': context_key, 'sources': sources}
+
+def remember_answer(retrieval, chat_history, answer):
+    if not chat_history and retrieval['embedding'] is not None and answer and not answer.startswith(FALLBACK_NOTE):
+        answer_cache.put(retrieval['embedding'], retrieval['context_key'], answer)
 
+answer_flights = SingleFlight()
+
+def coalescing_key(user_question, chat_history, document):
+    """
+    Key under which identical in-flight questions share one answer, or None.
+    Only questions that start a conversation qualify: with history, the
+    same words can ask something different.
+    """
+    if not COALESCE_REQUESTS or chat_history:
+        return None
+    return (normalize_question(user_question), document)
+
+def answer_question(user_question, chat_history, document=None):
+    """
+    Returns {'answer', 'sources'}, sources being the files and pages the
+    answer was drawn from.
+    """
+    key = coalescing_key(user_question, chat_history, document)
+    if key is None:
+        return _answer_question(user_question, chat_history, document)
+    response, shared = answer_flights.do(('answer',) + key, _answer_question, user_question, chat_history, document)
+    if shared:
+        metrics.ANSWERS.inc(outcome='coalesced')
+    return {'answer': response['answer'], 'sources': list(response['sources'])}
+
+def _answer_question(user_question, chat_history, document):
+    try:
+        retrieval = retrieve_context(user_question, chat_history, document)
+        if retrieval['answer'] is not None:
+            return {'answer': retrieval['answer'], 'sources': retrieval['sources']}
+        with span('generate'):
+            generative_answer = get_generative_answer(retrieval['context'], user_question, chat_history)
+        metrics.ANSWERS.inc(outcome='generated')
+        remember_answer(retrieval, chat_history, generative_answer)
+        return {'answer': generative_answer, 'sources': retrieval['sources']}
+
+    except Exception as e:
+        log.exception("Error in _answer_question: %s", e)
+        metrics.ANSWERS.inc(outcome='error')
+        return {'answer': "An error occurred. Please try again.", 'sources': []}
+
+def get_bot_response(user_question, chat_history, document=None):
+    return answer_question(user_question, chat_history, document)['answer']
+
+def stream_bot_response(user_question, chat_history, document=None, sources=None, status=None):
+    """
+    Streaming version of get_bot_response: yields the answer in pieces. The
+    cited sources are appended to the sources list, if one is passed, and
+    status['complete'] tells whether the answer ended normally (see
+    stream_generative_answer); only complete answers are cached.
+    """
+    key = coalescing_key(user_question, chat_history, document)
+    if key is None:
+        yield from _stream_bot_response(user_question, chat_history, document, sources, status)
+        return
+    pieces, shared = answer_flights.stream(('stream',) + key, _coalesced_stream, user_question, document)
+    if shared:
+        metrics.ANSWERS.inc(outcome='coalesced')
+    cited, flight_status = False, {}
+    for piece, flight_sources, flight_status in pieces:
+        if not cited and sources is not None:
+            sources.extend(flight_sources)  # Complete before the first piece is yielded
+            cited = True
+        yield piece
+    if status is not None:
+        status.update(flight_status)  # Final once the flight's last piece is out
+
+def _coalesced_stream(user_question, document):
+    # Pairs each piece with the flight's sources and status, so late joiners get them too
+    sources, status = [], {}
+    for piece in _stream_bot_response(user_question, [], document, sources, status):
+        yield piece, sources, status
+
+def _stream_bot_response(user_question, chat_history, document, sources, status):
+    status = status if status is not None else {}
+    status['complete'] = True
+    try:
+        retrieval = retrieve_context(user_question, chat_history, document)
     except Exception as e:
-        print(f"Error in get_bot_response: {e}") 
-        return "An error occurred. Please try again."
\ No newline at end of file
+        log.exception("Error in _stream_bot_response: %s", e)
+        metrics.ANSWERS.inc(outcome='error')
+        yield "An error occurred. Please try again."
+        return
+    if sources is not None:
+        sources.extend(retrieval['sources'])
+    if retrieval['answer'] is not None:
+        yield retrieval['answer']
+        return
+
+    pieces = []
+    with span('stream'):
+        for piece in stream_generative_answer(retrieval['context'], user_question, chat_history, status):
+            pieces.append(piece)
+            yield piece
+    if not status['complete']:
+        metrics.ANSWERS.inc(outcome='incomplete')
+        return  # A cut-off answer must not be served from the cache as if it were whole
+    metrics.ANSWERS.inc(outcome='generated')
+    remember_answer(retrieval, chat_history, "".join(pieces))
@@ -0,0 +1,163 @@
+import os
+import json
+import mmap
+import numpy as np
+from vector_store import content_key
+
+class ChunkStore:
+    """
+    Read-only, memory-mapped chunk texts keyed by chunk id.
+
+      <base>.txt   UTF-8 chunk texts, back to back
+      <base>.idx   int64 rows of (chunk_id, byte offset, byte length), sorted by id
+
+    Opening maps both files instead of unpickling a list, so it costs next
+    to nothing and the pages are shared by every process using the store.
+    """
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self._index = np.load(base_path + '.idx', mmap_mode='r')
+        self._ids = self._index[:, 0]
+        self._file = open(base_path + '.txt', 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    @staticmethod
+    def exists(base_path):
+        return os.path.exists(base_path + '.idx') and os.path.exists(base_path + '.txt')
+
+    @staticmethod
+    def write(base_path, chunk_map):
+        """
+        Writes {chunk_id: text} as a new store, atomically replacing any old one.
+        """
+        rows = []
+        offset = 0
+        tmp_txt, tmp_idx = base_path + '.txt.tmp', base_path + '.idx.tmp.npy'
+        with open(tmp_txt, 'wb') as f:
+            for chunk_id in sorted(chunk_map):
+                data = chunk_map[chunk_id].encode('utf-8')
+                f.write(data)
+                rows.append((chunk_id, offset, len(data)))
+                offset += len(data)
+        np.save(tmp_idx, np.array(rows, dtype='int64').reshape(-1, 3))
+        os.replace(tmp_txt, base_path + '.txt')
+        os.replace(tmp_idx, base_path + '.idx')
+
+    @staticmethod
+    def remove(base_path):
+        for suffix in ('.txt', '.idx'):
+            if os.path.exists(base_path + suffix):
+                os.remove(base_path + suffix)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, chunk_id):
+        return self._position(chunk_id) is not None
+
+    def _position(self, chunk_id):
+        pos = int(np.searchsorted(self._ids, chunk_id))
+        if pos < len(self._ids) and self._ids[pos] == chunk_id:
+            return pos
+        return None
+
+    def get(self, chunk_id, default=None):
+        pos = self._position(chunk_id)
+        if pos is None:
+            return default
+        _, offset, length = self._index[pos]
+        return self._data[offset:offset + length].decode('utf-8')
+
+    def __getitem__(self, chunk_id):
+        text = self.get(chunk_id)
+        if text is None:
+            raise KeyError(chunk_id)
+        return text
+
+    def ids(self):
+        return [int(i) for i in self._ids]
+
+    def to_dict(self):
+        return {chunk_id: self.get(chunk_id) for chunk_id in self.ids()}
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+META_DTYPE = np.dtype([('chunk_id', '<i8'), ('doc', '<i4'), ('page', '<i4'), ('offset', '<i8'), ('hash', '<u8')])
+
+class ChunkMetadata:
+    """
+    Columnar, memory-mapped metadata for the chunks of one brain version.
+
+      <base>.npy        one META_DTYPE row per chunk, sorted by chunk_id:
+                        document number, page (0 = unknown), character offset
+                        in the document (-1 = unknown), 64-bit content hash
+      <base>.docs.json  document file names, indexed by document number
+    """
+
+    def __init__(self, base_path):
+        self._rows = np.load(base_path + '.npy', mmap_mode='r')
+        with open(base_path + '.docs.json', 'r', encoding='utf-8') as f:
+            self.documents = json.load(f)
+        self._doc_numbers = {name: i for i, name in enumerate(self.documents)}
+
+    @staticmethod
+    def exists(base_path):
+        return os.path.exists(base_path + '.npy') and os.path.exists(base_path + '.docs.json')
+
+    @staticmethod
+    def write(base_path, chunk_map, manifest):
+        """
+        Builds the columns from the chunk map and the manifest's per-document
+        id ranges, pages and offsets.
+        """
+        documents = sorted(manifest['documents'])
+        rows = np.zeros(len(chunk_map), dtype=META_DTYPE)
+        position = {chunk_id: i for i, chunk_id in enumerate(sorted(chunk_map))}
+        rows['chunk_id'] = sorted(chunk_map)
+        rows['doc'] = -1
+        rows['offset'] = -1
+        for chunk_id, i in position.items():
+            rows['hash'][i] = int.from_bytes(content_key(chunk_map[chunk_id])[:8], 'little')
+        for doc_number, name in enumerate(documents):
+            doc = manifest['documents'][name]
+            pages, offsets = doc.get('pages') or [], doc.get('offsets') or []
+            for n, chunk_id in enumerate(range(doc['start_id'], doc['end_id'])):
+                i = position.get(chunk_id)
+                if i is None:
+                    continue
+                rows['doc'][i] = doc_number
+                rows['page'][i] = pages[n] if n < len(pages) else 0
+                rows['offset'][i] = offsets[n] if n < len(offsets) else -1
+        np.save(base_path + '.npy', rows)
+        with open(base_path + '.docs.json', 'w', encoding='utf-8') as f:
+            json.dump(documents, f)
+
+    def _position(self, chunk_id):
+        ids = self._rows['chunk_id']
+        pos = int(np.searchsorted(ids, chunk_id))
+        return pos if pos < len(ids) and ids[pos] == chunk_id else None
+
+    def source(self, chunk_id):
+        """
+        Returns {'file', 'page'} for a chunk (page None if unknown), or None.
+        """
+        pos = self._position(chunk_id)
+        if pos is None or self._rows['doc'][pos] < 0:
+            return None
+        page = int(self._rows['page'][pos])
+        return {'file': self.documents[self._rows['doc'][pos]], 'page': page or None}
+
+    def chunk_ids(self, document):
+        """
+        Returns the ids (int64 array) of one document's chunks, empty if unknown.
+        """
+        doc_number = self._doc_numbers.get(document)
+        if doc_number is None:
+            return np.empty(0, dtype='int64')
+        rows = self._rows
+        return np.asarray(rows['chunk_id'][rows['doc'] == doc_number], dtype='int64')
@@ -0,0 +1,118 @@
+import os
+import re
+from collections import namedtuple
+
+# --- Configuration ---
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "256"))                  # Token budget per chunk
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))   # Whole sentences repeated from the previous chunk
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "64"))           # Headings/page breaks only start a chunk past this size
+PAGE_BREAK = "\f"  # Page separator in extracted PDF text (see ingest.join_pages)
+
+# Word pieces and punctuation: a close, dependency-free stand-in for a BPE token count
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+(?=\S)")
+WORD_RE = re.compile(r"\S+")
+HEADING_RE = re.compile(
+    r"^(#{1,6}\s+\S.*"                                    # Markdown
+    r"|(\d+(\.\d+)*\.?|[IVX]+\.|Chapter \d+|Section \d+)\s+[A-Za-z].*"  # Numbered: "4.2 Joins", "Chapter 3 ..."
+    r"|[A-Z][A-Z0-9 &/,:()'\-]+)$"                          # ALL CAPS
+)
+
+Chunk = namedtuple('Chunk', ['text', 'page', 'section', 'offset', 'tokens'])
+Piece = namedtuple('Piece', ['start', 'end', 'tokens', 'page', 'heading'])
+
+def count_tokens(text):
+    return len(TOKEN_RE.findall(text))
+
+def is_heading(line):
+    line = line.strip()
+    return 3 <= len(line) <= 90 and not line.endswith(('.', ',', ';')) and HEADING_RE.match(line) is not None
+
+def iter_pieces(text, max_tokens):
+    """
+    Yields the text as Pieces (character spans) in order: a heading line, a
+    sentence, or a word window of an over-long sentence. A single pass over
+    the lines; nothing is searched backwards.
+    """
+    pos = 0
+    for page_number, page_text in enumerate(text.split(PAGE_BREAK), start=1):
+        paragraph_start = None
+        for line in page_text.split("\n") + [""]:  # The sentinel flushes the last paragraph
+            line_start, pos = pos, pos + len(line) + 1
+            heading = is_heading(line)
+            if paragraph_start is not None and (not line.strip() or heading):
+                yield from _split_paragraph(text, paragraph_start, line_start - 1, page_number, max_tokens)
+                paragraph_start = None
+            if heading:
+                yield Piece(line_start, line_start + len(line), count_tokens(line), page_number, True)
+            elif line.strip() and paragraph_start is None:
+                paragraph_start = line_start
+        pos -= 1  # The sentinel line had no separator after it
+
+def _split_paragraph(text, start, end, page, max_tokens):
+    paragraph = text[start:end]
+    sentence_start = 0
+    for boundary in list(SENTENCE_END_RE.finditer(paragraph)) + [None]:
+        sentence_end = boundary.start() if boundary else len(paragraph)
+        sentence = paragraph[sentence_start:sentence_end]
+        tokens = count_tokens(sentence)
+        if tokens > max_tokens:
+            yield from _split_words(text, start + sentence_start, sentence, page, max_tokens)
+        elif tokens:
+            yield Piece(start + sentence_start, start + sentence_end, tokens, page, False)
+        if boundary:
+            sentence_start = boundary.end()
+
+def _split_words(text, start, sentence, page, max_tokens):
+    window_start, window_end, tokens = None, None, 0
+    for word in WORD_RE.finditer(sentence):
+        word_tokens = count_tokens(word.group())
+        if window_start is not None and tokens + word_tokens > max_tokens:
+            yield Piece(start + window_start, start + window_end, tokens, page, False)
+            window_start, tokens = None, 0
+        if window_start is None:
+            window_start = word.start()
+        window_end = word.end()
+        tokens += word_tokens
+    if window_start is not None:
+        yield Piece(start + window_start, start + window_end, tokens, page, False)
+
+def iter_chunks(text, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, min_tokens=CHUNK_MIN_TOKENS):
+    """
+    Streams Chunks of at most max_tokens. A chunk ends at the budget, or at
+    a heading or page break once it holds min_tokens. Chunks cut by the
+    budget start with the previous chunk's last sentences (up to
+    overlap_tokens); chunks cut at a heading or page break don't need to.
+    Each chunk records its first page, current section heading and offset.
+    """
+    pieces, size = [], 0
+    section, chunk_section = None, None
+
+    def make_chunk():
+        body = text[pieces[0].start:pieces[-1].end].replace(PAGE_BREAK, "\n").strip()
+        return Chunk(body, pieces[0].page, chunk_section, pieces[0].start, size)
+
+    for piece in iter_pieces(text, max_tokens):
+        structural = pieces and (piece.heading or piece.page != pieces[-1].page)
+        if pieces and (size + piece.tokens > max_tokens or (structural and size >= min_tokens)):
+            yield make_chunk()
+            carried = []
+            if not structural:
+                for previous in reversed(pieces):
+                    if previous.heading or sum(p.tokens for p in carried) + previous.tokens > overlap_tokens:
+                        break
+                    carried.insert(0, previous)
+                if sum(p.tokens for p in carried) + piece.tokens > max_tokens:
+                    carried = []
+            pieces, size = carried, sum(p.tokens for p in carried)
+        if piece.heading:
+            section = " ".join(text[piece.start:piece.end].split())
+        if not pieces:
+            chunk_section = section
+        pieces.append(piece)
+        size += piece.tokens
+    if pieces:
+        yield make_chunk()
+
+def chunk_text(text, **kwargs):
+    return list(iter_chunks(text, **kwargs))
@@ -0,0 +1,111 @@
+import os
+import logging
+import re
+import threading
+import numpy as np
+import gemini_client
+
+log = logging.getLogger(__name__)
+
+# --- Configuration ---
+# 'gemini' (text-embedding-004 over the API) or 'local' (sentence-transformers on CPU)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "gemini")
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+LOCAL_EMBEDDING_RUNTIME = os.getenv("LOCAL_EMBEDDING_RUNTIME", "torch")  # 'torch' or 'onnx'
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "64"))
+LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", str(os.cpu_count() or 1)))
+
+# Brains built before backends were recorded used Gemini
+LEGACY_EMBEDDING_KEY = f"gemini:{gemini_client.EMBEDDING_MODEL}"
+
+class GeminiBackend:
+    """
+    Remote text-embedding-004. Batches are sent by ingest's rate-limited
+    pipeline through batch_request(); queries use embed().
+    """
+    remote = True
+
+    def __init__(self, model_name=gemini_client.EMBEDDING_MODEL):
+        if model_name != gemini_client.EMBEDDING_MODEL:
+            raise ValueError(f"Unsupported Gemini embedding model '{model_name}'")
+        self.key = f"gemini:{model_name}"
+
+    def embed(self, text, timeout=10):
+        return gemini_client.embed(text, timeout=timeout)
+
+    def batch_request(self, texts):
+        return gemini_client.batch_embed_request(texts)
+
+class LocalBackend:
+    """
+    sentence-transformers model on the CPU: no quota and no network hop.
+    The model (and torch) load on first use, so importing this module stays
+    cheap and nothing heavy is loaded before gunicorn forks.
+    """
+    remote = False
+
+    def __init__(self, model_name=LOCAL_EMBEDDING_MODEL):
+        self.model_name = model_name
+        self.key = f"local:{model_name}"
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                # Optional dependency, only needed for EMBEDDING_BACKEND=local
+                from sentence_transformers import SentenceTransformer
+                if LOCAL_EMBEDDING_RUNTIME == 'torch':
+                    import torch
+                    torch.set_num_threads(LOCAL_EMBEDDING_THREADS)
+                log.info("Loading local embedding model '%s' (%s)...", self.model_name, LOCAL_EMBEDDING_RUNTIME)
+                self._model = SentenceTransformer(self.model_name, device='cpu', backend=LOCAL_EMBEDDING_RUNTIME)
+        return self._model
+
+    def embed_many(self, texts):
+        """
+        Returns a float32 matrix with one row per text.
+        """
+        model = self._model or self._load()
+        vectors = model.encode(list(texts), batch_size=LOCAL_EMBEDDING_BATCH_SIZE,
+                               convert_to_numpy=True, show_progress_bar=False)
+        return np.asarray(vectors, dtype='float32')
+
+    def embed(self, text, timeout=None):
+        try:
+            return self.embed_many([text])[0]
+        except Exception as e:
+            log.error("Error getting local embedding: %s", e)
+            return None
+
+BACKENDS = {'gemini': GeminiBackend, 'local': LocalBackend}
+_backends = {}
+_backends_lock = threading.Lock()
+
+def configured_key():
+    if EMBEDDING_BACKEND == 'local':
+        return f"local:{LOCAL_EMBEDDING_MODEL}"
+    if EMBEDDING_BACKEND == 'gemini':
+        return LEGACY_EMBEDDING_KEY
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{EMBEDDING_BACKEND}' (expected one of {tuple(BACKENDS)})")
+
+def get_backend(key=None):
+    """
+    Returns the (shared) backend for a 'kind:model' key, such as the one a
+    brain's manifest records; the configured backend when key is None.
+    """
+    key = key or configured_key()
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            kind, _, model_name = key.partition(':')
+            if kind not in BACKENDS:
+                raise ValueError(f"Unknown embedding backend '{kind}' in '{key}'")
+            backend = _backends[key] = BACKENDS[kind](model_name)
+    return backend
+
+def cache_suffix(key):
+    """
+    File-name-safe form of a backend key, for per-model vector caches.
+    """
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', key)
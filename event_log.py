@@ -0,0 +1,180 @@
+import os
+import logging
+import re
+import time
+import queue
+import atexit
+import sqlite3
+import threading
+from datetime import datetime
+from background import BackgroundThread
+from sqlite_store import SQLiteStore
+
+log = logging.getLogger(__name__)
+
+# --- Configuration ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EVENTS_DB_PATH = os.getenv("EVENTS_DB", os.path.join(BASE_DIR, "events.db"))
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "10000"))  # Events waiting to be written; more are dropped
+EVENT_BATCH_SIZE = 500          # Most events written in one transaction
+EVENT_FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", "1.0"))  # Seconds an event may wait for a batch
+ADMIN_PAGE_SIZE = 50
+
+# Text logs written before the event log; imported once, then renamed
+LEGACY_LOGS = {'unanswered': os.path.join(BASE_DIR, 'unanswered_log.txt'),
+               'feedback': os.path.join(BASE_DIR, 'feedback_log.txt')}
+
+class EventLog(SQLiteStore):
+    """
+    Append-only log of unanswered questions and user feedback in SQLite.
+    log() only puts the event on a bounded queue; one background thread per
+    process writes queued events in batches. Reads are keyset-paginated on
+    (kind, id), so a page costs the same however long the log gets.
+    """
+
+    def __init__(self, db_path=EVENTS_DB_PATH, max_queue=EVENT_QUEUE_SIZE):
+        self.db_path = db_path
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._writer = BackgroundThread(self._run, "event-log")
+        self.dropped = 0
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    question TEXT,
+                    answer TEXT,
+                    rating TEXT
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS events_kind ON events (kind, id)")
+        finally:
+            conn.close()
+        self._import_legacy_logs()
+        atexit.register(self.flush)
+
+    # --- Writing ---
+    def log(self, kind, question, answer=None, rating=None):
+        """
+        Queues an event; never blocks the request. When the queue is full the
+        event is dropped (and counted) rather than slowing answers down.
+        """
+        self._writer.start()
+        try:
+            self._queue.put_nowait((kind, time.time(), question, answer, rating))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + EVENT_FLUSH_INTERVAL
+            while len(batch) < EVENT_BATCH_SIZE:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        markers = [item for item in batch if isinstance(item, threading.Event)]
+        rows = [item for item in batch if not isinstance(item, threading.Event)]
+        try:
+            if rows:
+                with self._transaction() as conn:
+                    conn.executemany("INSERT INTO events (kind, created_at, question, answer, rating) "
+                                     "VALUES (?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            log.error("Error writing %d events: %s", len(rows), e)
+        finally:
+            for marker in markers:
+                marker.set()
+
+    def flush(self, timeout=5.0):
+        """
+        Waits until everything queued so far is written.
+        """
+        if not self._writer.running():
+            return
+        marker = threading.Event()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return
+        marker.wait(timeout)
+
+    # --- Reading ---
+    def page(self, kind, before=None, limit=ADMIN_PAGE_SIZE):
+        """
+        Returns (events, next_before): up to limit events of a kind, newest
+        first, older than the id before. next_before is None on the last page.
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT * FROM events WHERE kind = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                                (kind, before if before is not None else 2 ** 63 - 1, limit + 1)).fetchall()
+        finally:
+            conn.close()
+        events = []
+        for row in rows[:limit]:
+            event = dict(row)
+            event['timestamp'] = datetime.fromtimestamp(event['created_at']).strftime('%Y-%m-%d %H:%M:%S')
+            events.append(event)
+        next_before = events[-1]['id'] if len(rows) > limit else None
+        return events, next_before
+
+    def clear(self):
+        self.flush()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM events")
+
+    # --- Migration ---
+    def _import_legacy_logs(self):
+        rows = []
+        for kind, path in LEGACY_LOGS.items():
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                os.replace(path, path + '.imported')
+            except OSError as e:
+                log.error("Error importing %s: %s", path, e)
+                continue
+            parsed = parse_unanswered_log(content) if kind == 'unanswered' else parse_feedback_log(content)
+            rows.extend((kind, created_at, question, answer, rating) for created_at, question, answer, rating in parsed)
+            log.info("Imported %d events from %s.", len(parsed), os.path.basename(path))
+        if rows:
+            rows.sort(key=lambda row: row[1])
+            with self._transaction() as conn:
+                conn.executemany("INSERT INTO events (kind, created_at, question, answer, rating) "
+                                 "VALUES (?, ?, ?, ?, ?)", rows)
+
+def _timestamp(text):
+    try:
+        return datetime.strptime(text, '%Y-%m-%d %H:%M:%S').timestamp()
+    except ValueError:
+        return 0.0
+
+def parse_unanswered_log(content):
+    events = []
+    for line in content.splitlines():
+        match = re.match(r"\[(.*?)\] - (.*)", line)
+        if match:
+            events.append((_timestamp(match.group(1)), match.group(2), None, None))
+    return events
+
+def parse_feedback_log(content):
+    events = []
+    for entry in content.split('-' * 20):
+        ts_match = re.search(r"\[(.*?)\] - TYPE: (up|down)", entry)
+        q_match = re.search(r"Q: (.*)", entry)
+        a_match = re.search(r"A: (.*)", entry, re.DOTALL)
+        if ts_match and q_match and a_match:
+            events.append((_timestamp(ts_match.group(1)), q_match.group(1).strip(), a_match.group(1).strip(),
+                           ts_match.group(2)))
+    return events
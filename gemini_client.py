@@ -0,0 +1,254 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+import logging
+import json
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger(__name__)
+
+# --- Configuration ---
+API_KEY = os.getenv("GEMINI_API_KEY")
+# Point this at a local stand-in (see benchmarks/mock_gemini.py) for tests and benchmarks
+API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+POOL_SIZE = int(os.getenv("GEMINI_POOL_SIZE", "10"))  # Keep-alive connections kept per host
+EMBEDDING_MODEL = "text-embedding-004"
+HEADERS = {'Content-Type': 'application/json'}
+
+def model_url(model_name, method, **params):
+    query = "&".join(f"{k}={v}" for k, v in params.items())
+    url = f"{API_BASE}/models/{model_name}:{method}?key={API_KEY}"
+    return f"{url}&{query}" if query else url
+
+def embedding_request(text):
+    return {
+        "model": f"models/{EMBEDDING_MODEL}",
+        "content": {
+            "parts": [{"text": text}]
+        }
+    }
+
+# --- Pooled Sync Client ---
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """
+    Returns the process-wide requests.Session. Its keep-alive pool means only
+    the first call per connection pays the TCP+TLS handshake.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+def reset_session():
+    """
+    Drops the pooled session, e.g. after fork or when API_BASE changes.
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+def post(model_name, method, payload, timeout, stream=False, **params):
+    """
+    POSTs a JSON payload to models/{model_name}:{method} over the pooled session.
+    """
+    # Bytes (not str) so http.client sends headers and body in one write; a
+    # separate body write on a reused connection stalls on Nagle/delayed ACK.
+    return get_session().post(model_url(model_name, method, **params), headers=HEADERS,
+                              data=json.dumps(payload).encode('utf-8'), timeout=timeout, stream=stream)
+
+def embed(text, timeout=10):
+    """
+    Returns the embedding values for one text, or None on failure.
+    """
+    try:
+        response = post(EMBEDDING_MODEL, "embedContent", embedding_request(text), timeout)
+        if response.status_code == 200:
+            return response.json()['embedding']['values']
+        log.error("Error getting embedding: %s", response.text)
+        return None
+    except Exception as e:
+        log.error("Error getting embedding: %s", e)
+        return None
+
+def batch_embed_request(texts, timeout=30):
+    """
+    One batchEmbedContents call (max 100 items). Returns (embeddings,
+    status_code, retry_after): embeddings is a list aligned with texts (None
+    for items the API didn't return) or None if the whole call failed;
+    status_code is None for network errors; retry_after is the server's
+    Retry-After in seconds, if any.
+    """
+    payload = {"requests": [embedding_request(text) for text in texts]}
+    try:
+        response = post(EMBEDDING_MODEL, "batchEmbedContents", payload, timeout)
+    except Exception as e:
+        log.error("Error during batch call: %s", e)
+        return None, None, None
+    if response.status_code != 200:
+        log.error("Error in batch embedding (%s): %s", response.status_code, response.text[:200])
+        retry_after = response.headers.get('Retry-After')
+        return None, response.status_code, float(retry_after) if retry_after and retry_after.isdigit() else None
+    try:
+        embeddings = batch_embeddings(response.json(), len(texts))
+    except ValueError as e:
+        log.error("Error parsing batch embedding response: %s", e)
+        return None, response.status_code, None
+    return embeddings, response.status_code, None
+
+def batch_embeddings(result, count):
+    """
+    The embeddings of a batchEmbedContents response, one per requested text:
+    None for items the API didn't return.
+    """
+    embeddings = [(res or {}).get('values') for res in result.get('embeddings', [])]
+    embeddings += [None] * (count - len(embeddings))
+    return embeddings[:count]
+
+# --- Pooled Async Client ---
+class AsyncGeminiClient:
+    """
+    asyncio counterpart of the helpers above, backed by one httpx.AsyncClient
+    with a bounded keep-alive pool. Use as 'async with AsyncGeminiClient() as client'.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE):
+        import httpx  # Only needed by async callers
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self._client = httpx.AsyncClient(limits=limits, headers=HEADERS)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def post(self, model_name, method, payload, timeout, **params):
+        return await self._client.post(model_url(model_name, method, **params),
+                                       content=json.dumps(payload).encode('utf-8'), timeout=timeout)
+
+    async def embed(self, text, timeout=10):
+        try:
+            response = await self.post(EMBEDDING_MODEL, "embedContent", embedding_request(text), timeout)
+            if response.status_code == 200:
+                return response.json()['embedding']['values']
+            log.error("Error getting embedding: %s", response.text)
+            return None
+        except Exception as e:
+            log.error("Error getting embedding: %s", e)
+            return None
+
+    async def batch_embed(self, texts, timeout=30):
+        """
+        One embedding per text, like batch_embed_request: None for items the
+        API didn't return, all None if the whole call failed.
+        """
+        if not texts:
+            return []
+        payload = {"requests": [embedding_request(text) for text in texts]}
+        try:
+            response = await self.post(EMBEDDING_MODEL, "batchEmbedContents", payload, timeout)
+            if response.status_code == 200:
+                return batch_embeddings(response.json(), len(texts))
+            log.error("Error in batch embedding (%s): %s", response.status_code, response.text[:200])
+        except Exception as e:
+            log.error("Error during batch call: %s", e)
+        return [None] * len(texts)
+
+# --- Rate Limiter ---
+class RateLimiter:
+    """
+    Thread-safe token bucket refilled at rate_per_minute, holding up to burst
+    tokens. Adapts AIMD-style: throttle() (on a 429) halves the rate, down to
+    min_rate_per_minute; recover() (on success) adds back 5% of the maximum.
+    """
+
+    def __init__(self, rate_per_minute, burst=None, min_rate_per_minute=None):
+        self.max_rate = rate_per_minute / 60.0
+        self.min_rate = (min_rate_per_minute or rate_per_minute / 32) / 60.0
+        self.rate = self.max_rate
+        self.burst = burst or max(1.0, self.max_rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait_for = (tokens - self._tokens) / self.rate
+            time.sleep(wait_for)
+
+    def throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0.0  # Stop the burst that caused the 429
+        return self.rate * 60
+
+    def recover(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+# --- Circuit Breaker ---
+class CircuitBreaker:
+    """
+    Per-key (e.g. per-model) breaker. trip() opens the key for a cooldown that
+    doubles with each consecutive trip, up to max_cooldown. Once it expires the
+    key is half-open: one caller is let through as a trial while the rest keep
+    skipping it, until the trial's success() closes it or trip() reopens it.
+    A trial that reports neither (e.g. it was cancelled) lapses after
+    trial_timeout seconds and the next caller gets to try.
+    """
+
+    def __init__(self, max_cooldown=3600, trial_timeout=30):
+        self.max_cooldown = max_cooldown
+        self.trial_timeout = trial_timeout
+        self._state = {}  # key -> (open_until, consecutive_trips, trial_until)
+        self._lock = threading.Lock()
+
+    def is_open(self, key):
+        """
+        Whether to skip key now. A False on a half-open key claims its trial,
+        so only ask when about to call.
+        """
+        now = time.time()
+        with self._lock:
+            if key not in self._state:
+                return False
+            open_until, trips, trial_until = self._state[key]
+            if now < open_until or now < trial_until:
+                return True
+            self._state[key] = (open_until, trips, now + self.trial_timeout)
+            return False
+
+    def trip(self, key, cooldown):
+        with self._lock:
+            _, trips, _ = self._state.get(key, (0, 0, 0))
+            cooldown = min(cooldown * (2 ** trips), self.max_cooldown)
+            self._state[key] = (time.time() + cooldown, trips + 1, 0)
+        return cooldown
+
+    def success(self, key):
+        with self._lock:
+            self._state.pop(key, None)
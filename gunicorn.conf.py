@@ -0,0 +1,66 @@
+import os
+
+# --- Concurrency ---
+# An answer spends nearly all its time waiting on Gemini, with the GIL
+# released, so each worker serves many requests at once on threads. The
+# brain is an immutable snapshot swapped whole and every cache and store has
+# its own lock or SQLite transaction, so requests share them safely.
+# Mock-API load test, 32 clients, 0.8 s per generation call (see
+# benchmarks/load_test.py): 1 worker x 1 thread 1.2 answers/s, p50 26 s;
+# 1 x 16 18.8 answers/s, p50 1.6 s; 2 x 16 33.4 answers/s, p50 0.9 s.
+# gevent would need the app loaded after monkey-patching (no preload), so
+# gthread is the supported worker class.
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+timeout = 120
+# Each request can have a generation call, its hedge and an abandoned
+# embedding or rewrite in flight; size the shared pools to match
+os.environ.setdefault("GEMINI_HEDGE_WORKERS", str(threads * 3))
+os.environ.setdefault("GEMINI_POOL_SIZE", str(threads * 3))
+
+# --- Preload ---
+# Load the app (and with it the memory-mapped brain) once in the master, then
+# fork: workers share the index and chunk pages copy-on-write, and start
+# serving without loading anything themselves.
+os.environ.setdefault("PRELOAD_BRAIN", "1")
+preload_app = True
+
+# --- Metrics ---
+# Workers publish their metrics here so /metrics reports the whole server, not
+# whichever worker answered the scrape
+os.environ.setdefault("METRICS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "metrics_data"))
+
+def on_starting(server):
+    import metrics
+    metrics.reset_dir()  # Counters start from zero with each server start
+
+def memory_usage():
+    """
+    Returns (rss_kb, pss_kb, private_kb) for this process. PSS splits shared
+    pages between the processes mapping them, so it is the fair per-worker cost.
+    """
+    usage = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[1].isdigit():
+                    usage[parts[0].rstrip(':')] = int(parts[1])
+    except OSError:
+        return None, None, None  # Not Linux
+    private = usage.get('Private_Clean', 0) + usage.get('Private_Dirty', 0)
+    return usage.get('Rss'), usage.get('Pss'), private
+
+def post_fork(server, worker):
+    # Pooled connections opened in the master must not be shared across processes
+    import gemini_client
+    gemini_client.reset_session()
+
+def post_worker_init(worker):
+    import chatbot
+    rss, pss, private = memory_usage()
+    load_ms = chatbot.brain.load_seconds * 1000 if chatbot.brain is not None else None
+    worker.log.info(f"Worker {worker.pid} ready: brain loaded in "
+                    f"{f'{load_ms:.1f} ms' if load_ms is not None else 'n/a (not loaded)'}, "
+                    f"RSS {rss} kB, PSS {pss} kB, private {private} kB")
@@ -0,0 +1,89 @@
+"""
+Recall-vs-latency report for the FAISS index types in ingest.py.
+
+Builds every index type over the current brain's vectors and compares each one
+against the exact (flat) search results:
+
+    python index_report.py [--k 10] [--queries 200]
+"""
+import os
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+import argparse
+import time
+import numpy as np
+import faiss
+import ingest
+import chatbot
+import brain_store
+import embeddings
+
+NPROBE_SWEEP = [1, 4, 16, 64]
+EF_SEARCH_SWEEP = [16, 64, 256]
+
+def load_vectors():
+    """
+    Returns (ids, vectors) for every chunk in the brain that has a cached embedding.
+    """
+    version = brain_store.live_version()
+    manifest = (brain_store.load_manifest(version) if version else None) or {}
+    chunk_map = ingest.load_chunk_map(version)
+    store = ingest.open_embedding_cache(manifest.get('embedding', embeddings.LEGACY_EMBEDDING_KEY))
+    cached = store.get_many([ingest.content_key(text) for text in chunk_map.values()])
+    ids = [chunk_id for chunk_id, text in chunk_map.items() if ingest.content_key(text) in cached]
+    vectors = np.array([cached[ingest.content_key(chunk_map[chunk_id])] for chunk_id in ids], dtype='float32')
+    return np.array(ids, dtype='int64'), vectors
+
+def make_queries(vectors, n_queries, seed=0):
+    # Perturbed copies of stored vectors stand in for real question embeddings
+    rng = np.random.default_rng(seed)
+    picks = vectors[rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)]
+    noise = rng.normal(scale=picks.std() * 0.5, size=picks.shape).astype('float32')
+    return picks + noise
+
+def measure(index, queries, truth, k):
+    start = time.perf_counter()
+    _, I = index.search(queries, k)
+    elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    recall = np.mean([len(set(found) & set(expected)) / k for found, expected in zip(I, truth)])
+    return recall, elapsed_ms
+
+def run_report(k=10, n_queries=200):
+    ids, vectors = load_vectors()
+    if len(vectors) == 0:
+        print("No cached vectors found. Run 'python ingest.py' first.")
+        return
+    k = min(k, len(vectors))
+    queries = make_queries(vectors, n_queries)
+    print(f"Corpus: {len(vectors)} vectors x {vectors.shape[1]} dims, {len(queries)} queries, recall@{k}")
+    print(f"Auto mode would pick: {ingest.choose_index_type(len(vectors))}")
+
+    flat, _ = ingest.build_index(vectors, ids, 'flat')
+    _, truth = flat.search(queries, k)
+
+    print(f"{'index':<8} {'setting':<14} {'recall':>7} {'ms/query':>9} {'build s':>8} {'size MB':>8}")
+    for index_type in ingest.INDEX_TYPES:
+        start = time.perf_counter()
+        index, built_type = ingest.build_index(vectors, ids, index_type)
+        build_s = time.perf_counter() - start
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+        if built_type in ('ivf', 'ivfpq'):
+            settings = [('nprobe', n) for n in NPROBE_SWEEP]
+        elif built_type == 'hnsw':
+            settings = [('efSearch', ef) for ef in EF_SEARCH_SWEEP]
+        else:
+            settings = [(None, None)]
+        for name, value in settings:
+            if name == 'nprobe':
+                chatbot.apply_search_params(index, nprobe=value)
+            elif name == 'efSearch':
+                chatbot.apply_search_params(index, ef_search=value)
+            recall, ms = measure(index, queries, truth, k)
+            setting = f"{name}={value}" if name else "exact"
+            print(f"{built_type:<8} {setting:<14} {recall:>7.3f} {ms:>9.3f} {build_s:>8.2f} {size_mb:>8.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+    run_report(args.k, args.queries)
@@ -2,90 +2,70 @@ import os
 os.environ['FAISS_OPT_LEVEL'] = 'generic'
 from dotenv import load_dotenv
 load_dotenv()
-import pickle
 # from langchain_text_splitters import RecursiveCharacterTextSplitter # REMOVED
 import faiss
-import requests
-import json
 import time
+import hashlib
+import random
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import numpy as np
 import pypdf
+import gemini_client
+import embeddings
+import chunker
+from vector_store import VectorStore, content_key
+import brain_store
 
 print("Script started...")
 
 # --- 1. Configuration ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-VECTOR_DB_PATH = os.path.join(BASE_DIR, "faiss_index")
-DATA_STORE_PATH = os.path.join(BASE_DIR, "data_store.pkl")
-CACHE_PATH = os.path.join(BASE_DIR, "embeddings_cache.pkl")
-MODEL_NAME = 'all-MiniLM-L6-v2'
+CACHE_PATH = os.path.join(BASE_DIR, "embeddings_cache.pkl")  # Legacy pickle cache, migrated on first use
+VECTOR_CACHE_PATH = os.path.join(BASE_DIR, "embeddings_cache")  # .f32 / .keys / .meta.json
+TEXT_CACHE_DIR = os.path.join(BASE_DIR, "text_cache")  # Extracted PDF text, one file per content hash
+SUPPORTED_EXTENSIONS = ('.txt', '.pdf')
 
-# --- IMPORTANT! PASTE YOUR KEY HERE (Or use env var) ---
-API_KEY = os.getenv("GEMINI_API_KEY")
+# --- Index Configuration ---
+# 'auto' picks by corpus size; 'flat', 'ivf', 'hnsw' and 'ivfpq' force a type.
+INDEX_TYPE = os.getenv("INDEX_TYPE", "auto")
+INDEX_TYPES = ('flat', 'ivf', 'hnsw', 'ivfpq')
+FLAT_MAX_VECTORS = 20000        # Brute force is exact and fast enough below this
+IVF_MAX_VECTORS = 300000        # Above this, compress vectors with product quantization
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+PQ_SUBQUANTIZERS = 64           # 768 dims -> 64 sub-vectors of 12 dims, 64 bytes/vector
+PQ_BITS = 8
 
-def get_embedding(text):
-    if not API_KEY:
-        print("Error: GEMINI_API_KEY not set in .env file.")
-        return None
+# --- PDF Extraction Configuration ---
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))  # 1 = extract in-process
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "25"))       # Page range per worker task
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/text-embedding-004:embedContent?key={API_KEY}"
-    payload = {
-        "model": "models/text-embedding-004",
-        "content": {
-            "parts": [{"text": text}]
-        }
-    }
-    headers = {'Content-Type': 'application/json'}
-    try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=15)
-        if response.status_code == 200:
-            return response.json()['embedding']['values']
-        else:
-            print(f"Error getting embedding: {response.text}")
-            return None
-    except Exception as e:
-        print(f"Error: {e}")
-        return None
+# --- Embedding Pipeline Configuration ---
+# The backend (Gemini API or a local CPU model) is chosen in embeddings.py via EMBEDDING_BACKEND
+EMBED_BATCH_SIZE = 100                                               # API maximum per batch call
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))         # Batch calls in flight
+EMBED_REQUESTS_PER_MINUTE = int(os.getenv("EMBED_REQUESTS_PER_MINUTE", "1500"))  # API quota
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+EMBED_BACKOFF_BASE = 1.0                                             # Seconds, doubled per retry
+EMBED_BACKOFF_MAX = 60.0
 
-def get_embeddings_batch(texts):
-    """
-    Get embeddings for a list of texts in a single batch call.
-    Max 100 items per batch.
-    """
-    if not texts:
-        return []
-    
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/text-embedding-004:batchEmbedContents?key={API_KEY}"
-    
-    requests_payload = []
-    for text in texts:
-        requests_payload.append({
-            "model": "models/text-embedding-004",
-            "content": {
-                "parts": [{"text": text}]
-            }
-        })
-        
-    payload = {"requests": requests_payload}
-    headers = {'Content-Type': 'application/json'}
-    
-    try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=30)
-        if response.status_code == 200:
-            results = response.json().get('embeddings', [])
-            return [res['values'] for res in results]
-        else:
-            print(f"Error in batch embedding: {response.text}")
-            return [None] * len(texts)
-    except Exception as e:
-        print(f"Error during batch call: {e}")
-        return [None] * len(texts)
+# --- Progress Reporting ---
+progress_callback = None  # Set by a job runner (see ingest_queue.py) to follow a run
+
+def report_progress(stage, done, total):
+    """
+    Reports progress through one stage: 'extract', 'split', 'embed' or 'index'.
+    """
+    if progress_callback is not None:
+        progress_callback(stage, done, total)
 
 # --- Custom Text Splitter ---
 def split_text_recursive(text, chunk_size=1000, chunk_overlap=200):
     """
     Splits text into chunks recursively, trying to break at paragraphs, then sentences, etc.
     This is a simplified version of RecursiveCharacterTextSplitter.
+    Superseded by chunker.py; kept as the baseline for benchmarks/chunking.py.
     """
     separators = ["\n\n", "\n", " ", ""]
     chunks = []
@@ -130,167 +110,579 @@ def split_text_recursive(text, chunk_size=1000, chunk_overlap=200):
 
     return chunks
 
+def pdf_page_count(filepath):
+    return len(pypdf.PdfReader(filepath).pages)
+
+def extract_pdf_pages(filepath, start, end):
+    """
+    Extracts the text of pages [start, end). Top-level so process pool
+    workers can run it; each worker opens its own reader.
+    """
+    reader = pypdf.PdfReader(filepath)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+def join_pages(pages):
+    # One form feed between pages, empty ones included, so chunks can cite page numbers
+    return chunker.PAGE_BREAK.join(content or "" for content in pages)
+
+def report_extraction(filepath, text):
+    print(f"✅ Successfully extracted {len(text)} characters from {os.path.basename(filepath)}.")
+    if len(text.strip()) < 50:
+        print(f"⚠️ Warning: Very little text extracted ({len(text)} chars).")
+        print(f"   This PDF might be a scan (images only). OCR may be required.")
+
 def extract_text_from_pdf(filepath):
     """
     Extracts plain text from a PDF file using pypdf.
     """
-    text = ""
     try:
         reader = pypdf.PdfReader(filepath)
         total_pages = len(reader.pages)
         print(f"Reading {total_pages} pages from {os.path.basename(filepath)}...")
+        pages = []
         for i, page in enumerate(reader.pages):
             if i % 10 == 0:
                  print(f"  - Progress: {i}/{total_pages} pages...")
-            content = page.extract_text()
-            if content:
-                text += content + "\n"
-        print(f"✅ Successfully extracted {len(text)} characters from {os.path.basename(filepath)}.")
-        if len(text.strip()) < 50:
-            print(f"⚠️ Warning: Very little text extracted ({len(text)} chars).")
-            print(f"   This PDF might be a scan (images only). OCR may be required.")
+            pages.append(page.extract_text())
+        text = join_pages(pages)
+        report_extraction(filepath, text)
         return text
     except Exception as e:
         print(f"❌ Error extracting text from PDF {filepath}: {e}")
         return ""
 
-def rebuild_brain(upload_dir="data_uploads"):
-    print(f"Starting brain rebuild from directory: {upload_dir}")
+def file_sha256(filepath):
+    """
+    Returns the SHA-256 hex digest of a file's contents.
+    """
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
 
-    if not os.path.exists(upload_dir):
-        print(f"Error: Directory not found: {upload_dir}")
-        return False
+def list_documents(upload_dir):
+    return sorted(f for f in os.listdir(upload_dir) if f.lower().endswith(SUPPORTED_EXTENSIONS))
 
-    all_chunks = []
-    
-    # --- 2. Iterate through all .txt and .pdf files in the directory ---
-    supported_extensions = ('.txt', '.pdf')
-    files = [f for f in os.listdir(upload_dir) if f.lower().endswith(supported_extensions)]
-    if not files:
-        print(f"No supported files ({supported_extensions}) found to ingest.")
-        # Clear the index and data store if no files are present
-        if os.path.exists(VECTOR_DB_PATH):
-            os.remove(VECTOR_DB_PATH)
-        if os.path.exists(DATA_STORE_PATH):
-            os.remove(DATA_STORE_PATH)
-        print("Knowledge base cleared.")
-        return True
+def read_document(file_path):
+    """
+    Returns the raw text of a single .txt or .pdf document.
+    """
+    if file_path.lower().endswith('.txt'):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    elif file_path.lower().endswith('.pdf'):
+        return extract_text_from_pdf(file_path)
+    return ""
+
+def _text_cache_path(file_hash):
+    return os.path.join(TEXT_CACHE_DIR, f"{file_hash}.pages.txt")
+
+def _save_cached_text(file_hash, text):
+    try:
+        os.makedirs(TEXT_CACHE_DIR, exist_ok=True)
+        tmp_path = _text_cache_path(file_hash) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, _text_cache_path(file_hash))
+    except OSError as e:
+        print(f"Error saving extracted text cache: {e}")
 
-    for filename in files:
-        file_path = os.path.join(upload_dir, filename)
-        print(f"Processing file: {file_path}...")
+def prune_text_cache(manifest):
+    """
+    Deletes extracted text of documents the brain no longer contains.
+    """
+    keep = {doc.get('hash') for doc in (manifest or {}).get('documents', {}).values()}
+    if not os.path.isdir(TEXT_CACHE_DIR):
+        return
+    for name in os.listdir(TEXT_CACHE_DIR):
+        if name.endswith('.pages.txt') and name[:-len('.pages.txt')] not in keep:
+            try:
+                os.remove(os.path.join(TEXT_CACHE_DIR, name))
+            except OSError as e:
+                print(f"Error pruning extracted text cache: {e}")
+
+def read_documents(file_hashes):
+    """
+    Returns {file_path: raw_text} for {file_path: content_hash}.
+    PDFs whose hash was extracted before come from TEXT_CACHE_DIR. The rest
+    are split into PDF_PAGES_PER_TASK page ranges and extracted in a process
+    pool of PDF_WORKERS, so big files and many files both use every core.
+    """
+    texts, pending = {}, []
+    report_progress('extract', 0, len(file_hashes))
+    for file_path, file_hash in file_hashes.items():
+        if not file_path.lower().endswith('.pdf'):
+            try:
+                texts[file_path] = read_document(file_path)
+            except Exception as e:
+                print(f"Error reading {os.path.basename(file_path)}: {e}")
+                texts[file_path] = ""
+        elif os.path.exists(_text_cache_path(file_hash)):
+            with open(_text_cache_path(file_hash), 'r', encoding='utf-8') as f:
+                texts[file_path] = f.read()
+            print(f"Using cached text for {os.path.basename(file_path)}.")
+        else:
+            pending.append(file_path)
+            continue
+        report_progress('extract', len(texts), len(file_hashes))
+
+    page_counts = {}
+    for file_path in pending:
         try:
-            raw_text = ""
-            if filename.lower().endswith('.txt'):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    raw_text = f.read()
-            elif filename.lower().endswith('.pdf'):
-                raw_text = extract_text_from_pdf(file_path)
-
-            if raw_text.strip():
-                # --- 3. Split Text into Chunks ---
-                chunks = split_text_recursive(raw_text, chunk_size=1000, chunk_overlap=200)
-                all_chunks.extend(chunks)
-                print(f"✅ Added {len(chunks)} chunks from {filename} (Total chunks: {len(all_chunks)})")
-            else:
-                print(f"⚠️ Warning: No text extracted from {filename}.")
+            page_counts[file_path] = pdf_page_count(file_path)
         except Exception as e:
-            print(f"Error reading {filename}: {e}")
+            print(f"❌ Error extracting text from PDF {file_path}: {e}")
+            texts[file_path] = ""
 
-    if not all_chunks:
-        print("Error: No text found in any of the files.")
-        return False
+    total_pages = sum(page_counts.values())
+    if PDF_WORKERS <= 1 or total_pages <= PDF_PAGES_PER_TASK:
+        # Not worth starting worker processes
+        for file_path in page_counts:
+            texts[file_path] = extract_text_from_pdf(file_path)
+            _save_cached_text(file_hashes[file_path], texts[file_path])
+            report_progress('extract', len(texts), len(file_hashes))
+        report_progress('extract', len(file_hashes), len(file_hashes))
+        return texts
+
+    print(f"Extracting {total_pages} pages from {len(page_counts)} PDFs with {PDF_WORKERS} workers...")
+    # Spawned, not forked: the web app runs this from a threaded worker, and a
+    # fork copies locks that its other threads may be holding
+    with ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context('spawn')) as pool:
+        tasks = {
+            file_path: [pool.submit(extract_pdf_pages, file_path, start, min(start + PDF_PAGES_PER_TASK, count))
+                        for start in range(0, count, PDF_PAGES_PER_TASK)]
+            for file_path, count in page_counts.items()
+        }
+        for file_path, futures in tasks.items():
+            try:
+                text = join_pages(page for future in futures for page in future.result())
+            except Exception as e:
+                print(f"❌ Error extracting text from PDF {file_path}: {e}")
+                texts[file_path] = ""
+                continue
+            report_extraction(file_path, text)
+            texts[file_path] = text
+            _save_cached_text(file_hashes[file_path], text)
+            report_progress('extract', len(texts), len(file_hashes))
+    report_progress('extract', len(file_hashes), len(file_hashes))
+    return texts
+
+def chunking_settings():
+    return {'tokens': chunker.CHUNK_TOKENS, 'overlap': chunker.CHUNK_OVERLAP_TOKENS, 'min': chunker.CHUNK_MIN_TOKENS}
+
+def chunk_document(file_path, raw_text):
+    """
+    Splits one document's text into chunker.Chunks. Returns an empty list if it has no text.
+    """
+    if raw_text.strip():
+        return chunker.chunk_text(raw_text)
+    print(f"⚠️ Warning: No text extracted from {os.path.basename(file_path)}.")
+    return []
+
+def embed_batch_with_retries(batch, limiter, backend):
+    """
+    Embeds one batch, retrying only the items that failed. 429s slow the
+    shared limiter down and back off (honouring Retry-After); client errors
+    other than 429 are not retried. Returns ({text: embedding}, failed_texts).
+    """
+    results = {}
+    remaining = list(batch)
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        limiter.acquire()
+        batch_embeddings, status, retry_after = backend.batch_request(remaining)
+        if batch_embeddings is not None:
+            limiter.recover()
+            failed = []
+            for text, emb in zip(remaining, batch_embeddings):
+                if emb:
+                    results[text] = emb
+                else:
+                    failed.append(text)
+            remaining = failed
+            if not remaining:
+                break
+        elif status == 429:
+            print(f"⚠️ Rate limited, embedding rate lowered to {limiter.throttle():.0f} requests/min")
+        elif status is not None and 400 <= status < 500:
+            break  # The request itself is bad; retrying won't help
+        if attempt < EMBED_MAX_RETRIES:
+            delay = retry_after or min(EMBED_BACKOFF_MAX, EMBED_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+            time.sleep(delay)
+    return results, remaining
+
+def embed_texts_locally(texts, backend):
+    """
+    Embeds texts with a local model. Batching and threading happen inside the
+    model; we feed it in slices only to report progress. Returns ({text: embedding}, failed_texts).
+    """
+    slice_size = embeddings.LOCAL_EMBEDDING_BATCH_SIZE * 8
+    results = {}
+    print(f"Embedding {len(texts)} new chunks locally with {backend.key}...")
+    report_progress('embed', 0, len(texts))
+    try:
+        for start in range(0, len(texts), slice_size):
+            batch = texts[start:start + slice_size]
+            results.update(zip(batch, backend.embed_many(batch)))
+            report_progress('embed', len(results), len(texts))
+    except Exception as e:
+        print(f"❌ Error in local embedding: {e}")
+    return results, [text for text in texts if text not in results]
+
+def embed_texts(texts, backend=None):
+    """
+    Embeds texts in batches of EMBED_BATCH_SIZE, with up to EMBED_CONCURRENCY
+    batches in flight under a token bucket of EMBED_REQUESTS_PER_MINUTE.
+    Local backends skip all that. Returns ({text: embedding}, failed_texts).
+    """
+    backend = backend or embeddings.get_backend()
+    if not backend.remote:
+        return embed_texts_locally(texts, backend)
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    limiter = gemini_client.RateLimiter(EMBED_REQUESTS_PER_MINUTE, burst=EMBED_CONCURRENCY)
+    results, failed = {}, []
+    print(f"Requesting embeddings for {len(texts)} new chunks in {len(batches)} batches "
+          f"({EMBED_CONCURRENCY} concurrent, {EMBED_REQUESTS_PER_MINUTE} requests/min)...")
+    report_progress('embed', 0, len(texts))
+    with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as pool:
+        futures = [pool.submit(embed_batch_with_retries, batch, limiter, backend) for batch in batches]
+        for done, future in enumerate(as_completed(futures), start=1):
+            batch_results, batch_failed = future.result()
+            results.update(batch_results)
+            failed.extend(batch_failed)
+            print(f"Processed batch {done}/{len(batches)} ({len(results)} embedded, {len(failed)} failed)")
+            report_progress('embed', len(results) + len(failed), len(texts))
+    return results, failed
 
-    # --- 5. Create Embeddings with Cache ---
-    print(f"Loading/Updating embeddings for total {len(all_chunks)} chunks...")
-    
-    # Load cache
-    cache = {}
-    if os.path.exists(CACHE_PATH):
+def open_embedding_cache(backend_key=None):
+    """
+    Opens the memory-mapped embeddings cache of one embedding backend (each
+    model has its own), importing the old Gemini pickle cache the first time
+    so existing embeddings aren't requested again.
+    """
+    backend_key = backend_key or embeddings.configured_key()
+    if backend_key != embeddings.LEGACY_EMBEDDING_KEY:
+        return VectorStore(f"{VECTOR_CACHE_PATH}.{embeddings.cache_suffix(backend_key)}")
+    store = VectorStore(VECTOR_CACHE_PATH)
+    if len(store) == 0 and os.path.exists(CACHE_PATH):
+        print(f"Migrating {CACHE_PATH} to the memory-mapped embeddings cache...")
         try:
-            with open(CACHE_PATH, 'rb') as f:
-                cache = pickle.load(f)
-            print(f"Loaded {len(cache)} entries from cache.")
+            print(f"Imported {store.import_pickle_cache(CACHE_PATH)} cached embeddings.")
         except Exception as e:
-            print(f"Error loading cache: {e}")
-
-    embeddings_map = {}
-    chunks_to_embed = []
-    
-    # Identify which chunks need new embeddings
-    for chunk in all_chunks:
-        if chunk in cache:
-            embeddings_map[chunk] = cache[chunk]
-        else:
-            if chunk not in chunks_to_embed: # Avoid duplicates in the same batch
-                chunks_to_embed.append(chunk)
+            print(f"Error migrating cache: {e}")
+    return store
+
+def embed_chunks(chunks, backend=None):
+    """
+    Returns one embedding (or None on failure) per chunk, using and updating
+    the embeddings cache so unchanged text is never re-embedded.
+    """
+    backend = backend or embeddings.get_backend()
+    store = open_embedding_cache(backend.key)
+    print(f"Embeddings cache holds {len(store)} vectors.")
+    keys = [content_key(chunk) for chunk in chunks]
+
+    # Identify which chunks need new embeddings (dict keeps order and de-duplicates)
+    chunks_to_embed = list(dict.fromkeys(c for c, key in zip(chunks, keys) if key not in store))
 
-    # Process new chunks in batches
-    batch_size = 100
     new_embeddings_count = 0
-    
     if chunks_to_embed:
-        print(f"Requesting embeddings for {len(chunks_to_embed)} new chunks in batches of {batch_size}...")
-        for i in range(0, len(chunks_to_embed), batch_size):
-            batch = chunks_to_embed[i:i + batch_size]
-            print(f"Processing batch {i//batch_size + 1}/{(len(chunks_to_embed)-1)//batch_size + 1}...")
-            
-            batch_results = get_embeddings_batch(batch)
-            
-            for chunk, emb in zip(batch, batch_results):
-                if emb:
-                    embeddings_map[chunk] = emb
-                    cache[chunk] = emb
-                    new_embeddings_count += 1
-            
-            # Rate limiting for batches
-            if i + batch_size < len(chunks_to_embed):
-                time.sleep(1.0) 
-
-    # Final ordered embeddings list
-    embeddings = []
-    for chunk in all_chunks:
-        if chunk in embeddings_map:
-            embeddings.append(embeddings_map[chunk])
+        new_embeddings, failed = embed_texts(chunks_to_embed, backend)
+        if new_embeddings:
+            # Only the new rows are written; the rest of the cache is untouched
+            texts = list(new_embeddings)
+            new_embeddings_count = store.append([content_key(t) for t in texts], [new_embeddings[t] for t in texts])
+        if failed:
+            print(f"⚠️ {len(failed)} chunks could not be embedded; they will be retried on the next sync.")
+
+    if not chunks_to_embed:
+        report_progress('embed', 0, 0)  # Everything came from the cache
+    print(f"Embeddings prepared: {new_embeddings_count} new, {len(chunks) - len(chunks_to_embed)} from cache")
+    found = store.get_many(keys)
+    return [found.get(key) for key in keys]
+
+# --- Brain Files (versioned snapshots, see brain_store.py) ---
+def load_chunk_map(version=None):
+    """
+    Returns a brain version's chunks (default: the live one) as an editable
+    {chunk_id: text} dict. Legacy brains may hold a pickled list.
+    """
+    version = version or brain_store.live_version()
+    if version is None:
+        return {}
+    chunks = brain_store.load_chunks(version)
+    if isinstance(chunks, list):
+        return dict(enumerate(chunks))
+    try:
+        return chunks.to_dict()
+    finally:
+        chunks.close()
+
+def new_manifest():
+    # 'embedding' records the backend, so queries and syncs use the same model
+    return {'next_id': 0, 'dim': None, 'embedding': embeddings.configured_key(),
+            'chunking': chunking_settings(), 'documents': {}}
+
+def save_brain(index, chunk_map, manifest):
+    """
+    Writes the FAISS index, the {chunk_id: text} store and the manifest as a
+    new brain version, then makes it live with one atomic pointer swap.
+    Nothing is overwritten in place, so readers of the old version are never
+    disturbed. An empty chunk map clears the knowledge base instead.
+    """
+    if not chunk_map or index is None or index.ntotal == 0:
+        brain_store.publish(None)
+        print("Knowledge base cleared.")
+        return None
+
+    report_progress('index', 1, 2)
+    version = brain_store.write_version(index, chunk_map, manifest)
+    brain_store.publish(version)
+    report_progress('index', 2, 2)
+    print(f"Saved brain version '{version}' to: {brain_store.version_dir(version)}")
+    return version
+
+def choose_index_type(n_vectors, index_type=None):
+    index_type = index_type or INDEX_TYPE
+    if index_type != 'auto':
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}' (expected auto or one of {INDEX_TYPES})")
+        return index_type
+    if n_vectors <= FLAT_MAX_VECTORS:
+        return 'flat'
+    if n_vectors <= IVF_MAX_VECTORS:
+        return 'ivf'
+    return 'ivfpq'
+
+def ivf_nlist(n_vectors):
+    # ~4*sqrt(N) lists, with at least 39 training points per centroid
+    return int(max(1, min(4 * np.sqrt(n_vectors), n_vectors // 39)))
+
+def build_index(vectors, ids, index_type=None):
+    """
+    Builds (and trains, for IVF types) an index over vectors with the given ids.
+    Returns the index and the type actually used, since IVF-PQ falls back to
+    IVF-Flat when there is too little data to train the codebooks.
+    """
+    n, d = vectors.shape
+    index_type = choose_index_type(n, index_type)
+    if index_type == 'ivfpq' and (n < 39 * (1 << PQ_BITS) or d % PQ_SUBQUANTIZERS):
+        print(f"⚠️ Not enough vectors ({n}) to train IVF-PQ, using IVF-Flat instead.")
+        index_type = 'ivf'
+
+    print(f"Creating FAISS index ({index_type}) over {n} vectors...")
+    report_progress('index', 0, 2)
+    if index_type == 'flat':
+        # ID-mapped so a document's vectors can be dropped with remove_ids
+        index = faiss.IndexIDMap(faiss.IndexFlatL2(d))
+    elif index_type == 'hnsw':
+        hnsw = faiss.IndexHNSWFlat(d, HNSW_M)
+        hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index = faiss.IndexIDMap2(hnsw)
+    else:
+        # IVF indexes store ids natively and support remove_ids
+        nlist = ivf_nlist(n)
+        quantizer = faiss.IndexFlatL2(d)
+        if index_type == 'ivf':
+            index = faiss.IndexIVFFlat(quantizer, d, nlist)
         else:
-             # This should ideally not happen if batch calls succeed
-             pass
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, PQ_SUBQUANTIZERS, PQ_BITS)
+        print(f"Training {index_type} with {nlist} lists...")
+        index.train(vectors)
 
-    if not embeddings:
-        print("Error: No embeddings were created.")
+    index.add_with_ids(vectors, ids)
+    return index, index_type
+
+def register_document(chunk_map, manifest, file_path, raw_text, file_hash):
+    """
+    Splits one document and records its chunks under a fresh id range in the
+    manifest and the chunk map. Returns [(chunk_id, text), ...].
+    """
+    filename = os.path.basename(file_path)
+    stat = os.stat(file_path)
+    chunks = chunk_document(file_path, raw_text)
+
+    start_id = manifest['next_id']
+    end_id = start_id + len(chunks)
+    manifest['next_id'] = end_id
+    manifest['documents'][filename] = {
+        'hash': file_hash,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'start_id': start_id,
+        'end_id': end_id,
+        'missing': 0,
+        'pages': [chunk.page for chunk in chunks],  # Source page of each chunk, in id order
+        'offsets': [chunk.offset for chunk in chunks],  # Character offset of each chunk in the text
+    }
+    entries = list(enumerate((chunk.text for chunk in chunks), start=start_id))
+    chunk_map.update(entries)
+    print(f"✅ Split {filename} into {len(chunks)} chunks (ids {start_id}-{end_id - 1})")
+    return entries
+
+def register_documents(chunk_map, manifest, file_paths):
+    """
+    Extracts (in parallel) and registers several documents, in order.
+    """
+    file_hashes = {file_path: file_sha256(file_path) for file_path in file_paths}
+    texts = read_documents(file_hashes)
+    entries = []
+    report_progress('split', 0, len(file_paths))
+    for done, file_path in enumerate(file_paths, start=1):
+        entries.extend(register_document(chunk_map, manifest, file_path, texts[file_path], file_hashes[file_path]))
+        report_progress('split', done, len(file_paths))
+    return entries
+
+def embed_entries(manifest, entries):
+    """
+    Embeds registered chunks in one pipeline run (so batches span documents).
+    Chunks that failed are counted per document in the manifest's 'missing'
+    field so the next sync retries them. Returns (ids, vectors).
+    """
+    backend = embeddings.get_backend(manifest.get('embedding', embeddings.LEGACY_EMBEDDING_KEY))
+    chunk_embeddings = embed_chunks([text for _, text in entries], backend) if entries else []
+    ids, vectors, missing = [], [], []
+    for (chunk_id, _), emb in zip(entries, chunk_embeddings):
+        if emb is None:
+            missing.append(chunk_id)
+        else:
+            ids.append(chunk_id)
+            vectors.append(emb)
+    for doc in manifest['documents'].values():
+        doc['missing'] = doc.get('missing', 0) + sum(doc['start_id'] <= i < doc['end_id'] for i in missing)
+    return np.array(ids, dtype='int64'), np.array(vectors, dtype='float32')
+
+def remove_document(index, chunk_map, manifest, filename):
+    """
+    Drops one document's vectors and chunks using its manifest id range.
+    """
+    doc = manifest['documents'].pop(filename, None)
+    if doc is None:
+        return 0
+    ids = np.arange(doc['start_id'], doc['end_id'], dtype='int64')
+    removed = index.remove_ids(ids) if index is not None and len(ids) else 0
+    for chunk_id in range(doc['start_id'], doc['end_id']):
+        chunk_map.pop(chunk_id, None)
+    print(f"🗑️ Removed {removed} vectors for {filename}")
+    return removed
+
+def rebuild_brain(upload_dir="data_uploads", index_type=None):
+    """
+    Rebuilds the whole brain from scratch from every document in upload_dir.
+    index_type overrides INDEX_TYPE ('auto', 'flat', 'ivf', 'hnsw' or 'ivfpq').
+    """
+    print(f"Starting brain rebuild from directory: {upload_dir}")
+
+    if not os.path.exists(upload_dir):
+        print(f"Error: Directory not found: {upload_dir}")
         return False
 
-    # Save cache if updated
-    if new_embeddings_count > 0:
-        print(f"Saving {len(cache)} entries to cache...")
-        try:
-            with open(CACHE_PATH, 'wb') as f:
-                pickle.dump(cache, f)
-        except Exception as e:
-            print(f"Error saving cache: {e}")
+    files = list_documents(upload_dir)
+    if not files:
+        print(f"No supported files ({SUPPORTED_EXTENSIONS}) found to ingest.")
+        save_brain(None, {}, None)
+        prune_text_cache(None)
+        return True
 
-    embeddings = np.array(embeddings).astype('float32')
-    print(f"Total embeddings prepared: {embeddings.shape} ({new_embeddings_count} new, {len(all_chunks) - new_embeddings_count} from cache)")
+    chunk_map, manifest = {}, new_manifest()
+    entries = register_documents(chunk_map, manifest, [os.path.join(upload_dir, f) for f in files])
 
-    # --- 6. Create and Save FAISS Vector Database ---
-    print("Creating FAISS index...")
-    d = embeddings.shape[1] 
-    index = faiss.IndexFlatL2(d)
-    index.add(embeddings)
+    ids, vectors = embed_entries(manifest, entries)
+    if len(ids) == 0:
+        print("Error: No embeddings were created.")
+        return False
 
-    print(f"Saving FAISS index to: {VECTOR_DB_PATH}")
-    faiss.write_index(index, VECTOR_DB_PATH)
+    manifest['dim'] = vectors.shape[1]
+    manifest['index_mode'] = index_type or INDEX_TYPE
+    index, manifest['index_type'] = build_index(vectors, ids, index_type)
 
-    # --- 7. Save the Text Chunks ---
-    print(f"Saving text chunks to: {DATA_STORE_PATH}...")
-    with open(DATA_STORE_PATH, 'wb') as f:
-        pickle.dump(all_chunks, f)
+    save_brain(index, chunk_map, manifest)
+    prune_text_cache(manifest)
 
     print("-" * 30)
     print("✅ Brain Rebuild Complete!")
-    print(f"Your updated AI brain is saved in '{VECTOR_DB_PATH}' and '{DATA_STORE_PATH}'.")
+    print(f"Your updated AI brain is live as '{brain_store.current_version()}' in '{brain_store.BRAINS_DIR}'.")
     print("-" * 30)
     return True
 
+def _document_changed(file_path, doc):
+    stat = os.stat(file_path)
+    if stat.st_size == doc.get('size') and stat.st_mtime == doc.get('mtime'):
+        return False
+    return file_sha256(file_path) != doc.get('hash')
+
+def sync_brain(upload_dir="data_uploads"):
+    """
+    Incrementally brings the brain in line with upload_dir using the manifest:
+    new or changed documents are embedded and appended, removed or changed ones
+    have their vectors dropped. Everything else is left untouched.
+    Falls back to a full rebuild when there is no manifest (e.g. a legacy brain).
+    """
+    if not os.path.exists(upload_dir):
+        print(f"Error: Directory not found: {upload_dir}")
+        return False
+
+    version = brain_store.live_version()
+    manifest = brain_store.load_manifest(version) if version else None
+    if manifest is None:
+        print("No brain manifest found, doing a full rebuild.")
+        return rebuild_brain(upload_dir)
+    if manifest.get('embedding', embeddings.LEGACY_EMBEDDING_KEY) != embeddings.configured_key():
+        # Vectors from different models can't share an index
+        print(f"Embedding backend changed to {embeddings.configured_key()}, doing a full rebuild.")
+        return rebuild_brain(upload_dir, index_type=manifest.get('index_mode'))
+    if manifest.get('chunking') != chunking_settings():
+        # Mixing chunk sizes would skew retrieval; re-chunk everything
+        print("Chunking settings changed, doing a full rebuild.")
+        return rebuild_brain(upload_dir, index_type=manifest.get('index_mode'))
+
+    try:
+        # A private, fully-read copy: the live version on disk is never modified
+        index = brain_store.load_index(version)
+        chunk_map = load_chunk_map(version)
+    except Exception as e:
+        print(f"Error loading existing brain ({e}), doing a full rebuild.")
+        return rebuild_brain(upload_dir, index_type=manifest.get('index_mode'))
+
+    files = list_documents(upload_dir)
+    # Documents with chunks that failed to embed last time are re-added too
+    to_remove = [name for name, doc in manifest['documents'].items()
+                 if name not in files or doc.get('missing')
+                 or _document_changed(os.path.join(upload_dir, name), doc)]
+    if to_remove and manifest.get('index_type') == 'hnsw':
+        print("HNSW indexes cannot remove vectors, doing a full rebuild.")
+        return rebuild_brain(upload_dir, index_type=manifest.get('index_mode'))
+    for filename in to_remove:
+        remove_document(index, chunk_map, manifest, filename)
+
+    to_add = [name for name in files if name not in manifest['documents']]
+    entries = register_documents(chunk_map, manifest, [os.path.join(upload_dir, f) for f in to_add])
+    ids, vectors = embed_entries(manifest, entries)
+    report_progress('index', 0, 2)
+    if len(ids):
+        index.add_with_ids(vectors, ids)
+
+    if not to_remove and not to_add:
+        print("Brain is already up to date.")
+        prune_text_cache(manifest)
+        return True
+
+    save_brain(index, chunk_map, manifest)
+    prune_text_cache(manifest)
+    print(f"✅ Brain synced: {len(to_add)} added, {len(to_remove)} removed ({index.ntotal} vectors).")
+    suggested = choose_index_type(index.ntotal, 'auto')
+    if manifest.get('index_mode') == 'auto' and suggested != manifest.get('index_type'):
+        print(f"ℹ️ Corpus size now suits a '{suggested}' index; run 'python ingest.py' to rebuild it.")
+    return True
+
 if __name__ == "__main__":
-    rebuild_brain()
+    import argparse
+    parser = argparse.ArgumentParser(description="Rebuild the chatbot's FAISS brain from data_uploads/.")
+    parser.add_argument('--index-type', default=None, choices=('auto',) + INDEX_TYPES,
+                        help="Index type (default: $INDEX_TYPE or 'auto', chosen by corpus size)")
+    args = parser.parse_args()
+    import logging
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(levelname)s %(name)s: %(message)s")
+    from ingest_queue import writer_lock
+    with writer_lock():  # Waits for any ingestion job the web app is running
+        rebuild_brain(index_type=args.index_type)
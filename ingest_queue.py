@@ -0,0 +1,257 @@
+import os
+import logging
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+import ingest
+from background import BackgroundThread
+from sqlite_store import SQLiteStore
+
+log = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Not available on Windows; the writer lock is then per process only
+
+# --- Configuration ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+JOBS_DB_PATH = os.getenv("INGEST_JOBS_DB", os.path.join(BASE_DIR, "ingest_jobs.db"))
+WRITER_LOCK_PATH = JOBS_DB_PATH + ".lock"
+POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "2.0"))  # Seconds between checks for queued jobs
+PROGRESS_WRITE_INTERVAL = 0.5  # Seconds between progress writes within a stage
+KEEP_FINISHED_JOBS = 100  # Older finished jobs are deleted
+STAGES = ('extract', 'split', 'embed', 'index')
+
+# Job status -> the status shown on the admin dashboard
+DISPLAY_STATUS = {
+    'queued': 'Queued',
+    'running': 'Processing',
+    'done': 'Success',
+    'failed': 'Failed',
+    'error': 'Error',
+}
+
+# --- Single-Writer Lock ---
+_process_lock = threading.Lock()
+
+@contextmanager
+def writer_lock(blocking=True):
+    """
+    Held by whoever is changing the brain (job worker or 'python ingest.py').
+    An OS file lock, so it works across gunicorn workers and is released by
+    the kernel if the holder dies. Yields False if non-blocking and busy.
+    """
+    if not _process_lock.acquire(blocking):
+        yield False
+        return
+    try:
+        if fcntl is None:
+            yield True
+            return
+        with open(WRITER_LOCK_PATH, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    finally:
+        _process_lock.release()
+
+# --- Job Queue ---
+class IngestQueue(SQLiteStore):
+    """
+    Durable queue of ingestion jobs in SQLite, run one at a time by a
+    background thread. Jobs are 'sync' (incremental) or 'rebuild' (from
+    scratch). Submitting while a job is already waiting merges into it, so a
+    burst of uploads/deletes costs one more run, not one run each.
+    """
+
+    def __init__(self, upload_dir, db_path=JOBS_DB_PATH, on_complete=None):
+        self.upload_dir = upload_dir
+        self.db_path = db_path
+        self.on_complete = on_complete  # Called with the job dict after each successful run
+        self._wake = threading.Event()
+        self._worker = BackgroundThread(self._run_forever, "ingest-worker")
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    reason TEXT,
+                    requests INTEGER NOT NULL DEFAULT 1,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    progress TEXT,
+                    error TEXT
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        finally:
+            conn.close()
+
+    def submit(self, kind='sync', reason=None):
+        """
+        Queues a job and returns its id. If a job is already waiting it absorbs
+        this one instead; a rebuild upgrades a waiting sync.
+        """
+        with self._transaction() as conn:
+            waiting = conn.execute("SELECT id, kind FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if waiting:
+                job_id = waiting['id']
+                new_kind = 'rebuild' if 'rebuild' in (kind, waiting['kind']) else 'sync'
+                conn.execute("UPDATE jobs SET kind = ?, requests = requests + 1 WHERE id = ?", (new_kind, job_id))
+                log.debug("Ingestion request coalesced into queued job %s", job_id)
+            else:
+                job_id = conn.execute("INSERT INTO jobs (kind, status, reason, created_at) VALUES (?, 'queued', ?, ?)",
+                                      (kind, reason, time.time())).lastrowid
+                log.info("Queued ingestion job %s (%s)", job_id, kind)
+        self.start()
+        self._wake.set()
+        return job_id
+
+    # --- Worker ---
+    def start(self):
+        """
+        Starts the worker thread for this process unless it is running.
+        """
+        self._worker.start()
+
+    def _run_forever(self):
+        while True:
+            try:
+                ran = self.run_next()
+            except Exception as e:
+                log.exception("Error in ingestion worker: %s", e)
+                ran = False
+            if not ran:
+                self._wake.wait(POLL_INTERVAL)
+                self._wake.clear()
+
+    def run_next(self):
+        """
+        Runs the oldest queued job, if this process can take the writer lock.
+        Returns True if a job was run.
+        """
+        with writer_lock(blocking=False) as acquired:
+            if not acquired:
+                return False
+            job = self._claim()
+            if job is None:
+                return False
+            self._run(job)
+            return True
+
+    def _claim(self):
+        with self._transaction() as conn:
+            # We hold the writer lock, so a 'running' job is left over from a crash
+            conn.execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+            conn.execute("DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND id NOT IN "
+                         "(SELECT id FROM jobs ORDER BY id DESC LIMIT ?)", (KEEP_FINISHED_JOBS,))
+            row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET status = 'running', started_at = ?, progress = NULL WHERE id = ?",
+                         (time.time(), row['id']))
+        return dict(row)
+
+    def _run(self, job):
+        log.info("Running ingestion job %s (%s)", job['id'], job['kind'])
+        progress = {}
+        last_write = [0.0]
+
+        def on_progress(stage, done, total):
+            now = time.time()
+            entry = progress.setdefault(stage, {'started_at': now})
+            entry.update(done=done, total=total)
+            finished = done >= total
+            if finished:
+                entry.setdefault('finished_at', now)
+            if finished or now - last_write[0] >= PROGRESS_WRITE_INTERVAL:
+                last_write[0] = now
+                self._update(job['id'], progress=json.dumps(progress))
+
+        ingest.progress_callback = on_progress
+        status, error = 'done', None
+        try:
+            if job['kind'] == 'rebuild':
+                success = ingest.rebuild_brain(self.upload_dir)
+            else:
+                success = ingest.sync_brain(self.upload_dir)
+            if not success:
+                status, error = 'failed', 'Ingestion produced no chunks (check file types/content)'
+        except Exception as e:
+            status, error = 'error', str(e)
+        finally:
+            ingest.progress_callback = None
+        self._update(job['id'], status=status, error=error, finished_at=time.time(), progress=json.dumps(progress))
+        log.info("Ingestion job %s finished: %s", job['id'], status)
+        if status == 'done' and self.on_complete is not None:
+            self.on_complete(job)
+
+    def _update(self, job_id, **fields):
+        conn = self._connect()
+        try:
+            assignments = ", ".join(f"{name} = ?" for name in fields)
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        finally:
+            conn.close()
+
+    # --- Status ---
+    @staticmethod
+    def _describe(row):
+        job = dict(row)
+        progress = json.loads(job.pop('progress') or '{}')
+        stages = []
+        for stage in STAGES:
+            entry = progress.get(stage)
+            if entry is None:
+                continue
+            done, total = entry['done'], entry['total']
+            eta = None
+            if 'finished_at' not in entry and done > 0:
+                elapsed = time.time() - entry['started_at']
+                eta = round(elapsed / done * (total - done), 1)
+            stages.append({'stage': stage, 'done': done, 'total': total, 'eta_seconds': eta,
+                           'finished': 'finished_at' in entry})
+        job['stages'] = stages
+        job['stage'] = stages[-1]['stage'] if stages else None
+        for name in ('created_at', 'started_at', 'finished_at'):
+            if job[name] is not None:
+                job[name] = datetime.fromtimestamp(job[name]).strftime('%Y-%m-%d %H:%M:%S')
+        return job
+
+    def status(self):
+        """
+        Summary for /ingest_status: the running job (else the latest one) with
+        per-stage progress and ETA, plus how many jobs are waiting.
+        """
+        self.start()  # Picks up jobs left queued by a previous run of the app
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE status = 'running' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                row = conn.execute("SELECT * FROM jobs WHERE status != 'queued' ORDER BY id DESC LIMIT 1").fetchone()
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        finally:
+            conn.close()
+
+        if row is None:
+            return {'status': 'Queued' if queued else 'Idle', 'last_run': None, 'error': None,
+                    'queued': queued, 'job': None}
+        job = self._describe(row)
+        return {
+            'status': DISPLAY_STATUS[job['status']],
+            'last_run': job['finished_at'] or job['started_at'],
+            'error': job['error'],
+            'queued': queued,
+            'job': job,
+        }
@@ -0,0 +1,113 @@
+import os
+import re
+import json
+import math
+from collections import Counter, defaultdict
+import numpy as np
+
+# --- BM25 Parameters ---
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Words, and dotted numbers kept whole so section numbers like "4.2.1" match
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)*")
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from how i in is it its me my of on or that the
+their there these this to was were what when where which who why will with you your
+""".split())
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+class LexicalIndex:
+    """
+    BM25 inverted index over chunk texts, stored next to the FAISS index:
+      <base>.terms.json    {term: [start, end)} into the postings, plus avgdl
+      <base>.postings.npy  int64 rows of (doc position, term frequency), grouped by term
+      <base>.docs.npy      int64 rows of (chunk_id, length in tokens)
+    The arrays are memory-mapped on load, like the chunk store.
+    """
+
+    def __init__(self, terms, postings, docs, avgdl):
+        self.terms = terms
+        self.postings = postings
+        self.docs = docs
+        self.avgdl = avgdl
+
+    @classmethod
+    def build(cls, chunk_map):
+        chunk_ids = sorted(chunk_map)
+        by_term = defaultdict(list)
+        lengths = []
+        for pos, chunk_id in enumerate(chunk_ids):
+            tokens = tokenize(chunk_map[chunk_id])
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                by_term[term].append((pos, tf))
+        terms, rows = {}, []
+        for term in sorted(by_term):
+            terms[term] = (len(rows), len(rows) + len(by_term[term]))
+            rows.extend(by_term[term])
+        postings = np.array(rows, dtype='int64').reshape(-1, 2)
+        docs = np.array(list(zip(chunk_ids, lengths)), dtype='int64').reshape(-1, 2)
+        avgdl = float(np.mean(lengths)) if lengths else 0.0
+        return cls(terms, postings, docs, avgdl)
+
+    @staticmethod
+    def exists(base_path):
+        return os.path.exists(base_path + '.terms.json')
+
+    def save(self, base_path):
+        with open(base_path + '.terms.json', 'w', encoding='utf-8') as f:
+            json.dump({'avgdl': self.avgdl, 'k1': BM25_K1, 'b': BM25_B, 'terms': self.terms}, f)
+        np.save(base_path + '.postings.npy', self.postings)
+        np.save(base_path + '.docs.npy', self.docs)
+
+    @classmethod
+    def load(cls, base_path):
+        with open(base_path + '.terms.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        postings = np.load(base_path + '.postings.npy', mmap_mode='r')
+        docs = np.load(base_path + '.docs.npy', mmap_mode='r')
+        return cls(meta['terms'], postings, docs, meta['avgdl'])
+
+    def __len__(self):
+        return len(self.docs)
+
+    def idf(self, term):
+        span = self.terms.get(term)
+        n, df = len(self.docs), (span[1] - span[0]) if span else 0
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query, k=5, chunk_ids=None):
+        """
+        Returns [(chunk_id, score, coverage), ...] best first. coverage is the
+        share of the query's IDF weight the chunk matches (0-1), which unlike
+        raw BM25 scores is comparable across queries and corpora.
+        chunk_ids, if given, restricts the results to those chunks.
+        """
+        query_terms = set(tokenize(query))
+        if not query_terms or len(self.docs) == 0:
+            return []
+        scores = np.zeros(len(self.docs), dtype='float64')
+        matched = np.zeros(len(self.docs), dtype='float64')
+        lengths = np.asarray(self.docs[:, 1], dtype='float64')
+        total_idf = 0.0
+        for term in query_terms:
+            idf = self.idf(term)
+            total_idf += idf
+            span = self.terms.get(term)
+            if not span:
+                continue
+            rows = np.asarray(self.postings[span[0]:span[1]])
+            positions, tf = rows[:, 0], rows[:, 1].astype('float64')
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[positions] / (self.avgdl or 1.0))
+            scores[positions] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+            matched[positions] += idf
+        if chunk_ids is not None:
+            scores[~np.isin(self.docs[:, 0], chunk_ids)] = 0.0
+        candidates = np.flatnonzero(scores)
+        if len(candidates) == 0:
+            return []
+        top = candidates[np.argsort(-scores[candidates], kind='stable')[:k]]
+        return [(int(self.docs[pos, 0]), float(scores[pos]), float(matched[pos] / total_idf)) for pos in top]
@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import glob
+import logging
+import threading
+from contextlib import contextmanager
+from background import BackgroundThread
+
+log = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Directory where each process publishes its metrics so /metrics can add up
+# all gunicorn workers (set by gunicorn.conf.py). Empty = this process only.
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5.0"))  # Seconds between publishes
+# Latency buckets in seconds: from a cached lookup up to a slow model call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _registry.touch()
+
+    def snapshot(self):
+        with self._lock:
+            return {'type': 'counter', 'help': self.help, 'labels': self.labelnames,
+                    'series': [[list(key), value] for key, value in self._values.items()]}
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            else:
+                entry[0][-1] += 1
+            entry[1] += value
+        _registry.touch()
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {'type': 'histogram', 'help': self.help, 'labels': self.labelnames, 'buckets': self.buckets,
+                    'series': [[list(key), [list(counts), total]] for key, (counts, total) in self._values.items()]}
+
+class Registry:
+    """
+    All metrics of this process. With METRICS_DIR set, a background thread
+    writes them to <METRICS_DIR>/<pid>.json when they change, and render()
+    adds up every process's file. Files of exited workers are kept, so
+    counters stay cumulative for the life of the server.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self._dirty = threading.Event()
+        self._publisher = BackgroundThread(self._run, "metrics")
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def touch(self):
+        self._dirty.set()
+        if METRICS_DIR:
+            self._publisher.start()
+
+    def _run(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            self.publish()
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def publish(self):
+        self._dirty.clear()
+        if not METRICS_DIR:
+            return
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            log.error("Error publishing metrics: %s", e)
+
+    def collect(self):
+        """
+        Snapshots of every process (just this one without METRICS_DIR).
+        """
+        if not METRICS_DIR:
+            return [self.snapshot()]
+        self.publish()
+        snapshots = []
+        for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # Being replaced, or left half-written by a crash
+        return snapshots
+
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        merged = {}
+        for snapshot in self.collect():
+            for name, metric in snapshot.items():
+                target = merged.setdefault(name, {'meta': metric, 'series': {}})
+                for labels, value in metric['series']:
+                    key = tuple(labels)
+                    if metric['type'] == 'counter':
+                        target['series'][key] = target['series'].get(key, 0) + value
+                    else:
+                        counts, total = target['series'].get(key, ([0] * len(value[0]), 0.0))
+                        target['series'][key] = ([a + b for a, b in zip(counts, value[0])], total + value[1])
+
+        lines = []
+        for name in sorted(merged):
+            meta, series = merged[name]['meta'], merged[name]['series']
+            lines.append(f"# HELP {name} {meta['help']}")
+            lines.append(f"# TYPE {name} {meta['type']}")
+            for key in sorted(series):
+                labels = list(zip(meta['labels'], key))
+                if meta['type'] == 'counter':
+                    lines.append(f"{name}{format_labels(labels)} {series[key]}")
+                    continue
+                counts, total = series[key]
+                cumulative = 0
+                for bound, count in zip(list(meta['buckets']) + ['+Inf'], counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels + [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+def reset_dir():
+    """
+    Deletes the published metrics of a previous server run (gunicorn on_starting).
+    """
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.json')) if METRICS_DIR else []:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+_registry = Registry()
+
+def counter(name, help, labelnames=()):
+    return _registry.register(Counter(name, help, labelnames))
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _registry.register(Histogram(name, help, labelnames, buckets))
+
+def render():
+    return _registry.render()
+
+# --- Chatbot Metrics ---
+STAGE_SECONDS = histogram("chatbot_stage_seconds", "Time spent in each stage of answering a question", ["stage"])
+MODEL_CALL_SECONDS = histogram("chatbot_model_call_seconds", "Gemini generation calls by model and outcome",
+                               ["model", "outcome"])
+HTTP_REQUEST_SECONDS = histogram("chatbot_http_request_seconds", "Request handling time by endpoint", ["endpoint"])
+MODEL_RETRIES = counter("chatbot_model_retries_total", "Generation calls retried after a network error", ["model"])
+MODEL_HEDGES = counter("chatbot_model_hedges_total", "Slow generation calls hedged with the next model")
+BREAKER_TRIPS = counter("chatbot_breaker_trips_total", "Circuit breaker trips by model and HTTP status",
+                        ["model", "status"])
+FALLBACK_ANSWERS = counter("chatbot_fallback_answers_total", "Answers given as raw context because every model failed",
+                           ["mode"])
+CACHE_LOOKUPS = counter("chatbot_cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"])
+ANSWERS = counter("chatbot_answers_total", "Questions by outcome", ["outcome"])
+
+def span(stage):
+    """
+    Times a block as one stage: with metrics.span('embedding'): ...
+    """
+    return STAGE_SECONDS.time(stage=stage)
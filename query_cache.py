@@ -0,0 +1,261 @@
+import os
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from sqlite_store import SQLiteStore
+
+log = logging.getLogger(__name__)
+
+# --- Configuration ---
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "2048"))
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# Optional SQLite file shared by all gunicorn workers (empty = in-process only)
+EMBEDDING_CACHE_DB = os.getenv("EMBEDDING_CACHE_DB", "")
+
+def normalize_question(text):
+    """
+    Canonical cache key for a question: case, spacing and trailing
+    punctuation don't change what is being asked.
+    """
+    return " ".join(text.lower().split()).rstrip("?!. ")
+
+class EmbeddingCache(SQLiteStore):
+    """
+    Thread-safe LRU of question embeddings, bounded by entry count and bytes,
+    optionally backed by an on-disk SQLite store shared across processes.
+    """
+
+    busy_timeout = 5  # A lookup gives up on a busy store rather than hold up the question
+
+    def __init__(self, max_entries=EMBEDDING_CACHE_MAX_ENTRIES, max_bytes=EMBEDDING_CACHE_MAX_BYTES,
+                 db_path=EMBEDDING_CACHE_DB):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.db_path = db_path or None
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.db_path:
+            self._init_db()
+
+    # --- On-disk store ---
+    def _init_db(self):
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            log.error("Error opening embedding cache DB, using memory only: %s", e)
+            self.db_path = None
+
+    def _disk_get(self, key):
+        try:
+            row = self._thread_connection().execute("SELECT vector FROM embeddings WHERE key = ?",
+                                                    (key,)).fetchone()
+            return np.frombuffer(row[0], dtype='float32') if row else None
+        except sqlite3.Error as e:
+            log.error("Error reading embedding cache DB: %s", e)
+            return None
+
+    def _disk_put(self, key, vector):
+        try:
+            self._thread_connection().execute("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                                              (key, vector.tobytes()))
+        except sqlite3.Error as e:
+            log.error("Error writing embedding cache DB: %s", e)
+
+    # --- LRU ---
+    def _remember(self, key, vector):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = vector
+            self._bytes += vector.nbytes
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    @staticmethod
+    def _key(text, namespace):
+        # namespace (e.g. the embedding model) keeps different models' vectors apart
+        key = normalize_question(text)
+        return f"{namespace}|{key}" if namespace else key
+
+    def get(self, text, namespace=None):
+        key = self._key(text, namespace)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+        if self.db_path:
+            vector = self._disk_get(key)
+            if vector is not None:
+                self._remember(key, vector)
+                with self._lock:
+                    self.disk_hits += 1
+                return vector
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, text, embedding, namespace=None):
+        key = self._key(text, namespace)
+        vector = np.asarray(embedding, dtype='float32')
+        self._remember(key, vector)
+        if self.db_path:
+            self._disk_put(key, vector)
+        return vector
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+            }
+
+# --- Semantic Answer Cache ---
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1024"))
+ANSWER_CACHE_MAX_DISTANCE = float(os.getenv("ANSWER_CACHE_MAX_DISTANCE", "0.05"))  # Cosine distance
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))  # Seconds, 0 disables the cache
+
+class AnswerCache:
+    """
+    Caches generated answers for history-free questions. A lookup hits when a
+    previous question used exactly the same context chunks and its embedding
+    is within max_distance (cosine) of the new one. Entries expire after ttl
+    seconds and are dropped wholesale when the corpus changes.
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, max_distance=ANSWER_CACHE_MAX_DISTANCE,
+                 ttl=ANSWER_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self._entries = OrderedDict()  # context key -> [(unit vector, answer, created_at), ...]
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype='float32')
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, embedding, context_ids):
+        if not self.enabled:
+            return None
+        key = tuple(context_ids)
+        query = self._unit(embedding)
+        now = time.time()
+        with self._lock:
+            entries = self._entries.get(key, [])
+            fresh = [e for e in entries if now - e[2] < self.ttl]
+            if len(fresh) != len(entries):
+                self._size -= len(entries) - len(fresh)
+                if fresh:
+                    self._entries[key] = fresh
+                else:
+                    del self._entries[key]
+            for vector, answer, _ in fresh:
+                if 1.0 - float(np.dot(vector, query)) <= self.max_distance:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return answer
+            self.misses += 1
+        return None
+
+    def put(self, embedding, context_ids, answer):
+        if not self.enabled:
+            return
+        key = tuple(context_ids)
+        with self._lock:
+            self._entries.setdefault(key, []).append((self._unit(embedding), answer, time.time()))
+            self._entries.move_to_end(key)
+            self._size += 1
+            while self._size > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': self._size, 'hits': self.hits, 'misses': self.misses}
+
+# --- Follow-up Rewrite Cache ---
+REWRITE_CACHE_MAX_ENTRIES = int(os.getenv("REWRITE_CACHE_MAX_ENTRIES", "1024"))
+REWRITE_CACHE_TTL = float(os.getenv("REWRITE_CACHE_TTL", "3600"))  # Seconds
+
+class RewriteCache:
+    """
+    LRU of standalone rewrites of follow-up questions, keyed on the question
+    and the conversation it follows, so retries and common follow-ups
+    ("why?" after the same question) don't call the model again.
+    """
+
+    def __init__(self, max_entries=REWRITE_CACHE_MAX_ENTRIES, ttl=REWRITE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (rewrite, created_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(question, context):
+        return f"{normalize_question(context)}|{normalize_question(question)}"
+
+    def get(self, question, context):
+        key = self._key(question, context)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        return None
+
+    def put(self, question, context, rewrite):
+        key = self._key(question, context)
+        with self._lock:
+            self._entries[key] = (rewrite, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
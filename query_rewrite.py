@@ -0,0 +1,61 @@
+import re
+from lexical_index import tokenize
+from sessions import message_text, SUMMARY_PREFIX
+
+# Words that point back at something said earlier, and words that only ask
+# for more of it: a question made of nothing else needs the conversation.
+REFERENCE_WORDS = frozenset("""
+it its this that these those they them their he she him his her one ones above previous same former latter
+""".split())
+FOLLOW_UP_WORDS = frozenset("""
+why how explain elaborate more example examples detail details detailed mean meaning means again else also so
+please tell give show expand clarify simpler simply further continue then but ok okay thanks about
+""".split())
+# "what about X?", "and X?", "how about X?": new content that borrows the rest from earlier
+CONTINUATION_RE = re.compile(r"^\s*(and|or|but|also|what about|how about|same for|compared to|versus|vs\.?)\b", re.I)
+WORD_RE = re.compile(r"[a-z]+")
+MAX_TOPIC_LOOKBACK = 3  # Earlier user messages searched for the topic of a follow-up
+
+STANDALONE, REFERENCE, AMBIGUOUS = 'standalone', 'reference', 'ambiguous'
+
+def content_terms(question):
+    return [t for t in tokenize(question) if t not in REFERENCE_WORDS and t not in FOLLOW_UP_WORDS]
+
+def classify(question):
+    """
+    STANDALONE: can be searched as is. REFERENCE: nothing to search on its
+    own ("why?", "explain that"). AMBIGUOUS: some content of its own but
+    leans on the conversation ("what about 3NF?", "is it faster than a heap?").
+    """
+    content = content_terms(question)
+    if not content:
+        return REFERENCE
+    words = set(WORD_RE.findall(question.lower()))
+    if len(content) <= 3 and (CONTINUATION_RE.match(question) or words & REFERENCE_WORDS):
+        return AMBIGUOUS
+    return STANDALONE
+
+def find_topic(chat_history):
+    """
+    The latest earlier user question that stands on its own, or None.
+    """
+    looked = 0
+    for msg in reversed(chat_history):
+        if msg.get('role') != 'user':
+            continue
+        text = message_text(msg).strip()
+        if not text or text.startswith(SUMMARY_PREFIX):
+            break
+        if classify(text) == STANDALONE:
+            return text
+        looked += 1
+        if looked >= MAX_TOPIC_LOOKBACK:
+            break
+    return None
+
+def heuristic_rewrite(question, topic):
+    """
+    Search text for a follow-up: the earlier question's topic plus the
+    follow-up itself, which is enough for both BM25 and the embedding.
+    """
+    return f"{topic} {question}" if topic else question
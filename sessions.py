@@ -0,0 +1,199 @@
+import os
+import logging
+import json
+import time
+import secrets
+import threading
+from sqlite_store import SQLiteStore
+
+log = logging.getLogger(__name__)
+
+# --- Configuration ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SESSIONS_DB_PATH = os.getenv("SESSIONS_DB", os.path.join(BASE_DIR, "sessions.db"))
+SESSION_WINDOW_MESSAGES = int(os.getenv("SESSION_WINDOW_MESSAGES", "6"))  # Recent messages sent verbatim
+MAX_HISTORY_TOKENS = int(os.getenv("MAX_HISTORY_TOKENS", "800"))          # Summary + recent messages, per prompt
+SUMMARY_TOKENS = int(os.getenv("SESSION_SUMMARY_TOKENS", "200"))          # Target size of the rolling summary
+MAX_MESSAGE_CHARS = 4000        # Longer questions/answers are stored cut to this
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(24 * 3600)))            # Idle sessions are deleted after this
+PRUNE_INTERVAL = 600            # Seconds between deletions of expired sessions
+SUMMARY_PREFIX = "(Summary of our earlier conversation:"  # Opens the summary turn of a capped history
+
+def estimate_tokens(text):
+    # Rough heuristic for English text: ~4 characters per token
+    return len(text) // 4 + 1
+
+def message(role, text):
+    return {"role": role, "parts": [{"text": text}]}
+
+def message_text(msg):
+    return "".join(part.get('text', '') for part in msg.get('parts', []))
+
+def cap_history(messages, summary=None, max_tokens=MAX_HISTORY_TOKENS):
+    """
+    Returns the Gemini 'contents' for a conversation: the summary (as a
+    user/model exchange) then the newest messages that fit in max_tokens.
+    Messages longer than a quarter of the budget are cut, so the last
+    exchange always fits; older ones are dropped first. The history starts
+    on a user turn.
+    """
+    budget = max_tokens
+    head = []
+    if summary:
+        summary = summary[-max_tokens * 4 // 3:]  # At most a third of the budget
+        head = [message("user", f"{SUMMARY_PREFIX} {summary})"),
+                message("model", "Understood.")]
+        budget -= estimate_tokens(summary) + 10
+    kept = []
+    for msg in reversed(messages):
+        text = message_text(msg)
+        if len(text) > max_tokens:  # ~4 characters per token
+            msg = message(msg.get('role'), text[:max_tokens] + " ...")
+        cost = estimate_tokens(message_text(msg))
+        if cost > budget:
+            break
+        kept.insert(0, msg)
+        budget -= cost
+    while kept and kept[0].get('role') != 'user':
+        kept.pop(0)
+    return head + kept
+
+def fallback_summary(summary, messages, max_tokens=SUMMARY_TOKENS):
+    """
+    Extractive summary used when no model is available: the user's earlier
+    questions, newest kept when it gets too long.
+    """
+    questions = [message_text(m) for m in messages if m.get('role') == 'user']
+    text = "; ".join(q for q in [summary] + questions if q)
+    limit = max_tokens * 4
+    return text if len(text) <= limit else "..." + text[-limit:]
+
+# --- Session Store ---
+class SessionStore(SQLiteStore):
+    """
+    Server-side conversations in SQLite, shared by all gunicorn workers.
+    Each session keeps a sliding window of recent messages; messages pushed
+    out of the window wait in 'pending' until a background thread folds them
+    into a rolling summary, so no request waits on summarization.
+    """
+
+    busy_timeout = 10  # A request waits no longer than this for the store
+
+    def __init__(self, db_path=SESSIONS_DB_PATH, summarize=None):
+        self.db_path = db_path
+        # summarize(summary, messages) -> new summary, or None to use the fallback
+        self.summarize = summarize
+        self._folding = set()
+        self._folding_lock = threading.Lock()
+        self._last_prune = 0.0
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    summary TEXT,
+                    pending TEXT NOT NULL DEFAULT '[]',
+                    messages TEXT NOT NULL DEFAULT '[]',
+                    updated_at REAL NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated_at)")
+        finally:
+            conn.close()
+
+    @staticmethod
+    def new_id():
+        return secrets.token_urlsafe(16)
+
+    def _load(self, conn, session_id):
+        row = conn.execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        return {'summary': row['summary'], 'pending': json.loads(row['pending']),
+                'messages': json.loads(row['messages'])}
+
+    def history(self, session_id):
+        """
+        The bounded chat history to send with the next question ([] for a new
+        or expired session).
+        """
+        if not session_id:
+            return []
+        conn = self._connect()
+        try:
+            session = self._load(conn, session_id)
+        finally:
+            conn.close()
+        if session is None:
+            return []
+        return cap_history(session['pending'] + session['messages'], session['summary'])
+
+    def record(self, session_id, question, answer):
+        """
+        Appends a question and its answer, moving messages that leave the
+        window to 'pending' and starting a background fold if there are any.
+        """
+        new_messages = [message("user", question[:MAX_MESSAGE_CHARS]), message("model", answer[:MAX_MESSAGE_CHARS])]
+        with self._transaction() as conn:
+            session = self._load(conn, session_id) or {'summary': None, 'pending': [], 'messages': []}
+            messages = session['messages'] + new_messages
+            overflow = len(messages) - SESSION_WINDOW_MESSAGES
+            pending = session['pending']
+            if overflow > 0:
+                pending, messages = pending + messages[:overflow], messages[overflow:]
+            conn.execute("INSERT OR REPLACE INTO sessions (id, summary, pending, messages, updated_at) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         (session_id, session['summary'], json.dumps(pending), json.dumps(messages), time.time()))
+        if pending:
+            self._start_fold(session_id)
+        self._prune()
+
+    def _start_fold(self, session_id):
+        with self._folding_lock:
+            if session_id in self._folding:
+                return
+            self._folding.add(session_id)
+        threading.Thread(target=self._fold, args=(session_id,), name="session-summary", daemon=True).start()
+
+    def _fold(self, session_id):
+        try:
+            conn = self._connect()
+            try:
+                session = self._load(conn, session_id)
+            finally:
+                conn.close()
+            if session is None or not session['pending']:
+                return
+            folded = session['pending']
+            summary = None
+            if self.summarize is not None:
+                try:
+                    summary = self.summarize(session['summary'], folded)
+                except Exception as e:
+                    log.error("Error summarizing session: %s", e)
+            if not summary:
+                summary = fallback_summary(session['summary'], folded)
+            summary = summary[:SUMMARY_TOKENS * 8]  # A model ignoring the length limit can't grow it forever
+            with self._transaction() as conn:
+                current = self._load(conn, session_id)
+                # Another worker may have folded these messages already
+                if current is None or current['pending'][:len(folded)] != folded:
+                    return
+                conn.execute("UPDATE sessions SET summary = ?, pending = ? WHERE id = ?",
+                             (summary, json.dumps(current['pending'][len(folded):]), session_id))
+            log.debug("Folded %d messages into the session summary (~%d tokens)", len(folded), estimate_tokens(summary))
+        except Exception as e:
+            log.error("Error folding session history: %s", e)
+        finally:
+            with self._folding_lock:
+                self._folding.discard(session_id)
+
+    def _prune(self):
+        now = time.time()
+        if now - self._last_prune < PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM sessions WHERE updated_at < ?", (now - SESSION_TTL,))
+        finally:
+            conn.close()
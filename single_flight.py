@@ -0,0 +1,121 @@
+import threading
+
+class Flight:
+    """
+    One in-flight computation: the pieces it has produced so far and, once
+    it has finished, its result or error.
+    """
+
+    def __init__(self):
+        self.pieces = []
+        self.result = None
+        self.error = None
+        self.done = False
+        self._cond = threading.Condition()
+
+    def add(self, piece):
+        with self._cond:
+            self.pieces.append(piece)
+            self._cond.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self._cond:
+            self.result, self.error, self.done = result, error, True
+            self._cond.notify_all()
+
+    def wait(self):
+        with self._cond:
+            while not self.done:
+                self._cond.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def follow(self):
+        """
+        Yields every piece from the first, each as soon as it is produced.
+        """
+        seen = 0
+        while True:
+            with self._cond:
+                while seen >= len(self.pieces) and not self.done:
+                    self._cond.wait()
+                new, done = self.pieces[seen:], self.done
+            seen += len(new)
+            yield from new
+            if done:
+                break
+        if self.error is not None:
+            raise self.error
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls within a process: the first caller
+    for a key starts the computation, callers arriving while it runs share
+    its result instead of repeating it. Nothing is kept once it finishes;
+    later calls start afresh (the answer cache is what remembers answers).
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.joined = 0
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.joined += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            self.started += 1
+            return flight, True
+
+    def _land(self, key, flight, result=None, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(result, error)
+
+    def do(self, key, fn, *args):
+        """
+        Returns (fn(*args), shared): shared is True when the result came from
+        a call another thread had already started.
+        """
+        flight, leader = self._join(key)
+        if not leader:
+            return flight.wait(), True
+        try:
+            result = fn(*args)
+        except Exception as e:
+            self._land(key, flight, error=e)
+            raise
+        self._land(key, flight, result)
+        return result, False
+
+    def stream(self, key, fn, *args):
+        """
+        Returns (pieces, shared) for a generator function: pieces iterates
+        over everything fn(*args) yields. The generator runs on its own
+        thread, so a client that hangs up doesn't cut the stream short for
+        the others following it.
+        """
+        flight, leader = self._join(key)
+        if leader:
+            threading.Thread(target=self._run_stream, args=(key, flight, fn, args),
+                             name="single-flight", daemon=True).start()
+        return flight.follow(), not leader
+
+    def _run_stream(self, key, flight, fn, args):
+        try:
+            for piece in fn(*args):
+                flight.add(piece)
+        except Exception as e:
+            self._land(key, flight, error=e)
+            return
+        self._land(key, flight)
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._flights), 'started': self.started, 'joined': self.joined}
@@ -0,0 +1,53 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+_local_lock = threading.Lock()
+
+class SQLiteStore:
+    """
+    Base for the stores kept in SQLite (sessions, ingestion jobs, events,
+    cached embeddings). Operations open their own short-lived connection in
+    WAL mode, so the store can be used from any thread and by every gunicorn
+    worker at once; hot-path lookups can reuse one connection per thread
+    instead. Subclasses set self.db_path.
+    """
+
+    busy_timeout = 30  # Seconds to wait for another process's write to finish
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _thread_connection(self):
+        """
+        This thread's own connection, opened on first use and then kept, for
+        queries on the request path where connecting each time would cost more
+        than the query. A forked child opens a fresh one.
+        """
+        local = self.__dict__.get('_local')
+        if local is None:
+            with _local_lock:
+                local = self.__dict__.setdefault('_local', threading.local())
+        if getattr(local, 'pid', None) != os.getpid():
+            local.conn = self._connect()
+            local.pid = os.getpid()
+        return local.conn
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front, so a read-then-write can't
+        # be overtaken by another writer in between
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
@@ -56,6 +56,7 @@ clearBtn.addEventListener('click', () => {
         </div>
     `;
     if (speechSynthesis.speaking) speechSynthesis.cancel();
+    sessionId = null;  // Start a new conversation
     // Re-run MathJax on the welcome message after clearing
     if (window.MathJax) {
         MathJax.typesetPromise([chatBox.querySelector('.bot-message')]).catch((err) => console.log('MathJax error:', err));
@@ -77,22 +78,8 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 });
 
-// --- Helper to get chat history ---
-function getChatHistory() {
-    const messages = chatBox.querySelectorAll('.message');
-    const history = [];
-    // Get the last 4 messages (or fewer if not available)
-    const recentMessages = Array.from(messages).slice(-4);
-
-    recentMessages.forEach(msg => {
-        const role = msg.dataset.role; // We'll add this dataset attribute
-        const text = msg.querySelector('p') ? msg.querySelector('p').textContent : msg.querySelector('div').textContent; // Handle p or div
-        if (role && text) {
-            history.push({ "role": role, "parts": [{ "text": text }] });
-        }
-    });
-    return history;
-}
+// --- Conversation session (the server keeps the history) ---
+let sessionId = null;
 
 // --- Core Send Function ---
 function sendMessage() {
@@ -101,26 +88,33 @@ function sendMessage() {
     const userMessageText = userInput.value.trim();
     if (userMessageText === '') return;
 
-    // Get history *before* adding the new message
-    const chatHistory = getChatHistory();
-
     appendMessage(userMessageText, 'user');
     userInput.value = '';
     showTypingIndicator();
 
-    // Send the new question AND the history
+    // Stream the answer (Server-Sent Events); fall back to /ask if streaming isn't available
+    const body = JSON.stringify({
+        'question': userMessageText,
+        'session_id': sessionId  // null starts a new conversation
+    });
+    streamAnswer(body, userMessageText).catch((error) => {
+        console.warn('Streaming failed, falling back to /ask:', error);
+        askOnce(body, userMessageText);
+    });
+}
+
+// --- Non-streaming request (fallback) ---
+function askOnce(body, userMessageText) {
     fetch('/ask', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-            'question': userMessageText,
-            'history': chatHistory  // Send the history
-        }),
+        body: body,
     })
         .then(response => response.json())
         .then(data => {
             hideTypingIndicator();
-            appendMessage(data.answer, 'bot', userMessageText);
+            if (data.session_id) sessionId = data.session_id;
+            appendMessage(data.answer, 'bot', userMessageText, data.sources);
         })
         .catch((error) => {
             console.error('Error:', error);
@@ -129,49 +123,141 @@ function sendMessage() {
         });
 }
 
+// --- Streaming request: render tokens as they arrive ---
+async function streamAnswer(body, userMessageText) {
+    const response = await fetch('/ask_stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: body,
+    });
+    if (!response.ok || !response.body) throw new Error(`HTTP ${response.status}`);
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let answer = '';
+    let sources = [];
+    let bubble = null;
+
+    try {
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // SSE events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let eventName = 'message';
+                let data = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                });
+                if (!data) continue;
+                const payload = JSON.parse(data);
+
+                if (eventName === 'done' || eventName === 'incomplete') {
+                    answer = payload.answer;
+                    if (eventName === 'incomplete') answer += '\n\n*(the answer was cut short; please ask again)*';
+                    sources = payload.sources || [];
+                    if (payload.session_id) sessionId = payload.session_id;
+                } else {
+                    answer += payload.text;
+                    if (!bubble) {
+                        hideTypingIndicator();
+                        bubble = createBotMessage();
+                    }
+                    bubble.content.innerHTML = marked.parse(answer);
+                    chatBox.scrollTop = chatBox.scrollHeight;
+                }
+            }
+        }
+    } catch (error) {
+        // Nothing shown yet: let the caller retry with /ask. Otherwise keep the partial answer.
+        if (!bubble) throw error;
+        console.error('Stream interrupted:', error);
+        answer += '\n\n*(connection lost, answer may be incomplete)*';
+    }
+
+    hideTypingIndicator();
+    if (!bubble) bubble = createBotMessage();
+    bubble.content.innerHTML = marked.parse(answer);
+    finalizeBotMessage(bubble.div, answer, userMessageText, sources);
+}
+
 // --- appendMessage function (with MathJax) ---
-function appendMessage(message, sender, originalQuestion = null) {
+function appendMessage(message, sender, originalQuestion = null, sources = []) {
+    if (sender === 'bot') {
+        const bubble = createBotMessage();
+        // Render Markdown
+        bubble.content.innerHTML = marked.parse(message);
+        finalizeBotMessage(bubble.div, message, originalQuestion, sources);
+        return;
+    }
+
     const messageDiv = document.createElement('div');
     messageDiv.classList.add('message', `${sender}-message`);
-    messageDiv.dataset.role = (sender === 'user') ? 'user' : 'model';
+    messageDiv.dataset.role = 'user';
 
     const messageP = document.createElement('div'); // Changed to div for HTML content
-    // Render Markdown
-    if (sender === 'bot') {
-        messageP.innerHTML = marked.parse(message);
-    } else {
-        messageP.textContent = message;
-    }
+    messageP.textContent = message;
     messageDiv.appendChild(messageP);
+    chatBox.appendChild(messageDiv);
+    chatBox.scrollTop = chatBox.scrollHeight;
+}
 
+// --- Empty bot bubble, filled in while the answer streams ---
+function createBotMessage() {
+    const messageDiv = document.createElement('div');
+    messageDiv.classList.add('message', 'bot-message');
+    messageDiv.dataset.role = 'model';
+
+    const messageP = document.createElement('div'); // Changed to div for HTML content
+    messageDiv.appendChild(messageP);
+    chatBox.appendChild(messageDiv);
+    chatBox.scrollTop = chatBox.scrollHeight;
+    return { div: messageDiv, content: messageP };
+}
+
+// --- Highlighting, speak/feedback buttons and MathJax once the answer is complete ---
+function finalizeBotMessage(messageDiv, message, originalQuestion = null, sources = []) {
     // Highlight Code Blocks
-    if (sender === 'bot') {
-        messageDiv.querySelectorAll('pre code').forEach((block) => {
-            hljs.highlightElement(block);
-        });
+    messageDiv.querySelectorAll('pre code').forEach((block) => {
+        hljs.highlightElement(block);
+    });
+
+    // Cited files/pages
+    if (sources && sources.length) {
+        const sourcesDiv = document.createElement('div');
+        sourcesDiv.classList.add('sources');
+        sourcesDiv.textContent = 'Sources: ' + sources
+            .map(source => source.page ? `${source.file} (p. ${source.page})` : source.file)
+            .join(', ');
+        messageDiv.appendChild(sourcesDiv);
     }
 
-    if (sender === 'bot') {
-        messageDiv.innerHTML += createSpeakButton(message);
-        if (originalQuestion && !message.startsWith("I'm sorry") && !message.startsWith("ERROR:")) {
-            const feedbackDiv = document.createElement('div');
-            feedbackDiv.classList.add('feedback-container');
-            const thumbUpBtn = createFeedbackButton('👍', () => {
-                sendFeedback(originalQuestion, message, 'up');
-                thumbUpBtn.disabled = true;
-                thumbDownBtn.disabled = true;
-            });
-            const thumbDownBtn = createFeedbackButton('👎', () => {
-                sendFeedback(originalQuestion, message, 'down');
-                thumbUpBtn.disabled = true;
-                thumbDownBtn.disabled = true;
-            });
-            feedbackDiv.appendChild(thumbUpBtn);
-            feedbackDiv.appendChild(thumbDownBtn);
-            messageDiv.appendChild(feedbackDiv);
-        }
+    messageDiv.innerHTML += createSpeakButton(message);
+    if (originalQuestion && !message.startsWith("I'm sorry") && !message.startsWith("ERROR:")) {
+        const feedbackDiv = document.createElement('div');
+        feedbackDiv.classList.add('feedback-container');
+        const thumbUpBtn = createFeedbackButton('👍', () => {
+            sendFeedback(originalQuestion, message, 'up');
+            thumbUpBtn.disabled = true;
+            thumbDownBtn.disabled = true;
+        });
+        const thumbDownBtn = createFeedbackButton('👎', () => {
+            sendFeedback(originalQuestion, message, 'down');
+            thumbUpBtn.disabled = true;
+            thumbDownBtn.disabled = true;
+        });
+        feedbackDiv.appendChild(thumbUpBtn);
+        feedbackDiv.appendChild(thumbDownBtn);
+        messageDiv.appendChild(feedbackDiv);
     }
-    chatBox.appendChild(messageDiv);
 
     // --- IMPORTANT: Tell MathJax to render the new message ---
     if (window.MathJax) {
@@ -0,0 +1,126 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+
+KEY_BYTES = 32  # SHA-256 digest
+
+def content_key(text):
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+class VectorStore:
+    """
+    Append-only store of float32 vectors keyed by content hash.
+
+    Three files share a base path:
+      <base>.f32        vector rows, memory-mapped for reads (no unpickling)
+      <base>.keys       one 32-byte key per row, in row order
+      <base>.meta.json  dimension
+
+    Appends write only the new rows, then their keys, each fsync'd, so a
+    crash can at worst leave a torn tail that the next open truncates away.
+    """
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.rows_path = base_path + '.f32'
+        self.keys_path = base_path + '.keys'
+        self.meta_path = base_path + '.meta.json'
+        self.dim = None
+        self._rows = {}        # key -> row number
+        self._matrix = None    # np.memmap over the rows file
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.dim = json.load(f)['dim']
+        if self.dim is None:
+            return
+        row_bytes = self.dim * 4
+        n_rows = os.path.getsize(self.rows_path) // row_bytes if os.path.exists(self.rows_path) else 0
+        n_keys = os.path.getsize(self.keys_path) // KEY_BYTES if os.path.exists(self.keys_path) else 0
+        count = min(n_rows, n_keys)
+        # Drop any half-written tail left by a crash
+        for path, size in ((self.rows_path, count * row_bytes), (self.keys_path, count * KEY_BYTES)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+        if count == 0:
+            return  # Also a crash between writing the meta file and the first append
+        with open(self.keys_path, 'rb') as f:
+            data = f.read()
+        self._rows = {data[i * KEY_BYTES:(i + 1) * KEY_BYTES]: i for i in range(count)}
+        self._remap()
+
+    def _remap(self):
+        count = len(self._rows)
+        self._matrix = np.memmap(self.rows_path, dtype='float32', mode='r', shape=(count, self.dim)) if count else None
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def get(self, key):
+        row = self._rows.get(key)
+        return None if row is None else np.array(self._matrix[row])
+
+    def get_many(self, keys):
+        """
+        Returns {key: vector} for the keys that are present.
+        """
+        found = [(key, self._rows[key]) for key in keys if key in self._rows]
+        if not found:
+            return {}
+        vectors = self._matrix[[row for _, row in found]]
+        return {key: vectors[i] for i, (key, _) in enumerate(found)}
+
+    def append(self, keys, vectors):
+        """
+        Appends vectors for keys not already stored. Returns how many were written.
+        """
+        vectors = np.asarray(vectors, dtype='float32')
+        with self._lock:
+            new = {}  # key -> index into vectors (first one wins for repeated keys)
+            for i, key in enumerate(keys):
+                if key not in self._rows and key not in new:
+                    new[key] = i
+            new = list(new.items())
+            if not new:
+                return 0
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                tmp_path = self.meta_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'dim': self.dim}, f)
+                os.replace(tmp_path, self.meta_path)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Vector dimension {vectors.shape[1]} does not match store dimension {self.dim}")
+
+            rows = np.ascontiguousarray(vectors[[i for _, i in new]])
+            for path, data in ((self.rows_path, rows.tobytes()), (self.keys_path, b''.join(k for k, _ in new))):
+                with open(path, 'ab') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            start = len(self._rows)
+            for offset, (key, _) in enumerate(new):
+                self._rows[key] = start + offset
+            self._remap()
+            return len(new)
+
+    def import_pickle_cache(self, pickle_path):
+        """
+        One-off migration from the old {chunk_text: [floats]} pickle cache.
+        """
+        import pickle
+        with open(pickle_path, 'rb') as f:
+            cache = pickle.load(f)
+        if not cache:
+            return 0
+        keys = [content_key(text) for text in cache]
+        return self.append(keys, np.array(list(cache.values()), dtype='float32'))